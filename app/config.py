@@ -9,6 +9,8 @@ class Settings:
     # Reddit API settings
     REDDIT_CLIENT_ID = os.getenv("REDDIT_CLIENT_ID")
     REDDIT_CLIENT_SECRET = os.getenv("REDDIT_CLIENT_SECRET")
+    # Scraping engine: "praw" (PRAW objects) or "json" (raw JSON listings)
+    REDDIT_ENGINE = os.getenv("REDDIT_ENGINE", "praw")
 
     # LinkedIn settings
     LINKEDIN_EMAIL = os.getenv("LINKEDIN_EMAIL")
@@ -18,12 +20,153 @@ class Settings:
     MINIO_ACCESS_KEY = os.getenv("MINIO_ACCESS_KEY")
     MINIO_SECRET_KEY = os.getenv("MINIO_SECRET_KEY")
     MINIO_BUCKET = os.getenv("MINIO_BUCKET")
+    # Part size for multipart uploads (at least 5 MiB)
+    MINIO_PART_SIZE = int(os.getenv("MINIO_PART_SIZE", str(10 * 1024 * 1024)))
+    # Files from this size are uploaded as resumable multipart uploads
+    MINIO_MULTIPART_THRESHOLD = int(
+        os.getenv("MINIO_MULTIPART_THRESHOLD", str(64 * 1024 * 1024))
+    )
+    # Parts of a multipart upload sent concurrently
+    MINIO_UPLOAD_CONCURRENCY = int(os.getenv("MINIO_UPLOAD_CONCURRENCY", "4"))
+
+    # Bulk uploads: concurrent uploads, and retries of a failed upload
+    STORAGE_UPLOAD_WORKERS = int(os.getenv("STORAGE_UPLOAD_WORKERS", "8"))
+    STORAGE_UPLOAD_RETRIES = int(os.getenv("STORAGE_UPLOAD_RETRIES", "2"))
+    STORAGE_UPLOAD_RETRY_DELAY = float(os.getenv("STORAGE_UPLOAD_RETRY_DELAY", "0.5"))
+    # Codec of JSON documents: "<serializer>[+<compression>]" with serializer
+    # "json", "orjson" or "msgpack" and compression "gzip" or "zstd"
+    STORAGE_CODEC = os.getenv("STORAGE_CODEC", "json")
+    # Codecs by path prefix, e.g. "bronze/crawler/metadata/=orjson+zstd"
+    # (comma-separated, the longest matching prefix wins)
+    STORAGE_CODEC_RULES = os.getenv("STORAGE_CODEC_RULES", "")
+
+    # Tiered storage: writes commit to a local spool that is replicated to
+    # the TIERED_REMOTE storage in the background
+    TIERED_SPOOL_DIR = os.getenv("TIERED_SPOOL_DIR", "spool")
+    TIERED_REMOTE = os.getenv("TIERED_REMOTE", "minio")
+    # Seconds between background drains of the spool (0 to only replicate
+    # through the replicate_spool task)
+    TIERED_REPLICATION_INTERVAL = float(os.getenv("TIERED_REPLICATION_INTERVAL", "5"))
+    TIERED_REPLICATION_BATCH = int(os.getenv("TIERED_REPLICATION_BATCH", "100"))
+    # Longest delay between attempts to replicate an object, in seconds
+    TIERED_RETRY_MAX_DELAY = float(os.getenv("TIERED_RETRY_MAX_DELAY", "300"))
+    # Seconds replicated files stay in the spool (0 to keep them)
+    TIERED_SPOOL_RETENTION = float(os.getenv("TIERED_SPOOL_RETENTION", "3600"))
+
+    # Run manifests: each crawl run lists the objects it wrote in a manifest,
+    # committed with a _SUCCESS marker once every author's crawl completed
+    RUN_MANIFESTS = os.getenv("RUN_MANIFESTS", "true").lower() == "true"
+    # Seconds between checks for the completion of a run, and checks before
+    # an incomplete run is finalized without _SUCCESS
+    RUN_MANIFEST_POLL_INTERVAL = float(os.getenv("RUN_MANIFEST_POLL_INTERVAL", "60"))
+    RUN_MANIFEST_MAX_POLLS = int(os.getenv("RUN_MANIFEST_MAX_POLLS", "120"))
+
+    # Partitions of the crawled datasets, filled from the platform and the
+    # run: {platform}, {dt} (YYYY-MM-DD), {hour} (HH) and {run} (processing
+    # timestamp). "platform={platform}/dt={dt}/hour={hour}" gives Hive-style
+    # partitions, the default keeps the original layout
+    KEY_PARTITION_SCHEME = os.getenv("KEY_PARTITION_SCHEME", "{run}/{platform}")
+    KEY_PARQUET_PARTITION_SCHEME = os.getenv(
+        "KEY_PARQUET_PARTITION_SCHEME", "platform={platform}/crawl_date={dt}"
+    )
+
+    # Skip writing posts and author profiles whose content hash matches the
+    # one stored by an earlier crawl
+    SKIP_UNCHANGED_WRITES = os.getenv("SKIP_UNCHANGED_WRITES", "true").lower() == "true"
+
+    # Post output: "json" writes one object per post, "ndjson" batches posts
+    # into gzipped JSON Lines files, "parquet" into Parquet files
+    POST_SINK = os.getenv("POST_SINK", "json")
+    # Posts uploaded together by the "json" sink; by default each post is
+    # uploaded as it arrives, larger batches save round trips but wait in
+    # memory until they are full, older than POST_SINK_MAX_AGE or the crawl ends
+    POST_SINK_JSON_BATCH = int(os.getenv("POST_SINK_JSON_BATCH", "1"))
+    # A batch is flushed at this many posts, uncompressed bytes or seconds
+    POST_SINK_MAX_RECORDS = int(os.getenv("POST_SINK_MAX_RECORDS", "1000"))
+    POST_SINK_MAX_BYTES = int(os.getenv("POST_SINK_MAX_BYTES", str(16 * 1024 * 1024)))
+    POST_SINK_MAX_AGE = float(os.getenv("POST_SINK_MAX_AGE", "60"))
+
+    # Parquet output (POST_SINK=parquet): files are partitioned by platform and
+    # crawl date and flushed at these thresholds, or when an author's crawl
+    # ends; compact a partition to merge the small files of its author tasks
+    PARQUET_MAX_RECORDS = int(os.getenv("PARQUET_MAX_RECORDS", "500000"))
+    PARQUET_MAX_BYTES = int(os.getenv("PARQUET_MAX_BYTES", str(128 * 1024 * 1024)))
+    PARQUET_MAX_AGE = float(os.getenv("PARQUET_MAX_AGE", "600"))
+    PARQUET_ROW_GROUP_SIZE = int(os.getenv("PARQUET_ROW_GROUP_SIZE", "100000"))
+    PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+    # Compaction: per-post JSON objects are merged into gzipped JSON Lines
+    # files of at most these sizes, and the originals moved under ARCHIVE_PREFIX
+    COMPACTION_TARGET_BYTES = int(
+        os.getenv("COMPACTION_TARGET_BYTES", str(128 * 1024 * 1024))
+    )
+    COMPACTION_MAX_RECORDS = int(os.getenv("COMPACTION_MAX_RECORDS", "50000"))
+    ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archive")
 
     # Celery settings
     RABBITMQ_HOST = os.getenv("RABBITMQ_HOST")
     CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL")
     CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND")
 
+    # Rate limiting settings
+    # Remaining API requests in the window at which to wait for the reset
+    RATE_LIMIT_MIN_REMAINING = int(os.getenv("RATE_LIMIT_MIN_REMAINING", "5"))
+    # Minimum seconds between media downloads
+    MEDIA_MIN_INTERVAL = float(os.getenv("MEDIA_MIN_INTERVAL", "0.2"))
+
+    # Media download settings
+    MEDIA_DOWNLOAD_WORKERS = int(os.getenv("MEDIA_DOWNLOAD_WORKERS", "8"))
+    MEDIA_PER_HOST_CONCURRENCY = int(os.getenv("MEDIA_PER_HOST_CONCURRENCY", "4"))
+    # Maximum size of a media file in bytes (0 for no limit)
+    MEDIA_MAX_BYTES = int(os.getenv("MEDIA_MAX_BYTES", str(500 * 1024 * 1024)))
+    # Content-Type prefixes of media worth downloading (empty for any)
+    MEDIA_ALLOWED_CONTENT_TYPES = [
+        prefix.strip()
+        for prefix in os.getenv(
+            "MEDIA_ALLOWED_CONTENT_TYPES",
+            "image/,video/,audio/,application/octet-stream",
+        ).split(",")
+        if prefix.strip()
+    ]
+    # Retries of an interrupted download, which resume where it stopped
+    MEDIA_DOWNLOAD_RETRIES = int(os.getenv("MEDIA_DOWNLOAD_RETRIES", "3"))
+    # Images are fetched at the smallest preview variant at least this wide
+    # (0 for full resolution)
+    MEDIA_MAX_IMAGE_WIDTH = int(os.getenv("MEDIA_MAX_IMAGE_WIDTH", "1080"))
+    # Videos longer (seconds) or with a higher bitrate (kbps) are skipped (0 for no limit)
+    MEDIA_MAX_VIDEO_DURATION = float(os.getenv("MEDIA_MAX_VIDEO_DURATION", "0"))
+    MEDIA_MAX_VIDEO_BITRATE = float(os.getenv("MEDIA_MAX_VIDEO_BITRATE", "0"))
+    # Disk quota for downloaded media, above which uploaded files are evicted
+    MEDIA_SPOOL_QUOTA_BYTES = int(
+        os.getenv("MEDIA_SPOOL_QUOTA_BYTES", str(512 * 1024 * 1024))
+    )
+    # Seconds after which abandoned partial downloads are removed
+    MEDIA_SPOOL_PART_TTL = float(os.getenv("MEDIA_SPOOL_PART_TTL", "86400"))
+    # Seconds after which the pin of an upload that never released it expires
+    MEDIA_SPOOL_PIN_TTL = float(os.getenv("MEDIA_SPOOL_PIN_TTL", "3600"))
+    # Seconds after which downloaded media that was never uploaded is evictable
+    MEDIA_SPOOL_UNUPLOADED_TTL = float(os.getenv("MEDIA_SPOOL_UNUPLOADED_TTL", "86400"))
+    # Media upload mode: "spool" downloads to local disk before uploading,
+    # "stream" pipes downloads straight into storage
+    MEDIA_UPLOAD_MODE = os.getenv("MEDIA_UPLOAD_MODE", "spool")
+
+    # Throttling mode: "sleep" waits in the worker, "defer" reschedules the
+    # task when it would have to wait at least THROTTLE_DEFER_MIN_DELAY seconds
+    # for a rate limit (retry backoffs after errors always sleep)
+    THROTTLE_MODE = os.getenv("THROTTLE_MODE", "sleep")
+    THROTTLE_DEFER_MIN_DELAY = float(os.getenv("THROTTLE_DEFER_MIN_DELAY", "10"))
+
+    # Request budget shared by all workers using the same credential and host
+    # Backend: "memory" (per process), "sqlite" (per host) or "redis" (cluster)
+    REQUEST_BUDGET_BACKEND = os.getenv("REQUEST_BUDGET_BACKEND", "memory")
+    # Sustained requests per second (Reddit allows 100 per minute per client)
+    REQUEST_BUDGET_RATE = float(os.getenv("REQUEST_BUDGET_RATE", "1.5"))
+    REQUEST_BUDGET_BURST = float(os.getenv("REQUEST_BUDGET_BURST", "10"))
+    REQUEST_BUDGET_SQLITE_PATH = os.getenv(
+        "REQUEST_BUDGET_SQLITE_PATH", "local_storage/request_budget.sqlite"
+    )
+    REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
     # User agent settings
     USER_AGENTS_FILE = os.getenv("USER_AGENTS_FILE")
 
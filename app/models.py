@@ -12,6 +12,7 @@ class Author(BaseModel):
 
 
 class Post(BaseModel):
+    id: Optional[str] = None
     author_id: str
     text: str
     timestamp: str
@@ -20,3 +21,4 @@ class Post(BaseModel):
     comments: int
     media_urls: List[str]
     media_local_paths: List[str]
+    media_object_names: List[str] = []
@@ -1,21 +1,48 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Any, Callable, Dict, Iterator, List, Optional
 from datetime import datetime
 import requests
+from app.config import settings
 from app.models import Author, Post
 from app.core.logger import logger
 from app.utils.user_agents import user_agent_manager
 from app.utils.media_downloader import media_downloader
 from app.utils.error_handler import handle_http_error, ScraperException
+from app.utils.throttling import api_rate_limiter
+from app.utils.token_bucket import request_budget
 import urllib.request
+from urllib.parse import urlparse
 
 
 class BaseScraper(ABC):
     """Base class for all scrapers"""
 
+    rate_limiter = api_rate_limiter
+    request_budget = request_budget
+
     def __init__(self):
         """Initialize the scraper with common attributes"""
         self.session = requests.Session()
+        # Identifies the account whose request budget this scraper spends
+        self.credential = "anonymous"
+        # Media is downloaded to local disk, unless the caller streams it to storage
+        self.spool_media = settings.MEDIA_UPLOAD_MODE != "stream"
+        # Storage the caller uploads media to, known media stored there isn't downloaded again
+        self.media_storage = None
+
+    def _throttle(self, host):
+        """
+        Wait until a request to a host is allowed
+
+        Takes a token from the request budget shared by every worker using
+        the same credential and host, then waits for the rate limit window
+        advertised by the server if it is nearly used up.
+
+        Args:
+            host (str): Host the request is sent to
+        """
+        self.request_budget.acquire(f"{self.credential}:{host}")
+        self.rate_limiter.wait()
 
     def _get_headers(self):
         """Get headers with a random user agent"""
@@ -44,7 +71,8 @@ class BaseScraper(ABC):
             request_headers.update(headers)
 
         proxies = urllib.request.getproxies()
-        # Make the request
+        # Wait for the rate limit budget and make the request
+        self._throttle(urlparse(url).netloc)
         try:
             response = self.session.request(
                 method=method,
@@ -56,9 +84,12 @@ class BaseScraper(ABC):
                 proxies=proxies,
                 timeout=30,
             )
+            self.rate_limiter.update_from_headers(response.headers)
 
             # Check for HTTP errors
             if response.status_code != 200:
+                if response.status_code == 429:
+                    self._handle_rate_limited(response)
                 handle_http_error(response.status_code, response.text)
 
             return response
@@ -67,6 +98,20 @@ class BaseScraper(ABC):
             logger.error(f"Request error for {url}: {e}")
             raise ScraperException(f"Request failed: {e}")
 
+    def _handle_rate_limited(self, response):
+        """
+        Exhaust the rate limit budget after a 429 response
+
+        Args:
+            response (requests.Response): Rate limited response
+        """
+        retry_after = response.headers.get("Retry-After")
+        try:
+            reset = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            reset = None
+        self.rate_limiter.update(remaining=0, reset=reset)
+
     def _parse_date(self, date_str):
         """
         Parse a date string in YYYY-MM-DD format to datetime
@@ -93,7 +138,7 @@ class BaseScraper(ABC):
         Returns:
             list: List of local file paths
         """
-        return media_downloader.download_multiple(urls)
+        return media_downloader.download_multiple(urls, self.media_storage)
 
     @abstractmethod
     def fetch_author(self, author_id: str) -> Author:
@@ -108,7 +153,13 @@ class BaseScraper(ABC):
         """
 
     @abstractmethod
-    def fetch_posts(self, author_id: str, since: str, until: str) -> List[Post]:
+    def fetch_posts(
+        self,
+        author_id: str,
+        since: str,
+        until: str,
+        watermark: Optional[Dict[str, Any]] = None,
+    ) -> List[Post]:
         """
         Fetch posts by an author within a date range
 
@@ -116,7 +167,50 @@ class BaseScraper(ABC):
             author_id (str): ID of the author
             since (str): Start date in YYYY-MM-DD format
             until (str): End date in YYYY-MM-DD format
+            watermark (dict, optional): Newest post of a previous crawl
+                ('fullname' and 'created_utc'); only newer posts are fetched
 
         Returns:
             List[Post]: List of Post objects
         """
+
+    def iter_posts(
+        self,
+        author_id: str,
+        since: str,
+        until: str,
+        after: Optional[str] = None,
+        watermark: Optional[Dict[str, Any]] = None,
+        on_dropped: Optional[Callable[[Dict[str, Any]], None]] = None,
+        skip_media: Optional[Callable[[Post], bool]] = None,
+    ) -> Iterator[Post]:
+        """
+        Iterate over posts by an author within a date range
+
+        Scrapers that can page through their source incrementally should
+        override this to yield each post as soon as it is processed. The
+        default implementation falls back to fetch_posts.
+
+        Args:
+            author_id (str): ID of the author
+            since (str): Start date in YYYY-MM-DD format
+            until (str): End date in YYYY-MM-DD format
+            after (str, optional): ID of the last post already processed;
+                iteration resumes right after it
+            watermark (dict, optional): Newest post of a previous crawl
+                ('fullname' and 'created_utc'); only newer posts are yielded
+            on_dropped (callable, optional): Called with the raw data of each
+                post that failed to process and was not yielded
+            skip_media (callable, optional): Called with each post before its
+                media is downloaded; posts it returns True for are yielded
+                without their media. The default implementation ignores it
+
+        Yields:
+            Post: Post objects
+        """
+        posts = self.fetch_posts(author_id, since, until, watermark=watermark)
+        if after:
+            ids = [post.id for post in posts]
+            if after in ids:
+                posts = posts[ids.index(after) + 1 :]
+        yield from posts
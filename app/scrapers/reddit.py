@@ -1,18 +1,23 @@
+import time
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from urllib.parse import urlparse
 
 import praw
+import prawcore
 import requests
 
 from app.config import settings
 from app.core.logger import logger
 from app.models import Author, Post
 from app.utils.error_handler import (
+    ParsingException,
     RateLimitException,
     ScraperException,
     retry_with_backoff,
 )
-from app.utils.throttling import wait_random_delay
+from app.utils.media_policy import media_policy
+from app.utils.throttling import ThrottleDeferred
 from app.utils.user_agents import user_agent_manager
 
 from .base import BaseScraper
@@ -21,11 +26,28 @@ from .base import BaseScraper
 class RedditScraper(BaseScraper):
     """
     Reddit scraper using PRAW (Python Reddit API Wrapper)
+
+    Two engines are available: "praw" goes through PRAW objects, while
+    "json" reads Reddit's public JSON listings directly and parses them into
+    models without building PRAW objects.
     """
 
     REDDIT_API_BASE = "https://www.reddit.com"
-
-    def __init__(self, client_id=None, client_secret=None, user_agent=None):
+    # Host PRAW sends its API requests to
+    PRAW_API_HOST = "oauth.reddit.com"
+    ENGINES = ("praw", "json")
+    LISTING_PAGE_SIZE = 100
+
+    media_policy = media_policy
+
+    def __init__(
+        self,
+        client_id=None,
+        client_secret=None,
+        user_agent=None,
+        engine=None,
+        api_base=None,
+    ):
         """
         Initialize the Reddit scraper
 
@@ -33,9 +55,16 @@ class RedditScraper(BaseScraper):
             client_id (str, optional): Reddit API client ID
             client_secret (str, optional): Reddit API client secret
             user_agent (str, optional): User agent for Reddit API
+            engine (str, optional): Scraping engine ('praw' or 'json')
+            api_base (str, optional): Base URL for the JSON engine
         """
         super().__init__()
 
+        self.engine = engine or settings.REDDIT_ENGINE
+        if self.engine not in self.ENGINES:
+            raise ValueError(f"Unsupported Reddit engine: {self.engine}")
+        self.api_base = (api_base or self.REDDIT_API_BASE).rstrip("/")
+
         # Use provided credentials, config settings, or defaults
         self.client_id = client_id or settings.REDDIT_CLIENT_ID or "YOUR_CLIENT_ID"
         self.client_secret = (
@@ -43,8 +72,15 @@ class RedditScraper(BaseScraper):
         )
         self.user_agent = user_agent or user_agent_manager.get_random_user_agent()
 
+        if self.engine == "json":
+            # The JSON engine talks to the public listings through _make_request
+            self.reddit = None
+            self.authenticated = False
+            logger.info(
+                f"Initialized Reddit scraper with JSON engine ({self.api_base})"
+            )
         # Initialize PRAW for authenticated API access if credentials are provided
-        if (
+        elif (
             self.client_id != "YOUR_CLIENT_ID"
             and self.client_secret != "YOUR_CLIENT_SECRET"
         ):
@@ -54,6 +90,7 @@ class RedditScraper(BaseScraper):
                 user_agent=self.user_agent,
             )
             self.authenticated = True
+            self.credential = self.client_id
             logger.info("Initialized Reddit scraper with API credentials")
         else:
             # Fall back to read-only mode without authentication
@@ -92,8 +129,11 @@ class RedditScraper(BaseScraper):
             Author: Author object with Reddit user information
         """
         logger.info(f"Fetching Reddit author: {author_id}")
-        wait_random_delay()
 
+        if self.engine == "json":
+            return self._fetch_author_json(author_id)
+
+        self._throttle(self.PRAW_API_HOST)
         try:
             # Get the Redditor object
             redditor = self.reddit.redditor(author_id)
@@ -101,6 +141,7 @@ class RedditScraper(BaseScraper):
             # Force loading of attributes by accessing a property
             # This will trigger an API call
             name = redditor.name
+            self._sync_praw_rate_limit()
 
             # Extract creation date
             created_utc = redditor.created_utc
@@ -129,6 +170,8 @@ class RedditScraper(BaseScraper):
             logger.info(f"Successfully fetched Reddit author: {author_id}")
             return author
 
+        except ThrottleDeferred:
+            raise
         except praw.exceptions.PRAWException as e:
             logger.error(f"PRAW error fetching Reddit user {author_id}: {e}")
             raise ScraperException(f"Failed to fetch Reddit user: {e}")
@@ -136,11 +179,50 @@ class RedditScraper(BaseScraper):
             logger.error(f"Error fetching Reddit user {author_id}: {e}")
             raise ScraperException(f"Failed to fetch Reddit user: {e}")
 
+    def _fetch_author_json(self, author_id: str) -> Author:
+        """
+        Fetch author information from the public about.json endpoint
+
+        Args:
+            author_id (str): Reddit username
+
+        Returns:
+            Author: Author object with Reddit user information
+        """
+        response = self._make_request(f"{self.api_base}/user/{author_id}/about.json")
+
+        try:
+            data = response.json()["data"]
+            created_utc = data.get("created_utc")
+            author = Author(
+                id=author_id,
+                name=data["name"],
+                created_at=(
+                    datetime.fromtimestamp(created_utc).isoformat()
+                    if created_utc
+                    else None
+                ),
+                followers_count=None,
+                following_count=None,  # Reddit doesn't provide this directly
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Unexpected about.json payload for {author_id}: {e}")
+            raise ParsingException(f"Failed to parse Reddit user: {e}")
+
+        logger.info(f"Successfully fetched Reddit author: {author_id}")
+        return author
+
     @retry_with_backoff(
         max_retries=3,
         exceptions=(ScraperException, RateLimitException, requests.RequestException),
     )
-    def fetch_posts(self, author_id: str, since: str, until: str) -> List[Post]:
+    def fetch_posts(
+        self,
+        author_id: str,
+        since: str,
+        until: str,
+        watermark: Optional[Dict[str, Any]] = None,
+    ) -> List[Post]:
         """
         Fetch posts by a Reddit user within a date range
 
@@ -148,10 +230,49 @@ class RedditScraper(BaseScraper):
             author_id (str): Reddit username
             since (str): Start date in YYYY-MM-DD format
             until (str): End date in YYYY-MM-DD format
+            watermark (dict, optional): Newest submission of a previous crawl
+                ('fullname' and 'created_utc'); only newer posts are fetched
 
         Returns:
             List[Post]: List of Post objects
         """
+        posts = list(self.iter_posts(author_id, since, until, watermark=watermark))
+        logger.info(f"Found {len(posts)} posts for {author_id}")
+        return posts
+
+    def iter_posts(
+        self,
+        author_id: str,
+        since: str,
+        until: str,
+        after: Optional[str] = None,
+        watermark: Optional[Dict[str, Any]] = None,
+        on_dropped: Optional[Callable[[Dict[str, Any]], None]] = None,
+        skip_media: Optional[Callable[[Post], bool]] = None,
+    ) -> Iterator[Post]:
+        """
+        Iterate over posts by a Reddit user within a date range
+
+        Posts are yielded one at a time, with their media downloaded, as the
+        submissions listing is paged through.
+
+        Args:
+            author_id (str): Reddit username
+            since (str): Start date in YYYY-MM-DD format
+            until (str): End date in YYYY-MM-DD format
+            after (str, optional): Fullname of the last submission already
+                processed; the listing resumes right after it
+            watermark (dict, optional): Newest submission of a previous crawl
+                ('fullname' and 'created_utc'); the listing stops there
+            on_dropped (callable, optional): Called with each submission that
+                failed to process and was not yielded
+            skip_media (callable, optional): Called with each post before its
+                media is downloaded; posts it returns True for are yielded
+                without downloading their media
+
+        Yields:
+            Post: Post objects
+        """
         logger.info(f"Fetching Reddit posts for {author_id} from {since} to {until}")
 
         # Parse date strings to datetime objects
@@ -159,44 +280,20 @@ class RedditScraper(BaseScraper):
         until_date = self._parse_date(until)
 
         try:
-            # Get the Redditor object
-            redditor = self.reddit.redditor(author_id)
-            logger.info(f"Redditor object for {redditor} fetched successfully")
-            # Get submissions (posts)
-            submissions = (
-                redditor.submissions.new()
-            )  # top(time_filter="all")  # Adjust limit as needed
-            print(f"Submissions: {submissions}")
-            posts = []
-            n = 0
-            for submission in submissions:
-                if n > 2:
-                    break
-                n += 1
-                logger.info(f"Processing submission: {submission.id}")
-                logger.info(f"Submission title: {submission.title}")
-                logger.info(f"Submission URL: {submission.url}")
-                logger.info(f"Submission created at: {submission.created_utc}")
-                # Add delay between processing posts to avoid rate limiting
-                wait_random_delay(base=5)  # Shorter delay for this
-
-                # Check if post is within date range
-                created_utc = submission.created_utc
-                post_date = datetime.fromtimestamp(created_utc)
-                logger.info(f"Post date: {post_date}")
-                logger.info(f"Since date: {since_date}, Until date: {until_date}")
-                # Check if the post date is within the specified range
-                if post_date < since_date or post_date > until_date:
-                    continue
+            for submission in self._iter_submissions(
+                author_id, since_date, until_date, after=after, watermark=watermark
+            ):
+                logger.info(f"Processing submission: {submission.get('id')}")
 
                 # Process the submission
-                post = self._process_submission(submission, author_id)
+                post = self._process_submission(submission, author_id, skip_media)
                 if post:
-                    posts.append(post)
-
-            logger.info(f"Found {len(posts)} posts for {author_id}")
-            return posts
+                    yield post
+                elif on_dropped:
+                    on_dropped(submission)
 
+        except ThrottleDeferred:
+            raise
         except praw.exceptions.PRAWException as e:
             logger.error(f"PRAW error fetching posts for {author_id}: {e}")
             raise ScraperException(f"Failed to fetch posts: {e}")
@@ -204,23 +301,243 @@ class RedditScraper(BaseScraper):
             logger.error(f"Error fetching posts for {author_id}: {e}")
             raise ScraperException(f"Failed to fetch posts: {e}")
 
-    def _process_submission(self, submission, author_id: str) -> Optional[Post]:
+    def _iter_submissions(
+        self,
+        author_id: str,
+        since_date: datetime,
+        until_date: datetime,
+        after: Optional[str] = None,
+        watermark: Optional[Dict[str, Any]] = None,
+    ):
         """
-        Process a submission from Reddit API
+        Iterate over a user's submissions within a date range
+
+        The listing is sorted newest first, so submissions newer than
+        ``until_date`` are skipped without further processing and the crawl
+        stops at the first submission older than ``since_date``, or at the
+        watermark left by a previous crawl. Pages are requested with the
+        maximum size Reddit allows (100 items).
 
         Args:
-            submission: PRAW Submission object
             author_id (str): Reddit username
+            since_date (datetime): Start of the date range
+            until_date (datetime): End of the date range
+            after (str, optional): Fullname of the submission to resume after
+            watermark (dict, optional): Newest submission of a previous crawl
+
+        Yields:
+            dict: Submission data within the date range
+        """
+        if self.engine == "json":
+            submissions = self._iter_listing_json(author_id, after=after)
+        else:
+            submissions = self._iter_listing_praw(author_id, after=after)
+
+        skipped = 0
+        for submission in submissions:
+            post_date = datetime.fromtimestamp(submission["created_utc"])
+
+            if post_date > until_date:
+                skipped += 1
+                continue
+
+            if post_date < since_date:
+                logger.info(
+                    f"Reached submissions older than {since_date} for {author_id}, stopping"
+                )
+                break
+
+            if watermark and (
+                submission.get("name") == watermark.get("fullname")
+                or submission["created_utc"] <= watermark.get("created_utc", 0)
+            ):
+                logger.info(
+                    f"Reached watermark {watermark.get('fullname')} for {author_id}, stopping"
+                )
+                break
+
+            yield submission
+
+        if skipped:
+            logger.info(f"Skipped {skipped} submissions newer than {until_date}")
+
+    def _iter_listing_praw(
+        self, author_id: str, after: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over a user's submissions listing through PRAW
+
+        Submissions are yielded as their attribute dictionaries so that
+        downstream code never touches a lazy PRAW attribute (which would
+        trigger an extra request for fields missing from the listing).
+        A failed page request is retried with backoff, resuming the listing
+        after the last submission yielded.
+
+        Args:
+            author_id (str): Reddit username
+            after (str, optional): Fullname of the submission to start after
+
+        Yields:
+            dict: Submission data, newest first
+        """
+        redditor = self.reddit.redditor(author_id)
+        cursor = {"after": after, "submissions": None, "count": 0}
+
+        @retry_with_backoff(
+            max_retries=3,
+            exceptions=(
+                praw.exceptions.PRAWException,
+                prawcore.exceptions.PrawcoreException,
+                requests.RequestException,
+            ),
+        )
+        def next_submission():
+            if cursor["submissions"] is None:
+                # limit=None lets PRAW follow the "after" cursor until the
+                # listing is exhausted; Reddit caps each page at 100 items.
+                params = {"after": cursor["after"]} if cursor["after"] else {}
+                cursor["submissions"] = redditor.submissions.new(
+                    limit=None, params=params
+                )
+                cursor["count"] = 0
+            # PRAW requests the next page when a page boundary is crossed
+            if cursor["count"] % self.LISTING_PAGE_SIZE == 0:
+                self._throttle(self.PRAW_API_HOST)
+            try:
+                submission = next(cursor["submissions"])
+            except StopIteration:
+                raise
+            except Exception:
+                # A listing whose page request failed can't go on, the retry
+                # starts a new one after the last submission yielded
+                cursor["submissions"] = None
+                raise
+            cursor["count"] += 1
+            return submission
+
+        while True:
+            try:
+                submission = next_submission()
+            except StopIteration:
+                return
+            cursor["after"] = f"t3_{submission.id}"
+
+            self._sync_praw_rate_limit()
+            yield vars(submission)
+
+    def _sync_praw_rate_limit(self):
+        """
+        Share the rate limit window seen by PRAW with the scraper's limiter
+
+        PRAW throttles its own requests from Reddit's rate limit headers;
+        copying its view keeps requests made outside PRAW within the same
+        budget.
+        """
+        try:
+            limits = self.reddit.auth.limits
+        except Exception:
+            return
+
+        remaining = limits.get("remaining")
+        used = limits.get("used")
+        reset_timestamp = limits.get("reset_timestamp")
+        if not isinstance(remaining, (int, float)):
+            return
+
+        self.rate_limiter.update(
+            remaining=remaining,
+            used=used if isinstance(used, int) else None,
+            reset=(
+                max(reset_timestamp - time.time(), 0)
+                if isinstance(reset_timestamp, (int, float))
+                else None
+            ),
+        )
+
+    def _iter_listing_json(
+        self, author_id: str, after: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over a user's submissions listing through the JSON endpoint
+
+        A failed page request is retried with backoff from the same cursor.
+
+        Args:
+            author_id (str): Reddit username
+            after (str, optional): Fullname of the submission to start after
+
+        Yields:
+            dict: Submission data, newest first
+        """
+        url = f"{self.api_base}/user/{author_id}/submitted.json"
+        params = {"limit": self.LISTING_PAGE_SIZE, "sort": "new", "raw_json": 1}
+        if after:
+            params["after"] = after
+
+        while True:
+            listing = self._fetch_listing_page(author_id, url, dict(params))
+            children = listing["children"]
+
+            for child in children:
+                yield child["data"]
+
+            after = listing.get("after")
+            if not children or not after or after == params.get("after"):
+                break
+            params["after"] = after
+
+    @retry_with_backoff(
+        max_retries=3,
+        exceptions=(ScraperException, RateLimitException, requests.RequestException),
+    )
+    def _fetch_listing_page(
+        self, author_id: str, url: str, params: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Fetch one page of a submissions listing from the JSON endpoint
+
+        Args:
+            author_id (str): Reddit username
+            url (str): URL of the listing
+            params (dict): Query parameters, including the "after" cursor
+
+        Returns:
+            dict: Listing data, with its 'children' and 'after' cursor
+        """
+        response = self._make_request(url, params=params)
+
+        try:
+            listing = response.json()["data"]
+            listing["children"]
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Unexpected listing payload for {author_id}: {e}")
+            raise ParsingException(f"Failed to parse Reddit listing: {e}")
+        return listing
+
+    def _process_submission(
+        self,
+        submission: Dict[str, Any],
+        author_id: str,
+        skip_media: Optional[Callable[[Post], bool]] = None,
+    ) -> Optional[Post]:
+        """
+        Process a submission from a Reddit listing
+
+        Args:
+            submission (dict): Submission data from a Reddit listing
+            author_id (str): Reddit username
+            skip_media (callable, optional): Called with the post before its
+                media is downloaded; True leaves the media undownloaded
 
         Returns:
             Optional[Post]: Post object or None if processing fails
         """
         try:
             # Extract text content
-            text = submission.selftext or submission.title
+            text = submission.get("selftext") or submission.get("title")
 
             # Convert timestamp
-            created_utc = submission.created_utc
+            created_utc = submission.get("created_utc")
             timestamp = (
                 datetime.fromtimestamp(created_utc).isoformat() if created_utc else None
             )
@@ -228,67 +545,128 @@ class RedditScraper(BaseScraper):
             # Extract media URLs
             media_urls = self._extract_media_urls(submission)
 
-            # Download media
-            media_local_paths = self._download_media(media_urls) if media_urls else []
-
             # Create Post object
             post = Post(
+                id=submission.get("name") or f"t3_{submission.get('id')}",
                 author_id=author_id,
                 text=text,
                 timestamp=timestamp,
-                likes=submission.score,
+                likes=submission.get("score") or 0,
                 reposts=0,  # Reddit doesn't have a direct "repost" concept
-                comments=submission.num_comments,
+                comments=submission.get("num_comments") or 0,
                 media_urls=media_urls,
-                media_local_paths=media_local_paths,
+                media_local_paths=[],
             )
 
+            # Download media, unless it is streamed to storage by the caller
+            # or the caller doesn't need it
+            if (
+                media_urls
+                and self.spool_media
+                and not (skip_media and skip_media(post))
+            ):
+                post.media_local_paths = self._download_media(media_urls)
+
             return post
 
+        except ThrottleDeferred:
+            raise
         except Exception as e:
             logger.error(
-                f"Error processing submission {getattr(submission, 'id', 'unknown')}: {e}"
+                f"Error processing submission {submission.get('id', 'unknown')}: {e}"
             )
             return None
 
-    def _extract_media_urls(self, submission) -> List[str]:
+    def _extract_media_urls(self, submission: Dict[str, Any]) -> List[str]:
         """
         Extract media URLs from a Reddit submission
 
+        URLs serving the same image are deduplicated, images are fetched at
+        the preview variant chosen by the media policy, and videos over its
+        caps are skipped.
+
         Args:
-            submission: PRAW Submission object
+            submission (dict): Submission data from a Reddit listing
 
         Returns:
             List[str]: List of media URLs
         """
         media_urls = []
+        policy = self.media_policy
 
         try:
+            # Resized variants of each image, keyed by image id
+            variants = {}
+
+            def choose_variant(candidates):
+                chosen = policy.select_variant(
+                    (policy.canonicalize(url), width)
+                    for url, width in candidates
+                    if url
+                )
+                if chosen:
+                    variants[policy.media_key(chosen)] = chosen
+                return chosen
+
+            # Preview images, with their resized variants
+            preview_urls = []
+            preview = submission.get("preview") or {}
+            for image in preview.get("images") or []:
+                source = image.get("source") or {}
+                chosen = choose_variant(
+                    [(source.get("url"), source.get("width"))]
+                    + [
+                        (r.get("url"), r.get("width"))
+                        for r in image.get("resolutions") or []
+                    ]
+                )
+                if chosen:
+                    preview_urls.append(chosen)
+
+            # Gallery items, with their resized variants
+            gallery_urls = []
+            if submission.get("is_gallery"):
+                media_metadata = submission.get("media_metadata") or {}
+                for item in media_metadata.values():
+                    source = item.get("s") or {}
+                    chosen = choose_variant(
+                        [(source.get("u"), source.get("x"))]
+                        + [(p.get("u"), p.get("x")) for p in item.get("p") or []]
+                    )
+                    if chosen:
+                        gallery_urls.append(chosen)
+
+            seen = set()
+
+            def add(url):
+                url = policy.canonicalize(url)
+                key = policy.media_key(url)
+                if key in seen:
+                    return
+                seen.add(key)
+                # Resized variants are stills, keep animated originals as they are
+                if not urlparse(url).path.lower().endswith(".gif"):
+                    url = variants.get(key, url)
+                media_urls.append(url)
+
             # Check for direct image/video URL
-            url = submission.url
+            url = submission.get("url")
             if url and self._is_media_url(url):
-                media_urls.append(url)
+                add(url)
 
-            # Check for gallery
-            if hasattr(submission, "is_gallery") and submission.is_gallery:
-                if hasattr(submission, "media_metadata"):
-                    for item_id in submission.media_metadata:
-                        item = submission.media_metadata[item_id]
-                        if "s" in item and "u" in item["s"]:
-                            media_urls.append(item["s"]["u"])
+            for gallery_url in gallery_urls:
+                add(gallery_url)
 
             # Check for media
-            if submission.media:
-                if "reddit_video" in submission.media:
-                    video_url = submission.media["reddit_video"].get("fallback_url")
-                    if video_url:
-                        media_urls.append(video_url)
-
-            # Check for preview images
-            if hasattr(submission, "preview") and "images" in submission.preview:
-                for image in submission.preview["images"]:
-                    if "source" in image and "url" in image["source"]:
-                        media_urls.append(image["source"]["url"])
+            media = submission.get("media")
+            if media and "reddit_video" in media:
+                video = media["reddit_video"]
+                video_url = video.get("fallback_url")
+                if video_url and policy.accept_video(video):
+                    add(video_url)
+
+            for preview_url in preview_urls:
+                add(preview_url)
 
         except Exception as e:
             logger.error(f"Error extracting media URLs: {e}")
@@ -0,0 +1,318 @@
+import gzip
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+from app.config import settings
+
+# Magic numbers of the compressed formats
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class Serializer(ABC):
+    """
+    Turns JSON-compatible data into bytes and back
+    """
+
+    name = ""
+    content_type = "application/octet-stream"
+
+    @abstractmethod
+    def dumps(self, data: Any) -> bytes:
+        """Serialize data to bytes"""
+
+    @abstractmethod
+    def loads(self, payload: bytes) -> Any:
+        """Deserialize bytes written by dumps()"""
+
+
+class JSONSerializer(Serializer):
+    """
+    UTF-8 JSON indented by two spaces with the standard library, as the
+    storages always wrote it
+    """
+
+    name = "json"
+    content_type = "application/json"
+
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8")
+
+    def loads(self, payload: bytes) -> Any:
+        return json.loads(payload)
+
+
+class ORJSONSerializer(Serializer):
+    """
+    Compact UTF-8 JSON with orjson, several times faster than the standard library
+    """
+
+    name = "orjson"
+    content_type = "application/json"
+
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise ImportError("The orjson package is required for the orjson codec")
+        self._orjson = orjson
+
+    def dumps(self, data: Any) -> bytes:
+        return self._orjson.dumps(data)
+
+    def loads(self, payload: bytes) -> Any:
+        return self._orjson.loads(payload)
+
+
+class MsgpackSerializer(Serializer):
+    """
+    Binary MessagePack, smaller than JSON and faster to parse
+    """
+
+    name = "msgpack"
+    content_type = "application/msgpack"
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("The msgpack package is required for the msgpack codec")
+        self._msgpack = msgpack
+
+    def dumps(self, data: Any) -> bytes:
+        return self._msgpack.packb(data, use_bin_type=True)
+
+    def loads(self, payload: bytes) -> Any:
+        return self._msgpack.unpackb(payload, raw=False)
+
+
+class Compression:
+    """
+    No compression
+    """
+
+    name = "none"
+    content_encoding: Optional[str] = None
+
+    def compress(self, payload: bytes) -> bytes:
+        return payload
+
+    def decompress(self, payload: bytes) -> bytes:
+        return payload
+
+
+class GzipCompression(Compression):
+    """
+    gzip compression, readable by any HTTP client
+    """
+
+    name = "gzip"
+    content_encoding = "gzip"
+
+    def __init__(self, level: int = 6):
+        self.level = level
+
+    def compress(self, payload: bytes) -> bytes:
+        return gzip.compress(payload, compresslevel=self.level)
+
+    def decompress(self, payload: bytes) -> bytes:
+        return gzip.decompress(payload)
+
+
+class ZstdCompression(Compression):
+    """
+    Zstandard compression, faster than gzip at a better ratio
+    """
+
+    name = "zstd"
+    content_encoding = "zstd"
+
+    def __init__(self, level: int = 3):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("The zstandard package is required for the zstd codec")
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._zstandard = zstandard
+
+    def compress(self, payload: bytes) -> bytes:
+        return self._compressor.compress(payload)
+
+    def decompress(self, payload: bytes) -> bytes:
+        # A new decompressor per call, since they are not thread-safe
+        return self._zstandard.ZstdDecompressor().decompressobj().decompress(payload)
+
+
+SERIALIZERS = {
+    "json": JSONSerializer,
+    "orjson": ORJSONSerializer,
+    "msgpack": MsgpackSerializer,
+}
+
+COMPRESSIONS = {
+    "none": Compression,
+    "gzip": GzipCompression,
+    "zstd": ZstdCompression,
+}
+
+
+class Codec:
+    """
+    A serializer followed by a compression
+    """
+
+    def __init__(self, serializer: Serializer, compression: Compression):
+        """
+        Initialize the codec
+
+        Args:
+            serializer (Serializer): Serializer of the data
+            compression (Compression): Compression of the serialized data
+        """
+        self.serializer = serializer
+        self.compression = compression
+
+    @property
+    def name(self) -> str:
+        if self.compression.content_encoding is None:
+            return self.serializer.name
+        return f"{self.serializer.name}+{self.compression.name}"
+
+    @property
+    def content_type(self) -> str:
+        return self.serializer.content_type
+
+    @property
+    def content_encoding(self) -> Optional[str]:
+        return self.compression.content_encoding
+
+    def encode(self, data: Any) -> bytes:
+        """
+        Serialize and compress data
+
+        Args:
+            data (Any): JSON-compatible data
+
+        Returns:
+            bytes: Encoded data
+        """
+        return self.compression.compress(self.serializer.dumps(data))
+
+
+_codecs: Dict[str, Codec] = {}
+
+
+def get_codec(spec: str) -> Codec:
+    """
+    Get a codec from its specification
+
+    Args:
+        spec (str): '<serializer>[+<compression>]', e.g. 'orjson+zstd'
+
+    Returns:
+        Codec: Codec instance, shared by every caller
+
+    Raises:
+        ValueError: If the serializer or compression is unknown
+    """
+    spec = spec.strip().lower()
+    codec = _codecs.get(spec)
+    if codec is None:
+        serializer_name, _, compression_name = spec.partition("+")
+        if serializer_name not in SERIALIZERS:
+            raise ValueError(f"Unsupported serializer: {serializer_name}")
+        if (compression_name or "none") not in COMPRESSIONS:
+            raise ValueError(f"Unsupported compression: {compression_name}")
+        codec = Codec(
+            SERIALIZERS[serializer_name](), COMPRESSIONS[compression_name or "none"]()
+        )
+        _codecs[spec] = codec
+    return codec
+
+
+def parse_codec_rules(rules: str) -> Dict[str, str]:
+    """
+    Parse per-prefix codec rules
+
+    Args:
+        rules (str): Comma-separated '<prefix>=<codec>' entries
+
+    Returns:
+        Dict[str, str]: Codec specifications by path prefix
+    """
+    parsed = {}
+    for rule in rules.split(","):
+        prefix, separator, spec = rule.partition("=")
+        if separator and spec.strip():
+            parsed[prefix.strip()] = spec.strip()
+    return parsed
+
+
+class CodecRules:
+    """
+    Chooses the codec of a path from the longest matching prefix rule
+    """
+
+    def __init__(self, default: str = "json", rules: Optional[Dict[str, str]] = None):
+        """
+        Initialize the rules
+
+        Args:
+            default (str): Codec of the paths matching no rule
+            rules (Dict[str, str], optional): Codec specifications by path prefix
+        """
+        self.default = default
+        # Longest prefixes first, so the most specific rule wins
+        self.rules = sorted(
+            (rules or {}).items(), key=lambda rule: len(rule[0]), reverse=True
+        )
+
+    def codec_for(self, path: str) -> Codec:
+        """
+        Get the codec of a path
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            Codec: Codec to write the path with
+        """
+        for prefix, spec in self.rules:
+            if path.startswith(prefix):
+                return get_codec(spec)
+        return get_codec(self.default)
+
+
+def decode(payload: bytes) -> Any:
+    """
+    Decode data written by any codec
+
+    The compression is detected from the magic number of the data, and the
+    serializer from its first byte: JSON documents start with '{' or '[',
+    MessagePack maps and arrays don't.
+
+    Args:
+        payload (bytes): Encoded data
+
+    Returns:
+        Any: Decoded data
+    """
+    if payload.startswith(GZIP_MAGIC):
+        payload = GzipCompression().decompress(payload)
+    elif payload.startswith(ZSTD_MAGIC):
+        payload = ZstdCompression().decompress(payload)
+
+    if payload.lstrip()[:1] in (b"{", b"["):
+        try:
+            return get_codec("orjson").serializer.loads(payload)
+        except ImportError:
+            return json.loads(payload)
+    return get_codec("msgpack").serializer.loads(payload)
+
+
+# Codec rules of the storage backends
+codec_rules = CodecRules(
+    default=settings.STORAGE_CODEC,
+    rules=parse_codec_rules(settings.STORAGE_CODEC_RULES),
+)
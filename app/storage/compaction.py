@@ -0,0 +1,400 @@
+import gzip
+import io
+import itertools
+import json
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Tuple
+
+from app.config import settings
+from app.core.logger import logger
+from app.storage.key_layout import COMPACTED_PREFIX, PARQUET_PREFIX, key_layout
+from app.storage.run_manifest import (
+    EXCLUDED_PREFIXES,
+    index_manifested_objects,
+    replace_objects,
+)
+from app.storage.storage_interface import StorageInterface
+
+MANIFEST_NAME = "_manifest.json"
+
+
+class Compactor:
+    """
+    Merges the small JSON objects under a prefix into gzipped JSON Lines files
+
+    Objects are read in batches and written one line per object to a local
+    temporary file, which goes up once it reaches ``target_bytes`` or
+    ``max_records``, so memory stays bounded whatever the prefix holds.
+
+    Each compacted part is committed in three steps:
+
+    1. The part is written and its line count checked against the objects
+       it was built from.
+    2. The manifest of the compacted prefix, listing its parts, is replaced
+       with a version that adds the part and its pending sources. It is
+       written to a staging key and moved into place, so readers see either
+       the old or the new manifest.
+    3. The run manifests listing the sources are rewritten to list the
+       part, then the sources are moved under ARCHIVE_PREFIX, and the
+       manifest is replaced again without them.
+
+    A run interrupted at any step can be re-run: it archives the sources of
+    committed parts, deletes parts that were never committed and compacts
+    what is left. Runs on the same prefix must not overlap.
+    """
+
+    READ_BATCH = 100
+    SOURCE_EXTENSION = ".json"
+    EXTENSION = ".json.gz"
+    CONTENT_TYPE = "application/x-ndjson"
+
+    def __init__(
+        self,
+        storage: StorageInterface,
+        prefix: str,
+        target_bytes: int = settings.COMPACTION_TARGET_BYTES,
+        max_records: int = settings.COMPACTION_MAX_RECORDS,
+    ):
+        """
+        Initialize the compactor
+
+        Args:
+            storage (StorageInterface): Storage with an iter_files() listing
+            prefix (str): Prefix of the objects to compact
+            target_bytes (int): Compressed size at which a part is closed
+            max_records (int): Objects merged into one part at most
+
+        Raises:
+            ValueError: If the storage cannot list objects
+        """
+        if not hasattr(storage, "iter_files"):
+            raise ValueError(
+                f"{type(storage).__name__} cannot list objects, compaction needs local or MinIO storage"
+            )
+        self.storage = storage
+        self.prefix = prefix.strip("/")
+        self.target_bytes = target_bytes
+        self.max_records = max_records
+        self.compacted_prefix = key_layout.compacted_prefix(self.prefix)
+        self.manifest_path = f"{self.compacted_prefix}/{MANIFEST_NAME}"
+        self._skipped = (
+            COMPACTED_PREFIX + "/",
+            key_layout.archive_key(""),
+            *EXCLUDED_PREFIXES,
+        )
+        # Run manifests listing each source, found on the first archiving
+        self._manifested = None
+
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            return self.storage.read_json(self.manifest_path)
+        except FileNotFoundError:
+            return {"prefix": self.prefix, "parts": []}
+
+    def _write_manifest(self, manifest: Dict[str, Any]):
+        """Replace the manifest through a staging key"""
+        parts = manifest["parts"]
+        manifest.update(
+            updated_at=datetime.now(timezone.utc).isoformat(),
+            part_count=len(parts),
+            record_count=sum(part["records"] for part in parts),
+            total_bytes=sum(part["size"] for part in parts),
+        )
+        staging_path = f"{self.manifest_path}.{uuid.uuid4().hex[:8]}.tmp"
+        self.storage.upload_json(manifest, staging_path)
+        self.storage.move(staging_path, self.manifest_path)
+
+    def _archive(self, manifest: Dict[str, Any], part: Dict[str, Any]) -> int:
+        """
+        Move the sources of a committed part under the archive prefix
+
+        Returns:
+            int: Number of sources moved
+        """
+        # Runs are pointed at the part first, so they never list missing keys
+        if self._manifested is None:
+            self._manifested = index_manifested_objects(self.storage, self.prefix)
+        manifest_paths = {
+            path
+            for source in part["sources"]
+            for path in self._manifested.get(source, ())
+        }
+        if manifest_paths:
+            replace_objects(
+                self.storage,
+                manifest_paths,
+                part["sources"],
+                {"path": part["path"], "size": part["size"]},
+            )
+
+        items = [(source, key_layout.archive_key(source)) for source in part["sources"]]
+        results = self.storage.move_many(items)
+        # Sources an interrupted run already moved are archived
+        failed = [
+            source
+            for (source, destination), result in zip(items, results)
+            if not result["ok"]
+            and (self.storage.exists(source) or not self.storage.exists(destination))
+        ]
+        if failed:
+            raise RuntimeError(
+                f"Failed to archive {len(failed)} sources of {part['path']}, re-run to retry"
+            )
+
+        del part["sources"]
+        self._write_manifest(manifest)
+        return len(items) - sum(1 for result in results if not result["ok"])
+
+    def _recover(self, manifest: Dict[str, Any]) -> int:
+        """
+        Finish the steps an interrupted run left undone
+
+        Returns:
+            int: Number of sources archived
+        """
+        archived = 0
+        for part in manifest["parts"]:
+            if "sources" in part:
+                logger.info(f"Archiving the sources of committed part {part['path']}")
+                archived += self._archive(manifest, part)
+
+        committed = {part["path"] for part in manifest["parts"]}
+        for key in self.storage.iter_files(self.compacted_prefix + "/"):
+            name = key[len(self.compacted_prefix) + 1 :]
+            # Parts of nested prefixes belong to their own manifests
+            if "/" in name or key == self.manifest_path or key in committed:
+                continue
+            logger.info(f"Deleting uncommitted object {key}")
+            self.storage.delete(key)
+        return archived
+
+    def _sources(self) -> Iterator[str]:
+        """Iterate over the objects to compact"""
+        for key in self.storage.iter_files(self.prefix + "/"):
+            if key.endswith(self.SOURCE_EXTENSION) and not key.startswith(
+                self._skipped
+            ):
+                yield key
+
+    def _write_part(
+        self, sources: Iterator[str], filepath: str
+    ) -> Tuple[List[str], int]:
+        """
+        Write the next objects to a gzipped JSON Lines file
+
+        Args:
+            sources (Iterator[str]): Keys of the objects left to compact
+            filepath (str): Local file to write
+
+        Returns:
+            Tuple[List[str], int]: Keys of the objects written, one per line,
+            and the number of records written
+        """
+        written = []
+        with open(filepath, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            while len(written) < self.max_records and raw.tell() < self.target_bytes:
+                batch = list(
+                    itertools.islice(
+                        sources, min(self.READ_BATCH, self.max_records - len(written))
+                    )
+                )
+                if not batch:
+                    break
+                documents = self.storage.read_json_many(batch)
+                for key in batch:
+                    # Objects removed since they were listed are left out
+                    if key not in documents:
+                        continue
+                    f.write(
+                        json.dumps(
+                            documents[key], ensure_ascii=False, separators=(",", ":")
+                        ).encode("utf-8")
+                        + b"\n"
+                    )
+                    written.append(key)
+        return written, len(written)
+
+    def _count_records(self, filepath: str) -> int:
+        """Count the records of a part, one per line"""
+        with gzip.open(filepath, "rb") as f:
+            return sum(1 for _ in f)
+
+    def _verify(self, filepath: str, records: int):
+        """Check that a part holds the records of the objects it was built from"""
+        count = self._count_records(filepath)
+        if count != records:
+            raise RuntimeError(
+                f"Compacted part holds {count} records instead of {records}, sources left in place"
+            )
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Compact the prefix
+
+        Returns:
+            Dict[str, Any]: Prefix, parts written, records compacted and
+            sources archived
+        """
+        manifest = self._load_manifest()
+        stats = {
+            "prefix": self.prefix,
+            "parts": 0,
+            "records": 0,
+            "archived": self._recover(manifest),
+        }
+
+        sources = self._sources()
+        fd, filepath = tempfile.mkstemp(suffix=self.EXTENSION)
+        os.close(fd)
+        try:
+            while True:
+                written, records = self._write_part(sources, filepath)
+                if not written:
+                    break
+                self._verify(filepath, records)
+
+                size = os.path.getsize(filepath)
+                path = (
+                    f"{self.compacted_prefix}/part-{int(time.time() * 1000)}-"
+                    f"{uuid.uuid4().hex[:8]}{self.EXTENSION}"
+                )
+                with open(filepath, "rb") as f:
+                    self.storage.upload_stream(
+                        f, path, length=size, content_type=self.CONTENT_TYPE
+                    )
+
+                part = {
+                    "path": path,
+                    "records": records,
+                    "size": size,
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "sources": written,
+                }
+                manifest["parts"].append(part)
+                self._write_manifest(manifest)
+                stats["archived"] += self._archive(manifest, part)
+                stats["parts"] += 1
+                stats["records"] += records
+                logger.info(
+                    f"Compacted {len(written)} objects of {self.prefix} into {path}"
+                )
+        finally:
+            os.remove(filepath)
+
+        logger.info(
+            f"Compaction of {self.prefix} wrote {stats['parts']} parts "
+            f"holding {stats['records']} records"
+        )
+        return stats
+
+
+class ParquetCompactor(Compactor):
+    """
+    Merges the small Parquet files under a prefix into larger Parquet files
+
+    Every author task flushes its own Parquet files, so a crawl run leaves
+    many small files in each partition. The rows of these files are merged
+    into parts of ``target_bytes`` of source data or ``max_records`` rows at
+    most, in row groups of PARQUET_ROW_GROUP_SIZE rows, which are committed
+    and archived as in Compactor. Requires the pyarrow package.
+    """
+
+    SOURCE_EXTENSION = ".parquet"
+    EXTENSION = ".parquet"
+    CONTENT_TYPE = "application/vnd.apache.parquet"
+
+    def _write_part(
+        self, sources: Iterator[str], filepath: str
+    ) -> Tuple[List[str], int]:
+        """
+        Write the rows of the next files to a Parquet file
+
+        Args:
+            sources (Iterator[str]): Keys of the files left to compact
+            filepath (str): Local file to write
+
+        Returns:
+            Tuple[List[str], int]: Keys of the files written and the number
+            of rows written
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        written = []
+        records = 0
+        read_bytes = 0
+        writer = None
+        # Rows are buffered up to a row group, small files make small tables
+        pending = []
+        pending_rows = 0
+        try:
+            while records < self.max_records and read_bytes < self.target_bytes:
+                key = next(sources, None)
+                if key is None:
+                    break
+                try:
+                    data = self.storage.read_bytes(key)
+                except FileNotFoundError:
+                    # Files removed since they were listed are left out
+                    continue
+                table = pq.read_table(io.BytesIO(data))
+                if writer is None:
+                    writer = pq.ParquetWriter(
+                        filepath, table.schema, compression=settings.PARQUET_COMPRESSION
+                    )
+                elif not table.schema.equals(writer.schema):
+                    raise RuntimeError(
+                        f"{key} doesn't match the schema of the files compacted with it"
+                    )
+
+                pending.append(table)
+                pending_rows += table.num_rows
+                if pending_rows >= settings.PARQUET_ROW_GROUP_SIZE:
+                    writer.write_table(
+                        pa.concat_tables(pending),
+                        row_group_size=settings.PARQUET_ROW_GROUP_SIZE,
+                    )
+                    pending, pending_rows = [], 0
+
+                written.append(key)
+                records += table.num_rows
+                read_bytes += len(data)
+
+            if pending:
+                writer.write_table(
+                    pa.concat_tables(pending),
+                    row_group_size=settings.PARQUET_ROW_GROUP_SIZE,
+                )
+        finally:
+            if writer is not None:
+                writer.close()
+        return written, records
+
+    def _count_records(self, filepath: str) -> int:
+        """Count the rows of a part from its footer"""
+        import pyarrow.parquet as pq
+
+        return pq.ParquetFile(filepath).metadata.num_rows
+
+
+def compact_prefix(storage: StorageInterface, prefix: str) -> Dict[str, Any]:
+    """
+    Compact the objects under a prefix and archive them
+
+    Prefixes under the Parquet datasets are compacted into Parquet files,
+    others from their JSON objects into gzipped JSON Lines files.
+
+    Args:
+        storage (StorageInterface): Storage holding the prefix
+        prefix (str): Prefix of the objects to compact
+
+    Returns:
+        Dict[str, Any]: Prefix, parts written, records compacted and sources archived
+    """
+    if (prefix.strip("/") + "/").startswith(PARQUET_PREFIX + "/"):
+        return ParquetCompactor(storage, prefix).run()
+    return Compactor(storage, prefix).run()
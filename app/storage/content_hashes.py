@@ -0,0 +1,107 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.core.logger import logger
+from app.storage.storage_interface import StorageInterface
+
+# Fields locating a post's media in storage or on disk, which depend on where
+# and how the media was stored rather than on the post
+LOCATION_FIELDS = {"media_local_paths", "media_object_names"}
+
+
+def content_hash(data: Dict[str, Any]) -> str:
+    """
+    Get the hash of a record's content
+
+    Args:
+        data (Dict[str, Any]): JSON-serializable record
+
+    Returns:
+        str: SHA-256 digest of the record's canonical JSON, in hex
+    """
+    canonical = json.dumps(
+        data, sort_keys=True, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class ContentHashStore:
+    """
+    Content hashes of the records stored for an author, by stable key
+
+    Records are keyed by an ID that doesn't change between crawls, such as
+    a submission's fullname. A record whose hash matches the one stored for
+    its key was already written by an earlier crawl and can be skipped.
+    The hashes of an author are kept in one object alongside the crawl
+    watermarks, loaded on first use and written back by save().
+    """
+
+    def __init__(
+        self,
+        storage: StorageInterface,
+        platform: str,
+        author_id: str,
+        prefix: str = "bronze/crawler/state/content_hashes",
+    ):
+        """
+        Initialize the hash store
+
+        Args:
+            storage (StorageInterface): Storage holding the hashes
+            platform (str): Platform name
+            author_id (str): ID of the author
+            prefix (str): Path prefix for hash objects
+        """
+        self.storage = storage
+        self.path = f"{prefix}/{platform}/{author_id}.json"
+        self._hashes: Optional[Dict[str, str]] = None
+        self._dirty = False
+
+    @property
+    def hashes(self) -> Dict[str, str]:
+        if self._hashes is None:
+            try:
+                self._hashes = dict(self.storage.read_json(self.path).get("hashes", {}))
+            except FileNotFoundError:
+                self._hashes = {}
+        return self._hashes
+
+    def unchanged(self, key: str, data: Dict[str, Any]) -> bool:
+        """
+        Check whether a record was already stored with the same content
+
+        Args:
+            key (str): Stable key of the record
+            data (Dict[str, Any]): Content of the record
+
+        Returns:
+            bool: True if the stored hash of the key matches the content
+        """
+        return self.hashes.get(key) == content_hash(data)
+
+    def update(self, key: str, data: Dict[str, Any]):
+        """
+        Record the content of a stored record
+
+        Args:
+            key (str): Stable key of the record
+            data (Dict[str, Any]): Content of the record
+        """
+        digest = content_hash(data)
+        if self.hashes.get(key) != digest:
+            self.hashes[key] = digest
+            self._dirty = True
+
+    def save(self):
+        """Write the hashes back if any changed"""
+        if not self._dirty:
+            return
+        document = {
+            "hashes": self.hashes,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.storage.upload_json(document, self.path)
+        self._dirty = False
+        logger.info(f"Saved {len(self.hashes)} content hashes to {self.path}")
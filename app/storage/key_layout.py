@@ -0,0 +1,298 @@
+import re
+import string
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, Optional, Tuple
+
+from app.config import settings
+
+BRONZE_PREFIX = "bronze/crawler"
+MEDIA_PREFIX = f"{BRONZE_PREFIX}/media/sha256"
+PARQUET_PREFIX = f"{BRONZE_PREFIX}/parquet"
+COMPACTED_PREFIX = f"{BRONZE_PREFIX}/compacted"
+
+# Placeholders a partition scheme can use, and those derived from the run time
+PLACEHOLDERS = ("platform", "dt", "hour", "run")
+TIME_PLACEHOLDERS = ("dt", "hour", "run")
+
+
+def to_datetime(crawler_processing_timestamp) -> datetime:
+    """
+    Get the moment of a crawl run from its processing timestamp
+
+    Args:
+        crawler_processing_timestamp: Unix timestamp, ISO datetime or datetime of the run
+
+    Returns:
+        datetime: Moment of the run (UTC)
+    """
+    if isinstance(crawler_processing_timestamp, datetime):
+        moment = crawler_processing_timestamp
+    else:
+        try:
+            return datetime.fromtimestamp(
+                float(crawler_processing_timestamp), timezone.utc
+            )
+        except (TypeError, ValueError):
+            try:
+                moment = datetime.fromisoformat(str(crawler_processing_timestamp))
+            except ValueError:
+                return datetime.now(timezone.utc)
+    if moment.tzinfo is None:
+        return moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc)
+
+
+class KeyLayout:
+    """
+    Builds the object keys of the crawled data
+
+    Datasets are partitioned by a scheme whose placeholders are filled from
+    the platform and the time of the crawl run:
+
+    - ``{platform}``: platform name
+    - ``{dt}``: date of the run (YYYY-MM-DD, UTC)
+    - ``{hour}``: hour of the run (HH, UTC)
+    - ``{run}``: processing timestamp of the run as given
+
+    ``platform={platform}/dt={dt}/hour={hour}`` gives Hive-style partitions
+    that sort by time, so a time range of a dataset is one contiguous range
+    of keys. ``{run}/{platform}`` is the original layout.
+    """
+
+    def __init__(
+        self,
+        scheme: str = settings.KEY_PARTITION_SCHEME,
+        parquet_scheme: str = settings.KEY_PARQUET_PARTITION_SCHEME,
+    ):
+        """
+        Initialize the key layout
+
+        Args:
+            scheme (str): Partition scheme of the JSON datasets
+            parquet_scheme (str): Partition scheme of the Parquet datasets
+
+        Raises:
+            ValueError: If a scheme uses an unknown placeholder
+        """
+        for value in (scheme, parquet_scheme):
+            for _, name, _, _ in string.Formatter().parse(value):
+                if name is not None and name not in PLACEHOLDERS:
+                    raise ValueError(
+                        f"Unknown placeholder {{{name}}} in partition scheme {value}"
+                    )
+        self.scheme = scheme.strip("/")
+        self.parquet_scheme = parquet_scheme.strip("/")
+
+    def _values(self, platform: str, crawler_processing_timestamp) -> Dict[str, str]:
+        moment = to_datetime(crawler_processing_timestamp)
+        return {
+            "platform": platform,
+            "dt": moment.strftime("%Y-%m-%d"),
+            "hour": moment.strftime("%H"),
+            "run": str(crawler_processing_timestamp),
+        }
+
+    def partition(
+        self, platform: str, crawler_processing_timestamp, scheme: Optional[str] = None
+    ) -> str:
+        """
+        Get the partition of a crawl run
+
+        Args:
+            platform (str): Platform name
+            crawler_processing_timestamp: Timestamp of the crawl run
+            scheme (str, optional): Partition scheme (default: the JSON scheme)
+
+        Returns:
+            str: Partition path, without slashes around it
+        """
+        return (scheme or self.scheme).format(
+            **self._values(platform, crawler_processing_timestamp)
+        )
+
+    def dataset_prefix(self, kind: str) -> str:
+        """
+        Get the prefix of a JSON dataset
+
+        Args:
+            kind (str): Record kind ('user_post' or 'user_profil')
+
+        Returns:
+            str: Prefix of the dataset
+        """
+        return f"{BRONZE_PREFIX}/metadata/{kind}"
+
+    def author_key(
+        self, platform: str, author_id: str, crawler_processing_timestamp
+    ) -> str:
+        """Get the key of an author profile crawled in a run"""
+        partition = self.partition(platform, crawler_processing_timestamp)
+        return f"{self.dataset_prefix('user_profil')}/{partition}/{author_id}.json"
+
+    def post_prefix(
+        self, platform: str, author_id: str, crawler_processing_timestamp
+    ) -> str:
+        """Get the prefix of the posts of an author crawled in a run"""
+        partition = self.partition(platform, crawler_processing_timestamp)
+        return f"{self.dataset_prefix('user_post')}/{partition}/{author_id}"
+
+    def post_key(self, post_prefix: str, post_timestamp: str) -> str:
+        """Get the key of a post stored as its own JSON object"""
+        return f"{post_prefix}/{post_timestamp.replace(':', '-')}.json"
+
+    def parquet_prefix(
+        self, kind: str, platform: str, crawler_processing_timestamp
+    ) -> str:
+        """Get the partition of the Parquet files of a crawl run"""
+        partition = self.partition(
+            platform, crawler_processing_timestamp, scheme=self.parquet_scheme
+        )
+        return f"{PARQUET_PREFIX}/{kind}/{partition}"
+
+    def media_key(self, filename: str) -> str:
+        """Get the key of a content-addressed media file"""
+        return f"{MEDIA_PREFIX}/{filename}"
+
+    def compacted_prefix(self, prefix: str) -> str:
+        """
+        Get the prefix of the compacted files of a prefix
+
+        Args:
+            prefix (str): Compacted prefix, such as a dataset partition
+
+        Returns:
+            str: Prefix mirroring it under the compacted files
+        """
+        prefix = prefix.strip("/")
+        if prefix.startswith(BRONZE_PREFIX + "/"):
+            prefix = prefix[len(BRONZE_PREFIX) + 1 :]
+        return f"{COMPACTED_PREFIX}/{prefix}"
+
+    def archive_key(self, key: str) -> str:
+        """Get the key an object is moved to once archived"""
+        return f"{settings.ARCHIVE_PREFIX.strip('/')}/{key}"
+
+    def _round_up(self, moment: datetime, scheme: str) -> datetime:
+        """Round a moment up to the start of a partition of the scheme"""
+        if "{run}" in scheme:
+            # Runs are partitioned by their exact timestamp
+            return moment
+        if "{hour}" in scheme:
+            start = moment.replace(minute=0, second=0, microsecond=0)
+            step = timedelta(hours=1)
+        elif "{dt}" in scheme:
+            start = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+            step = timedelta(days=1)
+        else:
+            return moment
+        return start if start == moment else start + step
+
+    def range_bounds(
+        self,
+        dataset_prefix: str,
+        platform: str,
+        since,
+        until,
+        scheme: Optional[str] = None,
+    ) -> Tuple[str, str, str]:
+        """
+        Get the key range holding the partitions of runs in a time range
+
+        Only the part of the scheme before its first time placeholder is
+        fixed, so the range is tight when the scheme starts with the
+        platform and time, as Hive-style schemes do. The start of the range
+        is rounded down and its end up to the partitions of the scheme, so
+        the partitions overlapping the range are listed in full.
+
+        Args:
+            dataset_prefix (str): Prefix of the dataset
+            platform (str): Platform name
+            since: Start of the range, inclusive
+            until: End of the range, exclusive
+            scheme (str, optional): Partition scheme (default: the JSON scheme)
+
+        Returns:
+            Tuple[str, str, str]: Prefix to list, first key of the range and
+            the key at which the range ends
+        """
+        scheme = scheme or self.scheme
+        cut = min(
+            (
+                scheme.find("{" + name + "}")
+                for name in TIME_PLACEHOLDERS
+                if "{" + name + "}" in scheme
+            ),
+            default=len(scheme),
+        )
+        fixed = scheme[:cut].format(platform=platform)
+        since = to_datetime(since)
+        until = self._round_up(to_datetime(until), scheme)
+        lower = self.partition(platform, since.timestamp(), scheme=scheme)
+        upper = self.partition(platform, until.timestamp(), scheme=scheme)
+        return (
+            f"{dataset_prefix}/{fixed}",
+            f"{dataset_prefix}/{lower}",
+            f"{dataset_prefix}/{upper}",
+        )
+
+    def partition_pattern(self, scheme: Optional[str] = None) -> re.Pattern:
+        """
+        Get a regular expression matching the partitions of a scheme
+
+        Args:
+            scheme (str, optional): Partition scheme (default: the JSON scheme)
+
+        Returns:
+            re.Pattern: Pattern with a named group per placeholder
+        """
+        pattern = ""
+        for literal, name, _, _ in string.Formatter().parse(scheme or self.scheme):
+            pattern += re.escape(literal)
+            if name is not None:
+                pattern += f"(?P<{name}>[^/]+)"
+        return re.compile(pattern + "/")
+
+    def iter_range(
+        self,
+        storage,
+        dataset_prefix: str,
+        platform: str,
+        since,
+        until,
+        scheme: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Iterate over the objects of a dataset crawled in a time range
+
+        Lists the range of keys from range_bounds() with a start_after
+        listing, stopping at the end of the range, so only the partitions
+        of the range are read.
+
+        Args:
+            storage: Storage with an iter_files(prefix, start_after) listing
+            dataset_prefix (str): Prefix of the dataset
+            platform (str): Platform name
+            since: Start of the range, inclusive
+            until: End of the range, exclusive
+            scheme (str, optional): Partition scheme (default: the JSON scheme)
+
+        Yields:
+            str: Object keys, in lexicographic order
+        """
+        prefix, lower, upper = self.range_bounds(
+            dataset_prefix, platform, since, until, scheme=scheme
+        )
+        pattern = self.partition_pattern(scheme)
+        # Keys of the first partition sort after any string shorter than it
+        for key in storage.iter_files(prefix, start_after=lower[:-1]):
+            if key >= upper:
+                return
+            if key < lower:
+                continue
+            match = pattern.match(key, len(dataset_prefix) + 1)
+            if match and match.groupdict().get("platform", platform) == platform:
+                yield key
+
+
+# Layout used by the crawl
+key_layout = KeyLayout()
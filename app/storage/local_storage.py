@@ -1,8 +1,10 @@
-import json
 import os
-from typing import Any, Dict
+import shutil
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional
 
 from app.core.logger import logger
+from app.storage.codecs import decode
+from app.storage.manifest_index import ManifestIndex
 from app.storage.storage_interface import StorageInterface
 
 
@@ -11,6 +13,8 @@ class LocalStorage(StorageInterface):
     Local file system storage implementation
     """
 
+    STREAM_CHUNK_SIZE = 64 * 1024
+
     def __init__(self, base_dir: str = "local_storage"):
         """
         Initialize the local storage with a base directory
@@ -30,11 +34,16 @@ class LocalStorage(StorageInterface):
         os.makedirs(self.metadata_dir, exist_ok=True)
         os.makedirs(self.media_dir, exist_ok=True)
 
+        # Index of the stored files, so listings don't walk the directories
+        self.index = ManifestIndex(os.path.join(self.base_dir, "manifest.sqlite"))
+        if not self.index.is_built():
+            self.rebuild_index()
+
         logger.info(f"Initialized local storage at {os.path.abspath(self.base_dir)}")
 
     def upload_json(self, data: Dict[str, Any], path: str) -> str:
         """
-        Save JSON data to a local file
+        Save JSON data to a local file, encoded with the codec of its path
 
         Args:
             data (Dict[str, Any]): JSON-serializable data
@@ -47,10 +56,13 @@ class LocalStorage(StorageInterface):
         full_path = os.path.join(self.metadata_dir, path)
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
 
-        # Write the JSON file
+        # Write the encoded document
         try:
-            with open(full_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            payload = self.get_codec(path).encode(data)
+            with open(full_path, "wb") as f:
+                f.write(payload)
+            self._index_file(full_path)
+            self._notify("on_write", path, len(payload), 1)
 
             logger.info(f"Saved JSON data to {full_path}")
             return full_path
@@ -58,6 +70,35 @@ class LocalStorage(StorageInterface):
             logger.error(f"Error saving JSON data to {full_path}: {e}")
             raise
 
+    def upload_bytes(
+        self, data: bytes, path: str, content_type: Optional[str] = None
+    ) -> str:
+        """
+        Save serialized data to a local file next to the JSON metadata
+
+        Args:
+            data (bytes): Serialized data
+            path (str): Relative path within the storage
+            content_type (str, optional): MIME type of the data (unused)
+
+        Returns:
+            str: Full path to the saved file
+        """
+        full_path = os.path.join(self.metadata_dir, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        try:
+            with open(full_path, "wb") as f:
+                f.write(data)
+            self._index_file(full_path)
+            self._notify("on_write", path, len(data))
+
+            logger.info(f"Saved {len(data)} bytes to {full_path}")
+            return full_path
+        except Exception as e:
+            logger.error(f"Error saving data to {full_path}: {e}")
+            raise
+
     def upload_file(self, filepath: str, object_name: str) -> str:
         """
         Copy a file to local storage
@@ -75,9 +116,8 @@ class LocalStorage(StorageInterface):
 
         # Copy the file
         try:
-            import shutil
-
             shutil.copy2(filepath, full_path)
+            self._notify("on_write", object_name, self._index_file(full_path))
 
             logger.info(f"Copied file from {filepath} to {full_path}")
             return full_path
@@ -85,6 +125,138 @@ class LocalStorage(StorageInterface):
             logger.error(f"Error copying file from {filepath} to {full_path}: {e}")
             raise
 
+    def upload_stream(
+        self,
+        stream: BinaryIO,
+        object_name: str,
+        length: int = -1,
+        content_type: Optional[str] = None,
+    ) -> str:
+        """
+        Write the content of a readable stream to local storage
+
+        Args:
+            stream (BinaryIO): Object with a read(size) method
+            object_name (str): Destination path within storage
+            length (int): Size of the content in bytes, or -1 if unknown
+            content_type (str, optional): MIME type of the content (unused)
+
+        Returns:
+            str: Full path to the saved file
+        """
+        full_path = os.path.join(self.media_dir, object_name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        try:
+            with open(full_path, "wb") as f:
+                shutil.copyfileobj(stream, f, self.STREAM_CHUNK_SIZE)
+            self._notify("on_write", object_name, self._index_file(full_path))
+
+            logger.info(f"Streamed data to {full_path}")
+            return full_path
+        except Exception as e:
+            logger.error(f"Error streaming data to {full_path}: {e}")
+            if os.path.exists(full_path):
+                os.remove(full_path)
+            raise
+
+    def _split(self, full_path: str) -> tuple:
+        """Get the area ('metadata' or 'media') and relative path of a stored file"""
+        if full_path.startswith(self.metadata_dir + os.sep):
+            return "metadata", os.path.relpath(full_path, self.metadata_dir)
+        return "media", os.path.relpath(full_path, self.media_dir)
+
+    def _index_file(self, full_path: str) -> int:
+        """Record a stored file in the manifest index and return its size"""
+        area, path = self._split(full_path)
+        size = os.path.getsize(full_path)
+        self.index.add(area, path, size)
+        return size
+
+    def _unindex_file(self, full_path: str):
+        """Remove a stored file from the manifest index"""
+        self.index.remove(*self._split(full_path))
+
+    def rebuild_index(self):
+        """
+        Rebuild the manifest index from the files on disk
+
+        Only needed for files written to the directories by other means.
+        """
+        entries = []
+        for area, base_dir in (
+            ("metadata", self.metadata_dir),
+            ("media", self.media_dir),
+        ):
+            for root, _, filenames in os.walk(base_dir):
+                for filename in filenames:
+                    full_path = os.path.join(root, filename)
+                    try:
+                        size = os.path.getsize(full_path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((area, os.path.relpath(full_path, base_dir), size))
+
+        self.index.rebuild(entries)
+        logger.info(f"Indexed {len(entries)} files in {self.base_dir}")
+
+    def local_path(self, path: str) -> str:
+        """
+        Get the full path of a stored file, in the media or metadata directory
+
+        Args:
+            path (str): Relative path within the storage
+
+        Returns:
+            str: Full path of the file
+        """
+        metadata_path = os.path.join(self.metadata_dir, path)
+        if os.path.isfile(metadata_path):
+            return metadata_path
+        return os.path.join(self.media_dir, path)
+
+    def move(self, source: str, destination: str) -> str:
+        """
+        Move a file within local storage
+
+        Args:
+            source (str): Current relative path of the file
+            destination (str): New relative path of the file
+
+        Returns:
+            str: Full path to the moved file
+        """
+        source_path = self.local_path(source)
+        base_dir = (
+            self.metadata_dir
+            if source_path.startswith(self.metadata_dir + os.sep)
+            else self.media_dir
+        )
+        full_path = os.path.join(base_dir, destination)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+        os.replace(source_path, full_path)
+        self._unindex_file(source_path)
+        self._index_file(full_path)
+        self._notify("on_move", source, destination)
+        logger.info(f"Moved {source_path} to {full_path}")
+        return full_path
+
+    def delete(self, path: str):
+        """
+        Delete a file from local storage, ignoring missing files
+
+        Args:
+            path (str): Relative path within the storage
+        """
+        full_path = self.local_path(path)
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
+        self._unindex_file(full_path)
+        self._notify("on_delete", path)
+
     def list_files(self, prefix: str = "") -> list:
         """
         List files in the storage with an optional prefix
@@ -93,35 +265,55 @@ class LocalStorage(StorageInterface):
             prefix (str): Optional prefix to filter files
 
         Returns:
-            list: List of file paths
+            list: List of file paths, in lexicographic order
         """
-        files = []
+        return self.index.list(prefix)
 
-        # List files in metadata directory
-        metadata_path = os.path.join(self.metadata_dir, prefix)
-        if os.path.exists(metadata_path):
-            for root, _, filenames in os.walk(metadata_path):
-                for filename in filenames:
-                    rel_path = os.path.relpath(
-                        os.path.join(root, filename), self.metadata_dir
-                    )
-                    files.append(rel_path)
-
-        # List files in media directory
-        media_path = os.path.join(self.media_dir, prefix)
-        if os.path.exists(media_path):
-            for root, _, filenames in os.walk(media_path):
-                for filename in filenames:
-                    rel_path = os.path.relpath(
-                        os.path.join(root, filename), self.media_dir
-                    )
-                    files.append(rel_path)
+    def list_files_page(
+        self, prefix: str = "", start_after: Optional[str] = None, limit: int = 1000
+    ) -> List[str]:
+        """
+        List one page of the files with a prefix
 
-        return files
+        Args:
+            prefix (str): Optional prefix to filter files
+            start_after (str, optional): Last path of the previous page
+            limit (int): Maximum number of paths in the page
+
+        Returns:
+            List[str]: File paths, in lexicographic order
+        """
+        return self.index.list(prefix, start_after=start_after, limit=limit)
+
+    def iter_files(
+        self,
+        prefix: str = "",
+        start_after: Optional[str] = None,
+        page_size: int = 1000,
+    ) -> Iterator[str]:
+        """
+        Iterate over the files with a prefix, one page at a time
+
+        Args:
+            prefix (str): Optional prefix to filter files
+            start_after (str, optional): Only list paths after this one
+            page_size (int): Number of paths fetched per query
+
+        Yields:
+            str: File paths, in lexicographic order
+        """
+        while True:
+            page = self.list_files_page(
+                prefix, start_after=start_after, limit=page_size
+            )
+            yield from page
+            if len(page) < page_size:
+                return
+            start_after = page[-1]
 
     def read_json(self, path: str) -> Dict[str, Any]:
         """
-        Read JSON data from a local file
+        Read JSON data from a local file, whatever codec it was written with
 
         Args:
             path (str): Relative path within the storage
@@ -132,8 +324,8 @@ class LocalStorage(StorageInterface):
         full_path = os.path.join(self.metadata_dir, path)
 
         try:
-            with open(full_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
+            with open(full_path, "rb") as f:
+                data = decode(f.read())
 
             logger.info(f"Read JSON data from {full_path}")
             return data
@@ -141,6 +333,42 @@ class LocalStorage(StorageInterface):
             logger.error(f"Error reading JSON data from {full_path}: {e}")
             raise
 
+    def read_bytes(self, path: str) -> bytes:
+        """
+        Read the content of a local file next to the JSON metadata
+
+        Args:
+            path (str): Relative path within the storage
+
+        Returns:
+            bytes: Content of the file
+        """
+        full_path = os.path.join(self.metadata_dir, path)
+
+        try:
+            with open(full_path, "rb") as f:
+                data = f.read()
+
+            logger.info(f"Read {len(data)} bytes from {full_path}")
+            return data
+        except Exception as e:
+            logger.error(f"Error reading data from {full_path}: {e}")
+            raise
+
+    def exists(self, path: str) -> bool:
+        """
+        Check whether a file is stored at a path
+
+        Args:
+            path (str): Relative path within the storage
+
+        Returns:
+            bool: True if a metadata or media file exists at the path
+        """
+        return os.path.isfile(os.path.join(self.metadata_dir, path)) or os.path.isfile(
+            os.path.join(self.media_dir, path)
+        )
+
 
 # Create a singleton instance
 local_storage = LocalStorage()
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from app.core.logger import logger
+
+
+def _prefix_upper_bound(prefix: str) -> Optional[str]:
+    """
+    Get the smallest string greater than every string starting with a prefix
+
+    Args:
+        prefix (str): Key prefix
+
+    Returns:
+        Optional[str]: Exclusive upper bound, or None for an empty prefix
+    """
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class ManifestIndex:
+    """
+    Sorted index of the objects stored by a LocalStorage
+
+    Objects are keyed by their storage area ('metadata' or 'media') and
+    relative path in a SQLite table whose primary key is a B-tree, so
+    prefix listings are range scans instead of directory walks.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the manifest index
+
+        Args:
+            path (str): Path to the SQLite database file
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        try:
+            # WAL keeps index writes cheap next to the file writes they follow
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS objects ("
+                    "path TEXT NOT NULL, area TEXT NOT NULL, size INTEGER NOT NULL, "
+                    "updated_at REAL NOT NULL, PRIMARY KEY (path, area)) WITHOUT ROWID"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS index_state "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A connection per operation keeps the index safe across forks
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def is_built(self) -> bool:
+        """
+        Check whether the index was built from the files on disk
+
+        Returns:
+            bool: True once rebuild() has completed
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value FROM index_state WHERE key = 'built'"
+            ).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+    def rebuild(self, entries: Iterable[Tuple[str, str, int]]):
+        """
+        Replace the content of the index
+
+        Args:
+            entries (Iterable[Tuple[str, str, int]]): (area, path, size) of every object
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("DELETE FROM objects")
+                conn.executemany(
+                    "INSERT OR REPLACE INTO objects (path, area, size, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    ((path, area, size, now) for area, path, size in entries),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO index_state (key, value) VALUES ('built', ?)",
+                    (str(now),),
+                )
+        finally:
+            conn.close()
+
+    def add(self, area: str, path: str, size: int):
+        """
+        Record an object
+
+        Args:
+            area (str): Storage area of the object
+            path (str): Relative path of the object
+            size (int): Size in bytes
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO objects (path, area, size, updated_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (path, area, size, time.time()),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to index {area}/{path}: {e}")
+        finally:
+            conn.close()
+
+    def remove(self, area: str, path: str):
+        """
+        Forget an object
+
+        Args:
+            area (str): Storage area of the object
+            path (str): Relative path of the object
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "DELETE FROM objects WHERE path = ? AND area = ?", (path, area)
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to unindex {area}/{path}: {e}")
+        finally:
+            conn.close()
+
+    def list(
+        self,
+        prefix: str = "",
+        start_after: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[str]:
+        """
+        List object paths starting with a prefix, in lexicographic order
+
+        Args:
+            prefix (str): Path prefix
+            start_after (str, optional): Only list paths after this one
+            limit (int, optional): Maximum number of paths to return
+
+        Returns:
+            List[str]: Distinct object paths
+        """
+        clauses = ["path >= ?"]
+        params = [prefix]
+        upper_bound = _prefix_upper_bound(prefix)
+        if upper_bound is not None:
+            clauses.append("path < ?")
+            params.append(upper_bound)
+        if start_after is not None:
+            clauses.append("path > ?")
+            params.append(start_after)
+
+        sql = (
+            f"SELECT DISTINCT path FROM objects WHERE {' AND '.join(clauses)} "
+            "ORDER BY path"
+        )
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute(sql, params)]
+        finally:
+            conn.close()
@@ -1,13 +1,64 @@
-import json
+import io
 import os
-from tempfile import NamedTemporaryFile
-from typing import Any, Dict
+import threading
+from typing import Any, BinaryIO, Dict, Iterator, Optional
 
 from minio import Minio
+from minio.commonconfig import CopySource
+from minio.error import S3Error
 
 from app.config import settings
 from app.core.logger import logger
-from app.storage.storage_interface import StorageInterface
+from app.storage.codecs import decode
+from app.storage.multipart import MultipartUploader, get_s3_client
+from app.storage.storage_interface import CountingReader, StorageInterface
+
+# Clients by process, since connection pools must not be shared across forks
+_clients = {}
+_checked_buckets = set()
+_clients_lock = threading.Lock()
+
+
+def get_minio_client() -> Minio:
+    """
+    Get the MinIO client of the current process, creating it on first use
+
+    Returns:
+        Minio: Client configured from settings
+    """
+    key = (os.getpid(), settings.MINIO_ENDPOINT, settings.MINIO_ACCESS_KEY)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = Minio(
+                settings.MINIO_ENDPOINT,
+                access_key=settings.MINIO_ACCESS_KEY,
+                secret_key=settings.MINIO_SECRET_KEY,
+                secure=False,
+            )
+            _clients[key] = client
+        return client
+
+
+def ensure_bucket(client: Minio, bucket: str):
+    """
+    Create a bucket if it doesn't exist, checking once per process
+
+    Args:
+        client (Minio): MinIO client
+        bucket (str): Bucket name
+    """
+    key = (os.getpid(), settings.MINIO_ENDPOINT, bucket)
+    with _clients_lock:
+        if key in _checked_buckets:
+            return
+
+        if not client.bucket_exists(bucket):
+            client.make_bucket(bucket)
+            logger.info(f"Created MinIO bucket: {bucket}")
+        else:
+            logger.info(f"Using existing MinIO bucket: {bucket}")
+        _checked_buckets.add(key)
 
 
 class MinIOStorage(StorageInterface):
@@ -18,24 +69,20 @@ class MinIOStorage(StorageInterface):
     def __init__(self):
         """
         Initialize the MinIO client with settings from config
+
+        The client and the bucket check are shared by every instance in the
+        process.
         """
-        self.client = Minio(
-            settings.MINIO_ENDPOINT,
-            access_key=settings.MINIO_ACCESS_KEY,
-            secret_key=settings.MINIO_SECRET_KEY,
-            secure=False,
-        )
+        self.client = get_minio_client()
 
         # Create bucket if it doesn't exist
-        if not self.client.bucket_exists(settings.MINIO_BUCKET):
-            self.client.make_bucket(settings.MINIO_BUCKET)
-            logger.info(f"Created MinIO bucket: {settings.MINIO_BUCKET}")
-        else:
-            logger.info(f"Using existing MinIO bucket: {settings.MINIO_BUCKET}")
+        ensure_bucket(self.client, settings.MINIO_BUCKET)
 
     def upload_json(self, data: Dict[str, Any], path: str) -> str:
         """
-        Upload JSON data to MinIO
+        Upload JSON data to MinIO, encoded with the codec of its path
+
+        The object's Content-Type and Content-Encoding describe the codec.
 
         Args:
             data (Dict[str, Any]): JSON-serializable data
@@ -45,18 +92,23 @@ class MinIOStorage(StorageInterface):
             str: Path of the uploaded object
         """
         try:
-            # Create a temporary file
-            with NamedTemporaryFile(delete=False, mode="w", suffix=".json") as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-                f.flush()
-                temp_path = f.name
-
-            # Upload the file to MinIO
-            self.client.fput_object(settings.MINIO_BUCKET, path, temp_path)
-
-            # Clean up the temporary file
-            os.unlink(temp_path)
+            # Serialize in memory, no temporary file needed
+            codec = self.get_codec(path)
+            payload = codec.encode(data)
+            self.client.put_object(
+                settings.MINIO_BUCKET,
+                path,
+                io.BytesIO(payload),
+                len(payload),
+                content_type=codec.content_type,
+                metadata=(
+                    {"Content-Encoding": codec.content_encoding}
+                    if codec.content_encoding
+                    else None
+                ),
+            )
 
+            self._notify("on_write", path, len(payload), 1)
             logger.info(f"Uploaded JSON data to MinIO: {path}")
             return path
 
@@ -64,10 +116,44 @@ class MinIOStorage(StorageInterface):
             logger.error(f"Error uploading JSON to MinIO at {path}: {e}")
             raise
 
+    def upload_bytes(
+        self, data: bytes, path: str, content_type: Optional[str] = None
+    ) -> str:
+        """
+        Upload serialized data to MinIO
+
+        Args:
+            data (bytes): Serialized data
+            path (str): Path within the bucket
+            content_type (str, optional): MIME type of the data
+
+        Returns:
+            str: Path of the uploaded object
+        """
+        try:
+            self.client.put_object(
+                settings.MINIO_BUCKET,
+                path,
+                io.BytesIO(data),
+                len(data),
+                content_type=content_type or "application/octet-stream",
+            )
+
+            self._notify("on_write", path, len(data))
+            logger.info(f"Uploaded {len(data)} bytes to MinIO: {path}")
+            return path
+
+        except Exception as e:
+            logger.error(f"Error uploading data to MinIO at {path}: {e}")
+            raise
+
     def upload_file(self, filepath: str, object_name: str) -> str:
         """
         Upload a file to MinIO
 
+        Files of at least MINIO_MULTIPART_THRESHOLD bytes are uploaded as a
+        resumable multipart upload with concurrent parts.
+
         Args:
             filepath (str): Source file path
             object_name (str): Destination path within the bucket
@@ -76,8 +162,22 @@ class MinIOStorage(StorageInterface):
             str: Path of the uploaded object
         """
         try:
-            self.client.fput_object(settings.MINIO_BUCKET, object_name, filepath)
+            size = os.path.getsize(filepath)
+            if size >= settings.MINIO_MULTIPART_THRESHOLD:
+                # Large files go up in concurrent parts that survive interruptions
+                MultipartUploader(get_s3_client(), settings.MINIO_BUCKET).upload(
+                    filepath, object_name
+                )
+            else:
+                self.client.fput_object(
+                    settings.MINIO_BUCKET,
+                    object_name,
+                    filepath,
+                    part_size=settings.MINIO_PART_SIZE,
+                    num_parallel_uploads=settings.MINIO_UPLOAD_CONCURRENCY,
+                )
 
+            self._notify("on_write", object_name, size)
             logger.info(f"Uploaded file from {filepath} to MinIO: {object_name}")
             return object_name
 
@@ -85,22 +185,207 @@ class MinIOStorage(StorageInterface):
             logger.error(f"Error uploading file to MinIO at {object_name}: {e}")
             raise
 
-    def list_objects(self, prefix: str = "") -> list:
+    def upload_stream(
+        self,
+        stream: BinaryIO,
+        object_name: str,
+        length: int = -1,
+        content_type: Optional[str] = None,
+    ) -> str:
         """
-        List objects in the bucket with an optional prefix
+        Upload the content of a readable stream to MinIO
+
+        Content of unknown length goes up as a multipart upload, buffering
+        at most one part of MINIO_PART_SIZE bytes in memory.
 
         Args:
-            prefix (str): Optional prefix to filter objects
+            stream (BinaryIO): Object with a read(size) method
+            object_name (str): Destination path within the bucket
+            length (int): Size of the content in bytes, or -1 if unknown
+            content_type (str, optional): MIME type of the content
 
         Returns:
-            list: List of object names
+            str: Path of the uploaded object
+        """
+        try:
+            stream = CountingReader(stream)
+            self.client.put_object(
+                settings.MINIO_BUCKET,
+                object_name,
+                stream,
+                length,
+                content_type=content_type or "application/octet-stream",
+                part_size=settings.MINIO_PART_SIZE,
+            )
+
+            self._notify("on_write", object_name, stream.count)
+            logger.info(f"Streamed data to MinIO: {object_name}")
+            return object_name
+
+        except Exception as e:
+            logger.error(f"Error streaming data to MinIO at {object_name}: {e}")
+            raise
+
+    def move(self, source: str, destination: str) -> str:
+        """
+        Move an object within the bucket with a server-side copy
+
+        Args:
+            source (str): Current path of the object
+            destination (str): New path of the object
+
+        Returns:
+            str: Path of the moved object
         """
         try:
-            objects = self.client.list_objects(
-                settings.MINIO_BUCKET, prefix=prefix, recursive=True
+            self.client.copy_object(
+                settings.MINIO_BUCKET,
+                destination,
+                CopySource(settings.MINIO_BUCKET, source),
             )
-            return [obj.object_name for obj in objects]
+            self.client.remove_object(settings.MINIO_BUCKET, source)
+            self._notify("on_move", source, destination)
+
+            logger.info(f"Moved MinIO object {source} to {destination}")
+            return destination
+
+        except Exception as e:
+            logger.error(f"Error moving MinIO object {source} to {destination}: {e}")
+            raise
+
+    def delete(self, path: str):
+        """
+        Delete an object from MinIO, ignoring missing objects
+
+        Args:
+            path (str): Path within the bucket
+        """
+        try:
+            self.client.remove_object(settings.MINIO_BUCKET, path)
+            self._notify("on_delete", path)
+        except Exception as e:
+            logger.error(f"Error deleting MinIO object {path}: {e}")
+            raise
+
+    def read_json(self, path: str) -> Dict[str, Any]:
+        """
+        Read JSON data from MinIO, whatever codec it was written with
+
+        Args:
+            path (str): Path within the bucket
+
+        Returns:
+            Dict[str, Any]: JSON data
+        """
+        response = None
+        try:
+            response = self.client.get_object(settings.MINIO_BUCKET, path)
+            # Compressed objects may already be decompressed by the HTTP client
+            data = decode(response.read())
+
+            logger.info(f"Read JSON data from MinIO: {path}")
+            return data
+
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                raise FileNotFoundError(f"No object in MinIO at {path}")
+            logger.error(f"Error reading JSON from MinIO at {path}: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error reading JSON from MinIO at {path}: {e}")
+            raise
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+    def read_bytes(self, path: str) -> bytes:
+        """
+        Read the content of an object from MinIO
+
+        Args:
+            path (str): Path within the bucket
+
+        Returns:
+            bytes: Content of the object
+        """
+        response = None
+        try:
+            response = self.client.get_object(settings.MINIO_BUCKET, path)
+            data = response.read()
+
+            logger.info(f"Read {len(data)} bytes from MinIO: {path}")
+            return data
+
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                raise FileNotFoundError(f"No object in MinIO at {path}")
+            logger.error(f"Error reading data from MinIO at {path}: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error reading data from MinIO at {path}: {e}")
+            raise
+        finally:
+            if response is not None:
+                response.close()
+                response.release_conn()
+
+    def exists(self, path: str) -> bool:
+        """
+        Check whether an object exists in MinIO
+
+        Args:
+            path (str): Path within the bucket
+
+        Returns:
+            bool: True if an object exists at the path
+        """
+        try:
+            self.client.stat_object(settings.MINIO_BUCKET, path)
+            return True
+        except S3Error as e:
+            if e.code in ("NoSuchKey", "NoSuchObject"):
+                return False
+            logger.error(f"Error checking MinIO object {path}: {e}")
+            raise
+
+    def iter_files(
+        self, prefix: str = "", start_after: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Iterate over the objects with a prefix, one listing page at a time
+
+        Args:
+            prefix (str): Optional prefix to filter objects
+            start_after (str, optional): Only list objects after this name
+
+        Yields:
+            str: Object names, in lexicographic order
+        """
+        try:
+            for obj in self.client.list_objects(
+                settings.MINIO_BUCKET,
+                prefix=prefix,
+                recursive=True,
+                start_after=start_after,
+            ):
+                yield obj.object_name
 
         except Exception as e:
             logger.error(f"Error listing objects in MinIO with prefix {prefix}: {e}")
             raise
+
+    def list_objects(self, prefix: str = "") -> list:
+        """
+        List objects in the bucket with an optional prefix
+
+        Prefer iter_files() for large prefixes, which doesn't hold the
+        whole listing in memory.
+
+        Args:
+            prefix (str): Optional prefix to filter objects
+
+        Returns:
+            list: List of object names
+        """
+        return list(self.iter_files(prefix))
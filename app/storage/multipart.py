@@ -0,0 +1,219 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from app.config import settings
+from app.core.logger import logger
+
+# S3 requires every part but the last to be at least 5 MiB
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+# Clients by process, since connection pools must not be shared across forks
+_s3_clients = {}
+_s3_clients_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Get the boto3 S3 client of the current process for the MinIO endpoint
+
+    Returns:
+        botocore.client.S3: Client configured from settings
+    """
+    key = (os.getpid(), settings.MINIO_ENDPOINT, settings.MINIO_ACCESS_KEY)
+    with _s3_clients_lock:
+        client = _s3_clients.get(key)
+        if client is None:
+            import boto3
+            from botocore.config import Config
+
+            client = boto3.client(
+                "s3",
+                endpoint_url=f"http://{settings.MINIO_ENDPOINT}",
+                aws_access_key_id=settings.MINIO_ACCESS_KEY,
+                aws_secret_access_key=settings.MINIO_SECRET_KEY,
+                region_name="us-east-1",
+                config=Config(
+                    signature_version="s3v4",
+                    s3={"addressing_style": "path"},
+                    max_pool_connections=max(settings.MINIO_UPLOAD_CONCURRENCY, 10),
+                ),
+            )
+            _s3_clients[key] = client
+        return client
+
+
+class MultipartUploader:
+    """
+    Uploads large files as S3 multipart uploads with concurrent, resumable parts
+
+    Parts are uploaded by a bounded thread pool. An upload interrupted by a
+    failure is left open on the server; the next upload of the same object
+    finds it with ListMultipartUploads, keeps the parts that were already
+    received and only sends the missing ones.
+    """
+
+    def __init__(
+        self,
+        client,
+        bucket: str,
+        part_size: int = settings.MINIO_PART_SIZE,
+        max_workers: int = settings.MINIO_UPLOAD_CONCURRENCY,
+    ):
+        """
+        Initialize the uploader
+
+        Args:
+            client: boto3 S3 client
+            bucket (str): Bucket to upload to
+            part_size (int): Size of each part in bytes (at least 5 MiB)
+            max_workers (int): Maximum number of concurrent part uploads
+        """
+        self.client = client
+        self.bucket = bucket
+        self.part_size = max(part_size, MIN_PART_SIZE)
+        self.max_workers = max(max_workers, 1)
+
+    def _find_upload(self, object_name: str) -> Optional[str]:
+        """
+        Find the most recent unfinished multipart upload of an object
+
+        Args:
+            object_name (str): Object name
+
+        Returns:
+            Optional[str]: Upload ID, or None if there is none
+        """
+        uploads = []
+        params = {"Bucket": self.bucket, "Prefix": object_name}
+        while True:
+            response = self.client.list_multipart_uploads(**params)
+            uploads.extend(
+                upload
+                for upload in response.get("Uploads", [])
+                if upload["Key"] == object_name
+            )
+            if not response.get("IsTruncated"):
+                break
+            params["KeyMarker"] = response.get("NextKeyMarker")
+            params["UploadIdMarker"] = response.get("NextUploadIdMarker")
+
+        if not uploads:
+            return None
+        return max(uploads, key=lambda upload: upload["Initiated"])["UploadId"]
+
+    def _list_parts(self, object_name: str, upload_id: str) -> Dict[int, Dict]:
+        """
+        List the parts already received for a multipart upload
+
+        Args:
+            object_name (str): Object name
+            upload_id (str): Upload ID
+
+        Returns:
+            Dict[int, Dict]: Parts by part number, with 'ETag' and 'Size'
+        """
+        parts = {}
+        params = {"Bucket": self.bucket, "Key": object_name, "UploadId": upload_id}
+        while True:
+            response = self.client.list_parts(**params)
+            for part in response.get("Parts", []):
+                parts[part["PartNumber"]] = {"ETag": part["ETag"], "Size": part["Size"]}
+            if not response.get("IsTruncated"):
+                break
+            params["PartNumberMarker"] = response.get("NextPartNumberMarker")
+        return parts
+
+    def _read_part(self, filepath, part_number, size):
+        """Read one part of a file"""
+        with open(filepath, "rb") as f:
+            f.seek((part_number - 1) * self.part_size)
+            return f.read(size)
+
+    def _upload_part(self, filepath, object_name, upload_id, part_number, size):
+        """Upload one part of a file and return its ETag"""
+        body = self._read_part(filepath, part_number, size)
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=object_name,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=body,
+        )
+        return response["ETag"]
+
+    def upload(
+        self, filepath: str, object_name: str, content_type: Optional[str] = None
+    ) -> str:
+        """
+        Upload a file as a multipart upload, resuming an unfinished one
+
+        Args:
+            filepath (str): Source file path
+            object_name (str): Destination object name
+            content_type (str, optional): MIME type of the file
+
+        Returns:
+            str: Object name of the uploaded file
+        """
+        file_size = os.path.getsize(filepath)
+        part_count = max((file_size + self.part_size - 1) // self.part_size, 1)
+        part_sizes = {
+            number: min(self.part_size, file_size - (number - 1) * self.part_size)
+            for number in range(1, part_count + 1)
+        }
+
+        upload_id = self._find_upload(object_name)
+        done = {}
+        if upload_id:
+            # Only keep parts that match the content of this file
+            done = {
+                number: part
+                for number, part in self._list_parts(object_name, upload_id).items()
+                if part_sizes.get(number) == part["Size"]
+                and part["ETag"].strip('"')
+                == hashlib.md5(
+                    self._read_part(filepath, number, part["Size"])
+                ).hexdigest()
+            }
+            logger.info(
+                f"Resuming upload of {object_name} with {len(done)}/{part_count} parts"
+            )
+        else:
+            upload_id = self.client.create_multipart_upload(
+                Bucket=self.bucket,
+                Key=object_name,
+                ContentType=content_type or "application/octet-stream",
+            )["UploadId"]
+
+        missing = [number for number in part_sizes if number not in done]
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, max(len(missing), 1)),
+            thread_name_prefix="multipart-upload",
+        ) as executor:
+            etags = executor.map(
+                lambda number: self._upload_part(
+                    filepath, object_name, upload_id, number, part_sizes[number]
+                ),
+                missing,
+            )
+            # The upload stays open on failure, so a later call can resume it
+            for number, etag in zip(missing, etags):
+                done[number] = {"ETag": etag, "Size": part_sizes[number]}
+
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=object_name,
+            UploadId=upload_id,
+            MultipartUpload={
+                "Parts": [
+                    {"PartNumber": number, "ETag": done[number]["ETag"]}
+                    for number in sorted(part_sizes)
+                ]
+            },
+        )
+
+        logger.info(f"Uploaded {filepath} to {object_name} in {part_count} parts")
+        return object_name
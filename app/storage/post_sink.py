@@ -0,0 +1,424 @@
+import gzip
+import io
+import json
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List
+
+from pydantic import BaseModel
+
+from app.config import settings
+from app.core.logger import logger
+from app.models import Post
+from app.storage.key_layout import key_layout
+from app.storage.storage_interface import StorageInterface
+
+
+class PostSink(ABC):
+    """
+    Abstract writer of the posts of a crawl to storage
+    """
+
+    def __init__(self, storage: StorageInterface, prefix: str):
+        """
+        Initialize the sink
+
+        Args:
+            storage (StorageInterface): Storage to write to
+            prefix (str): Prefix of the objects written
+        """
+        self.storage = storage
+        self.prefix = prefix.rstrip("/")
+
+    @abstractmethod
+    def write(self, post: Post):
+        """
+        Write a post
+
+        Args:
+            post (Post): Post to write
+        """
+
+    def flush(self):
+        """Write out any buffered posts"""
+
+    def close(self):
+        """Write out any buffered posts once the crawl is done"""
+        self.flush()
+
+
+class BatchingPostSink(PostSink):
+    """
+    Buffers records and writes them to storage in batches
+
+    A batch is flushed once it holds ``max_records`` records, about
+    ``max_bytes`` of data, or has been open for ``max_age`` seconds, and
+    when the sink is closed at the end of the crawl.
+    """
+
+    def __init__(
+        self,
+        storage: StorageInterface,
+        prefix: str,
+        max_records: int = settings.POST_SINK_MAX_RECORDS,
+        max_bytes: int = settings.POST_SINK_MAX_BYTES,
+        max_age: float = settings.POST_SINK_MAX_AGE,
+    ):
+        """
+        Initialize the sink
+
+        Args:
+            storage (StorageInterface): Storage to write to
+            prefix (str): Prefix of the batch files
+            max_records (int): Records per batch
+            max_bytes (int): Uncompressed bytes per batch
+            max_age (float): Seconds after which a batch is flushed
+        """
+        super().__init__(storage, prefix)
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.paths: List[str] = []
+        # Records in each batch file, for run manifests
+        self.record_counts: Dict[str, int] = {}
+
+        self._items: List[Any] = []
+        self._size = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def _encode_record(self, record: BaseModel) -> tuple:
+        """
+        Prepare a record for its batch
+
+        Returns:
+            tuple: (buffered item, approximate size in bytes)
+        """
+
+    @abstractmethod
+    def _write_batch(self, items: List[Any]):
+        """
+        Write a batch of buffered items to storage
+
+        Args:
+            items (List[Any]): Buffered items
+
+        Raises:
+            Exception: If the batch could not be written, it stays buffered
+        """
+
+    def write(self, post: BaseModel):
+        item, size = self._encode_record(post)
+
+        with self._lock:
+            if not self._items:
+                self._opened_at = time.monotonic()
+            self._items.append(item)
+            self._size += size
+
+            if (
+                len(self._items) >= self.max_records
+                or self._size >= self.max_bytes
+                or time.monotonic() - self._opened_at >= self.max_age
+            ):
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._items:
+            return
+
+        # The batch is kept if the upload fails, so a later flush can retry it
+        self._write_batch(self._items)
+        self._items = []
+        self._size = 0
+        self._opened_at = None
+
+
+class JSONPostSink(BatchingPostSink):
+    """
+    Writes every post as its own JSON object, named after its timestamp
+
+    By default each post is uploaded as it arrives. A max_records above 1
+    buffers posts in small batches that are uploaded concurrently, which
+    saves a storage round trip per post but holds up to ``max_records``
+    posts in memory until their batch is flushed.
+    """
+
+    def __init__(
+        self,
+        storage: StorageInterface,
+        prefix: str,
+        max_records: int = settings.POST_SINK_JSON_BATCH,
+        **kwargs,
+    ):
+        """
+        Initialize the sink
+
+        Args:
+            storage (StorageInterface): Storage to write to
+            prefix (str): Prefix of the post objects
+            max_records (int): Posts uploaded together
+            **kwargs: Other batching thresholds, see BatchingPostSink
+        """
+        super().__init__(storage, prefix, max_records=max_records, **kwargs)
+
+    def _encode_record(self, record: BaseModel) -> tuple:
+        return (
+            record.model_dump(),
+            key_layout.post_key(self.prefix, record.timestamp),
+        ), 0
+
+    def _write_batch(self, items: List[tuple]):
+        results = self.storage.upload_json_many(items)
+        failed = [result for result in results if not result["ok"]]
+        self.paths.extend(result["path"] for result in results if result["ok"])
+        if failed:
+            # Keep only the posts that failed, for a later flush to retry
+            failed_paths = {result["path"] for result in failed}
+            self._items = [item for item in items if item[1] in failed_paths]
+            raise OSError(
+                f"Failed to upload {len(failed)} posts, first error: {failed[0]['error']}"
+            )
+
+
+class BatchFilePostSink(BatchingPostSink):
+    """
+    Writes each batch of records to storage as one file
+    """
+
+    EXTENSION = ""
+    CONTENT_TYPE = "application/octet-stream"
+
+    @abstractmethod
+    def _encode_batch(self, items: List[Any]) -> bytes:
+        """Serialize a batch of buffered items into the content of a file"""
+
+    def _write_batch(self, items: List[Any]):
+        data = self._encode_batch(items)
+        path = f"{self.prefix}/part-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}{self.EXTENSION}"
+        self.storage.upload_bytes(data, path, content_type=self.CONTENT_TYPE)
+
+        logger.info(f"Flushed {len(items)} records to {path}")
+        self.paths.append(path)
+        self.record_counts[path] = len(items)
+
+
+class NDJSONPostSink(BatchFilePostSink):
+    """
+    Writes posts as gzipped JSON Lines files
+    """
+
+    EXTENSION = ".json.gz"
+    CONTENT_TYPE = "application/x-ndjson"
+
+    def _encode_record(self, record: BaseModel) -> tuple:
+        line = json.dumps(
+            record.model_dump(), ensure_ascii=False, separators=(",", ":")
+        ).encode("utf-8")
+        return line, len(line) + 1
+
+    def _encode_batch(self, items: List[bytes]) -> bytes:
+        return gzip.compress(b"\n".join(items) + b"\n")
+
+
+class ParquetSink(BatchFilePostSink):
+    """
+    Writes records as compressed, typed Parquet files
+
+    Each flush writes one file, split into row groups of ``row_group_size``
+    rows. Requires the pyarrow package.
+
+    A sink is closed at the end of each author's crawl, before the watermark
+    advances, so every author task leaves its own small files in the
+    partition. ParquetCompactor merges them once the partition is complete.
+    """
+
+    EXTENSION = ".parquet"
+    CONTENT_TYPE = "application/vnd.apache.parquet"
+
+    def __init__(
+        self,
+        storage: StorageInterface,
+        prefix: str,
+        schema,
+        timestamp_fields: tuple = (),
+        row_group_size: int = settings.PARQUET_ROW_GROUP_SIZE,
+        compression: str = settings.PARQUET_COMPRESSION,
+        **kwargs,
+    ):
+        """
+        Initialize the sink
+
+        Args:
+            storage (StorageInterface): Storage to write to
+            prefix (str): Prefix of the Parquet files
+            schema (pyarrow.Schema): Schema of the records
+            timestamp_fields (tuple): Fields holding ISO datetimes to store as timestamps
+            row_group_size (int): Rows per row group
+            compression (str): Parquet compression codec
+            **kwargs: Batching thresholds, see BatchingPostSink
+        """
+        super().__init__(storage, prefix, **kwargs)
+        self.schema = schema
+        self.timestamp_fields = timestamp_fields
+        self.row_group_size = row_group_size
+        self.compression = compression
+
+    def _encode_record(self, record: BaseModel) -> tuple:
+        row = record.model_dump()
+        for field in self.timestamp_fields:
+            if row.get(field):
+                row[field] = datetime.fromisoformat(row[field])
+        # Strings dominate the size of a row
+        size = sum(
+            len(value) if isinstance(value, str) else sum(map(len, value))
+            for value in row.values()
+            if isinstance(value, (str, list))
+        )
+        return row, size
+
+    def _encode_batch(self, items: List[Dict[str, Any]]) -> bytes:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pylist(items, schema=self.schema)
+        buffer = io.BytesIO()
+        pq.write_table(
+            table,
+            buffer,
+            row_group_size=self.row_group_size,
+            compression=self.compression,
+        )
+        return buffer.getvalue()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("The pyarrow package is required for Parquet output")
+    return pyarrow
+
+
+def get_post_schema():
+    """
+    Get the Parquet schema of posts
+
+    Returns:
+        pyarrow.Schema: Schema matching the Post model
+    """
+    pa = _require_pyarrow()
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("author_id", pa.string()),
+            ("text", pa.string()),
+            ("timestamp", pa.timestamp("us")),
+            ("likes", pa.int64()),
+            ("reposts", pa.int64()),
+            ("comments", pa.int64()),
+            ("media_urls", pa.list_(pa.string())),
+            ("media_local_paths", pa.list_(pa.string())),
+            ("media_object_names", pa.list_(pa.string())),
+        ]
+    )
+
+
+def get_author_schema():
+    """
+    Get the Parquet schema of authors
+
+    Returns:
+        pyarrow.Schema: Schema matching the Author model
+    """
+    pa = _require_pyarrow()
+    return pa.schema(
+        [
+            ("id", pa.string()),
+            ("name", pa.string()),
+            ("created_at", pa.timestamp("us")),
+            ("followers_count", pa.int64()),
+            ("following_count", pa.int64()),
+        ]
+    )
+
+
+class PostSinkFactory:
+    """
+    Factory class for creating post sinks
+    """
+
+    @staticmethod
+    def get_sink(
+        sink_type: str,
+        storage: StorageInterface,
+        platform: str,
+        author_id: str,
+        crawler_processing_timestamp,
+    ) -> PostSink:
+        """
+        Get a post sink based on the specified type
+
+        Args:
+            sink_type (str): Type of sink ('json', 'ndjson' or 'parquet')
+            storage (StorageInterface): Storage to write to
+            platform (str): Platform name
+            author_id (str): Author whose posts are written
+            crawler_processing_timestamp: Timestamp of the crawl run
+
+        Returns:
+            PostSink: Sink implementation
+        """
+        prefix = key_layout.post_prefix(
+            platform, author_id, crawler_processing_timestamp
+        )
+        if sink_type == "json":
+            return JSONPostSink(storage, prefix)
+        elif sink_type == "ndjson":
+            return NDJSONPostSink(storage, prefix)
+        elif sink_type == "parquet":
+            return ParquetSink(
+                storage,
+                key_layout.parquet_prefix(
+                    "user_post", platform, crawler_processing_timestamp
+                ),
+                get_post_schema(),
+                timestamp_fields=("timestamp",),
+                max_records=settings.PARQUET_MAX_RECORDS,
+                max_bytes=settings.PARQUET_MAX_BYTES,
+                max_age=settings.PARQUET_MAX_AGE,
+            )
+        else:
+            raise ValueError(f"Unsupported post sink: {sink_type}")
+
+    @staticmethod
+    def get_author_sink(
+        storage: StorageInterface, platform: str, crawler_processing_timestamp
+    ) -> ParquetSink:
+        """
+        Get a Parquet sink for author profiles
+
+        Args:
+            storage (StorageInterface): Storage to write to
+            platform (str): Platform name
+            crawler_processing_timestamp: Timestamp of the crawl run
+
+        Returns:
+            ParquetSink: Sink writing Author records
+        """
+        return ParquetSink(
+            storage,
+            key_layout.parquet_prefix(
+                "user_profil", platform, crawler_processing_timestamp
+            ),
+            get_author_schema(),
+            timestamp_fields=("created_at",),
+        )
@@ -0,0 +1,364 @@
+import itertools
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.core.logger import logger
+from app.storage.storage_interface import (
+    ObservedStorage,
+    StorageInterface,
+    WriteListener,
+)
+
+MANIFEST_PREFIX = "bronze/crawler/manifests"
+
+# Objects that describe the crawl rather than being crawled data
+EXCLUDED_PREFIXES = (MANIFEST_PREFIX + "/", "bronze/crawler/state/")
+
+
+def get_run_prefix(crawler_processing_timestamp, prefix: str = MANIFEST_PREFIX) -> str:
+    """
+    Get the prefix of the manifests of a crawl run
+
+    Args:
+        crawler_processing_timestamp: Timestamp of the crawl run
+        prefix (str): Prefix of all run manifests
+
+    Returns:
+        str: Prefix of the run's manifests
+    """
+    return f"{prefix}/run={crawler_processing_timestamp}"
+
+
+def get_author_manifest_path(
+    crawler_processing_timestamp, platform: str, author_id: str
+) -> str:
+    """Get the path of the manifest of one author's crawl within a run"""
+    return f"{get_run_prefix(crawler_processing_timestamp)}/authors/{platform}/{author_id}.json"
+
+
+def _summarize(objects: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Sort manifest entries and total their sizes and record counts"""
+    objects = sorted(objects, key=lambda entry: entry["path"])
+    return {
+        "objects": objects,
+        "object_count": len(objects),
+        "record_count": sum(entry.get("records") or 0 for entry in objects),
+        "total_bytes": sum(entry.get("size") or 0 for entry in objects),
+    }
+
+
+def _merge_entry(objects: Dict[str, Dict[str, Any]], entry: Dict[str, Any]):
+    """
+    Add a manifest entry to entries by path
+
+    Compacted parts are listed once per manifest with the sources each one
+    took from it, so the entries of a part merge their sources and records.
+    Other objects, such as content-addressed media shared by several
+    authors, keep their first entry.
+    """
+    existing = objects.get(entry["path"])
+    if existing is None:
+        objects[entry["path"]] = entry
+    elif (
+        "sources" in existing
+        and "sources" in entry
+        and set(existing["sources"]).isdisjoint(entry["sources"])
+    ):
+        objects[entry["path"]] = dict(
+            existing,
+            sources=sorted(existing["sources"] + entry["sources"]),
+            records=(existing.get("records") or 0) + (entry.get("records") or 0),
+        )
+
+
+class RunManifest(WriteListener):
+    """
+    Records the objects written for one author during a crawl run
+
+    The crawl writes through ``recorded_storage``, a view of the storage
+    that only this manifest listens to, so the writes of other crawls
+    sharing the storage aren't recorded. A crawl deferred by throttling writes what it recorded so far as a
+    part, and the invocation that completes the crawl merges the parts
+    into the author's manifest.
+    """
+
+    def __init__(
+        self,
+        storage: StorageInterface,
+        crawler_processing_timestamp,
+        platform: str,
+        author_id: str,
+    ):
+        """
+        Initialize the manifest
+
+        Args:
+            storage (StorageInterface): Storage the crawl writes to
+            crawler_processing_timestamp: Timestamp of the crawl run
+            platform (str): Platform name
+            author_id (str): Author being crawled
+        """
+        self.storage = storage
+        self.crawler_processing_timestamp = crawler_processing_timestamp
+        self.platform = platform
+        self.author_id = author_id
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self._sinks = []
+        self._lock = threading.Lock()
+        self.recorded_storage = ObservedStorage(storage)
+        self.recorded_storage.add_write_listener(self)
+
+    def on_write(self, path: str, size: Optional[int], records: Optional[int] = None):
+        if path.startswith(EXCLUDED_PREFIXES):
+            return
+        with self._lock:
+            self.objects[path] = {"path": path, "size": size, "records": records}
+
+    def on_move(self, source: str, destination: str):
+        with self._lock:
+            entry = self.objects.pop(source, None)
+            if entry is not None and destination not in self.objects:
+                self.objects[destination] = dict(entry, path=destination)
+
+    def on_delete(self, path: str):
+        with self._lock:
+            self.objects.pop(path, None)
+
+    def track_sink(self, sink):
+        """
+        Take the record counts of the batch files of a sink
+
+        Args:
+            sink (BatchingPostSink): Sink writing batch files
+        """
+        self._sinks.append(sink)
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """
+        Get the recorded objects
+
+        Returns:
+            List[Dict[str, Any]]: Entries with 'path', 'size' and 'records'
+        """
+        with self._lock:
+            for sink in self._sinks:
+                for path, records in getattr(sink, "record_counts", {}).items():
+                    if path in self.objects:
+                        self.objects[path]["records"] = records
+            return list(self.objects.values())
+
+    def _document(self, **extra) -> Dict[str, Any]:
+        return {
+            "run": str(self.crawler_processing_timestamp),
+            "platform": self.platform,
+            "author_id": self.author_id,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            **extra,
+            **_summarize(self.entries()),
+        }
+
+    def write_part(self, number: int) -> str:
+        """
+        Write the objects recorded so far as a part, and start over
+
+        Args:
+            number (int): Number of the part within the author's crawl
+
+        Returns:
+            str: Path of the part
+        """
+        path = (
+            f"{get_run_prefix(self.crawler_processing_timestamp)}/parts/"
+            f"{self.platform}/{self.author_id}/part-{number:05d}.json"
+        )
+        self.storage.upload_json(self._document(part=number), path)
+        with self._lock:
+            self.objects.clear()
+        return path
+
+    def write(self, part_paths: Iterable[str] = (), **extra) -> str:
+        """
+        Write the manifest of the author's crawl, merging earlier parts
+
+        Args:
+            part_paths (Iterable[str]): Parts written by deferred invocations
+            **extra: Additional fields, such as post counts
+
+        Returns:
+            str: Path of the manifest
+        """
+        parts = self.storage.read_json_many(list(part_paths))
+        with self._lock:
+            for part in parts.values():
+                for entry in part.get("objects", []):
+                    _merge_entry(self.objects, entry)
+
+        path = get_author_manifest_path(
+            self.crawler_processing_timestamp, self.platform, self.author_id
+        )
+        self.storage.upload_json(self._document(**extra), path)
+        logger.info(f"Wrote manifest of {len(self.objects)} objects to {path}")
+        return path
+
+
+def finalize_run(
+    storage: StorageInterface,
+    crawler_processing_timestamp,
+    platform: str,
+    author_ids: List[str],
+    force: bool = False,
+) -> Optional[Dict[str, Any]]:
+    """
+    Write the manifest of a crawl run and its _SUCCESS marker
+
+    The run manifest merges the manifests of its authors. The _SUCCESS
+    marker is written last, and only once every author's crawl completed,
+    so consumers that see it can read the run from its manifest without
+    listing the data.
+
+    Args:
+        storage (StorageInterface): Storage holding the run
+        crawler_processing_timestamp: Timestamp of the crawl run
+        platform (str): Platform name
+        author_ids (List[str]): Authors crawled in the run
+        force (bool): Write an incomplete manifest, without _SUCCESS, when
+            some authors have no manifest
+
+    Returns:
+        Optional[Dict[str, Any]]: Run manifest, or None if authors are
+        missing and force is False
+    """
+    paths = {
+        author_id: get_author_manifest_path(
+            crawler_processing_timestamp, platform, author_id
+        )
+        for author_id in author_ids
+    }
+    found = storage.read_json_many(list(paths.values()))
+    missing = [author_id for author_id, path in paths.items() if path not in found]
+    if missing and not force:
+        logger.info(
+            f"Run {crawler_processing_timestamp} is waiting for {len(missing)} authors"
+        )
+        return None
+
+    objects = {}
+    for manifest in found.values():
+        for entry in manifest.get("objects", []):
+            _merge_entry(objects, entry)
+
+    run_prefix = get_run_prefix(crawler_processing_timestamp)
+    manifest = {
+        "run": str(crawler_processing_timestamp),
+        "platform": platform,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "complete": not missing,
+        "authors": sorted(
+            author_id for author_id, path in paths.items() if path in found
+        ),
+        "missing_authors": sorted(missing),
+        "author_manifests": sorted(found),
+        **_summarize(objects.values()),
+    }
+    storage.upload_json(manifest, f"{run_prefix}/manifest.json")
+
+    if not missing:
+        storage.upload_bytes(b"", f"{run_prefix}/_SUCCESS", content_type="text/plain")
+        logger.info(
+            f"Finalized run {crawler_processing_timestamp} with "
+            f"{manifest['object_count']} objects"
+        )
+    else:
+        logger.warning(
+            f"Run {crawler_processing_timestamp} finalized without _SUCCESS, "
+            f"missing authors: {', '.join(missing)}"
+        )
+    return manifest
+
+
+def index_manifested_objects(
+    storage: StorageInterface, prefix: str
+) -> Dict[str, List[str]]:
+    """
+    Find the manifests listing the objects under a prefix
+
+    Args:
+        storage (StorageInterface): Storage with an iter_files() listing
+        prefix (str): Prefix of the objects
+
+    Returns:
+        Dict[str, List[str]]: Paths of the manifests listing each object
+    """
+    prefix = prefix.strip("/") + "/"
+    keys = (
+        key
+        for key in storage.iter_files(MANIFEST_PREFIX + "/")
+        if key.endswith(".json")
+    )
+    index = {}
+    while True:
+        batch = list(itertools.islice(keys, 100))
+        if not batch:
+            return index
+        for key, manifest in storage.read_json_many(batch).items():
+            for entry in manifest.get("objects", []):
+                if entry["path"].startswith(prefix):
+                    index.setdefault(entry["path"], []).append(key)
+
+
+def replace_objects(
+    storage: StorageInterface,
+    manifest_paths: Iterable[str],
+    sources: Iterable[str],
+    replacement: Dict[str, Any],
+) -> int:
+    """
+    Rewrite manifests to list an object in place of the objects it replaced
+
+    Compaction merges crawled objects into parts and archives them. The
+    manifests listing them are pointed at the part instead, with the
+    sources and records each one took from it, so completed runs never
+    list missing keys.
+
+    Args:
+        storage (StorageInterface): Storage holding the manifests
+        manifest_paths (Iterable[str]): Manifests that may list the objects
+        sources (Iterable[str]): Paths of the replaced objects
+        replacement (Dict[str, Any]): Entry of the new object, with 'path'
+            and 'size'
+
+    Returns:
+        int: Number of manifests rewritten
+    """
+    sources = set(sources)
+    rewritten = 0
+    for path, manifest in storage.read_json_many(list(manifest_paths)).items():
+        objects = {}
+        replaced = []
+        for entry in manifest.get("objects", []):
+            if entry["path"] in sources:
+                replaced.append(entry)
+            else:
+                objects[entry["path"]] = entry
+        if not replaced:
+            continue
+
+        _merge_entry(
+            objects,
+            dict(
+                replacement,
+                records=sum(entry.get("records") or 0 for entry in replaced),
+                sources=sorted(entry["path"] for entry in replaced),
+            ),
+        )
+        manifest.update(_summarize(objects.values()))
+        storage.upload_json(manifest, path)
+        rewritten += 1
+
+    if rewritten:
+        logger.info(
+            f"Pointed {rewritten} manifests at {replacement['path']} "
+            f"instead of its sources"
+        )
+    return rewritten
@@ -1,12 +1,101 @@
+import os
 from abc import ABC, abstractmethod
-from typing import Any, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Sequence, Tuple
+
+from app.config import settings
+from app.core.logger import logger
+from app.storage.codecs import Codec, CodecRules, codec_rules
+from app.utils.error_handler import retry_with_backoff
+
+
+class WriteListener:
+    """
+    Receives the changes a storage makes to its objects
+
+    Sizes are in bytes, or None when the storage doesn't know them.
+    """
+
+    def on_write(self, path: str, size: Optional[int], records: Optional[int] = None):
+        """Called after an object was written; records is 1 for JSON documents"""
+
+    def on_move(self, source: str, destination: str):
+        """Called after an object was moved"""
+
+    def on_delete(self, path: str):
+        """Called after an object was deleted"""
+
+
+class CountingReader:
+    """
+    Wraps a readable stream and counts the bytes read from it
+    """
+
+    def __init__(self, raw: BinaryIO):
+        self.raw = raw
+        self.count = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.count += len(data)
+        return data
 
 
 class StorageInterface(ABC):
     """
     Abstract interface for storage implementations
+
+    JSON documents are written with the codec (serializer and compression)
+    that ``codec_rules`` assigns to their path, and read back whatever codec
+    they were written with.
     """
 
+    codec_rules: CodecRules = codec_rules
+
+    def get_codec(self, path: str) -> Codec:
+        """
+        Get the codec JSON documents are written with at a path
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            Codec: Codec of the path
+        """
+        return self.codec_rules.codec_for(path)
+
+    def add_write_listener(self, listener: WriteListener):
+        """
+        Notify a listener of every object written, moved or deleted
+
+        Args:
+            listener (WriteListener): Listener to notify
+        """
+        # Replaced rather than mutated, so uploads running on other threads
+        # iterate over a consistent list
+        self._write_listeners = [*getattr(self, "_write_listeners", ()), listener]
+
+    def remove_write_listener(self, listener: WriteListener):
+        """
+        Stop notifying a listener added with add_write_listener()
+
+        Args:
+            listener (WriteListener): Listener to remove
+        """
+        self._write_listeners = [
+            other
+            for other in getattr(self, "_write_listeners", ())
+            if other is not listener
+        ]
+
+    def _notify(self, event: str, *args):
+        """Call a method of every write listener, logging their failures"""
+        for listener in getattr(self, "_write_listeners", ()):
+            try:
+                getattr(listener, event)(*args)
+            except Exception as e:
+                logger.warning(f"Write listener failed on {event}{args}: {e}")
+
     @abstractmethod
     def upload_json(self, data: Dict[str, Any], path: str) -> str:
         """
@@ -20,6 +109,22 @@ class StorageInterface(ABC):
             str: Path or identifier of the stored data
         """
 
+    @abstractmethod
+    def upload_bytes(
+        self, data: bytes, path: str, content_type: Optional[str] = None
+    ) -> str:
+        """
+        Upload serialized data, such as a batch of records, to storage
+
+        Args:
+            data (bytes): Serialized data
+            path (str): Path within the storage
+            content_type (str, optional): MIME type of the data
+
+        Returns:
+            str: Path or identifier of the stored data
+        """
+
     @abstractmethod
     def upload_file(self, filepath: str, object_name: str) -> str:
         """
@@ -33,6 +138,335 @@ class StorageInterface(ABC):
             str: Path or identifier of the stored file
         """
 
+    @abstractmethod
+    def upload_stream(
+        self,
+        stream: BinaryIO,
+        object_name: str,
+        length: int = -1,
+        content_type: Optional[str] = None,
+    ) -> str:
+        """
+        Upload the content of a readable stream to storage
+
+        The stream is consumed in bounded chunks, so its content is never
+        held in memory or written to a temporary file in full.
+
+        Args:
+            stream (BinaryIO): Object with a read(size) method
+            object_name (str): Destination path within storage
+            length (int): Size of the content in bytes, or -1 if unknown
+            content_type (str, optional): MIME type of the content
+
+        Returns:
+            str: Path or identifier of the stored object
+        """
+
+    @abstractmethod
+    def move(self, source: str, destination: str) -> str:
+        """
+        Move an object to another path within storage
+
+        Args:
+            source (str): Current path of the object
+            destination (str): New path of the object
+
+        Returns:
+            str: Path or identifier of the moved object
+        """
+
+    @abstractmethod
+    def delete(self, path: str):
+        """
+        Delete an object from storage, ignoring missing objects
+
+        Args:
+            path (str): Path within the storage
+        """
+
+    @abstractmethod
+    def read_json(self, path: str) -> Dict[str, Any]:
+        """
+        Read JSON data from storage
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            Dict[str, Any]: JSON data
+
+        Raises:
+            FileNotFoundError: If nothing is stored at the path
+        """
+
+    @abstractmethod
+    def read_bytes(self, path: str) -> bytes:
+        """
+        Read the content of an object written with upload_bytes
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            bytes: Content of the object
+
+        Raises:
+            FileNotFoundError: If nothing is stored at the path
+        """
+
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        """
+        Check whether an object is stored at a path
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            bool: True if an object exists at the path
+        """
+
+    def _run_many(
+        self,
+        upload: Callable[..., str],
+        items: Sequence[Tuple[Any, str]],
+        max_workers: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Run uploads concurrently on a bounded thread pool, retrying failures
+
+        Args:
+            upload (Callable): Single-object upload method
+            items (Sequence[Tuple[Any, str]]): (source, destination path) pairs
+            max_workers (int, optional): Maximum number of concurrent uploads
+            max_retries (int, optional): Retries of a failed upload
+
+        Returns:
+            List[Dict[str, Any]]: One result per item, in order, with 'path',
+            'ok', 'result' and 'error'
+        """
+        if max_workers is None:
+            max_workers = settings.STORAGE_UPLOAD_WORKERS
+        if max_retries is None:
+            max_retries = settings.STORAGE_UPLOAD_RETRIES
+
+        upload_with_retry = retry_with_backoff(
+            max_retries=max_retries,
+            base_delay=settings.STORAGE_UPLOAD_RETRY_DELAY,
+            max_delay=10,
+        )(upload)
+
+        def run(item):
+            source, path = item
+            try:
+                return {
+                    "path": path,
+                    "ok": True,
+                    "result": upload_with_retry(source, path),
+                    "error": None,
+                }
+            except Exception as e:
+                return {"path": path, "ok": False, "result": None, "error": str(e)}
+
+        if len(items) <= 1:
+            results = [run(item) for item in items]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=max(min(max_workers, len(items)), 1),
+                thread_name_prefix="storage-upload",
+            ) as executor:
+                results = list(executor.map(run, items))
+
+        failed = [result for result in results if not result["ok"]]
+        if failed:
+            logger.error(f"{len(failed)} of {len(items)} uploads failed")
+        return results
+
+    def upload_json_many(
+        self,
+        items: Sequence[Tuple[Dict[str, Any], str]],
+        max_workers: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Upload several JSON documents concurrently
+
+        A failed upload is retried with backoff and then reported in its
+        result, without affecting the other uploads.
+
+        Args:
+            items (Sequence[Tuple[Dict[str, Any], str]]): (data, path) pairs
+            max_workers (int, optional): Maximum number of concurrent uploads
+            max_retries (int, optional): Retries of a failed upload
+
+        Returns:
+            List[Dict[str, Any]]: One result per item, in order, with 'path',
+            'ok', 'result' and 'error'
+        """
+        return self._run_many(self.upload_json, items, max_workers, max_retries)
+
+    def upload_many(
+        self,
+        items: Sequence[Tuple[str, str]],
+        max_workers: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Upload several files concurrently
+
+        A failed upload is retried with backoff and then reported in its
+        result, without affecting the other uploads.
+
+        Args:
+            items (Sequence[Tuple[str, str]]): (source file path, object name) pairs
+            max_workers (int, optional): Maximum number of concurrent uploads
+            max_retries (int, optional): Retries of a failed upload
+
+        Returns:
+            List[Dict[str, Any]]: One result per item, in order, with 'path',
+            'ok', 'result' and 'error'
+        """
+        return self._run_many(self.upload_file, items, max_workers, max_retries)
+
+    def move_many(
+        self,
+        items: Sequence[Tuple[str, str]],
+        max_workers: Optional[int] = None,
+        max_retries: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Move several objects concurrently
+
+        A failed move is retried with backoff and then reported in its
+        result, without affecting the other moves.
+
+        Args:
+            items (Sequence[Tuple[str, str]]): (source path, destination path) pairs
+            max_workers (int, optional): Maximum number of concurrent moves
+            max_retries (int, optional): Retries of a failed move
+
+        Returns:
+            List[Dict[str, Any]]: One result per item, in order, with 'path'
+            (the destination), 'ok', 'result' and 'error'
+        """
+        return self._run_many(self.move, items, max_workers, max_retries)
+
+    def read_json_many(
+        self, paths: Sequence[str], max_workers: Optional[int] = None
+    ) -> Dict[str, Dict[str, Any]]:
+        """
+        Read several JSON documents in one call
+
+        Args:
+            paths (Sequence[str]): Paths within the storage
+            max_workers (int, optional): Maximum number of concurrent reads
+
+        Returns:
+            Dict[str, Dict[str, Any]]: JSON data by path, without the paths
+            where nothing is stored
+        """
+        if max_workers is None:
+            max_workers = settings.STORAGE_UPLOAD_WORKERS
+
+        def read(path):
+            try:
+                return path, self.read_json(path)
+            except FileNotFoundError:
+                return path, None
+
+        paths = list(dict.fromkeys(paths))
+        if len(paths) <= 1:
+            results = [read(path) for path in paths]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=max(min(max_workers, len(paths)), 1),
+                thread_name_prefix="storage-read",
+            ) as executor:
+                results = list(executor.map(read, paths))
+
+        return {path: data for path, data in results if data is not None}
+
+
+class ObservedStorage(StorageInterface):
+    """
+    View of a storage that notifies its own write listeners
+
+    Storages are shared by the tasks of a worker, so a listener added to
+    one hears the writes of every task. Writes made through this view go to
+    the wrapped storage, but only the listeners of the view are notified,
+    and the wrapped storage is left untouched.
+    """
+
+    def __init__(self, storage: StorageInterface):
+        """
+        Initialize the view
+
+        Args:
+            storage (StorageInterface): Storage to write to
+        """
+        self.storage = storage
+        # Set here, or the lookup would fall through to the wrapped storage
+        self._write_listeners = []
+
+    def __getattr__(self, name: str):
+        # Listings, local paths and other storage-specific methods
+        return getattr(self.storage, name)
+
+    def get_codec(self, path: str) -> Codec:
+        return self.storage.get_codec(path)
+
+    def upload_json(self, data: Dict[str, Any], path: str) -> str:
+        result = self.storage.upload_json(data, path)
+        if self._write_listeners:
+            # Sized here, as the wrapped storage only reports it to its own
+            # listeners
+            size = len(self.get_codec(path).encode(data))
+            self._notify("on_write", path, size, 1)
+        return result
+
+    def upload_bytes(
+        self, data: bytes, path: str, content_type: Optional[str] = None
+    ) -> str:
+        result = self.storage.upload_bytes(data, path, content_type=content_type)
+        self._notify("on_write", path, len(data))
+        return result
+
+    def upload_file(self, filepath: str, object_name: str) -> str:
+        result = self.storage.upload_file(filepath, object_name)
+        self._notify("on_write", object_name, os.path.getsize(filepath))
+        return result
+
+    def upload_stream(
+        self,
+        stream: BinaryIO,
+        object_name: str,
+        length: int = -1,
+        content_type: Optional[str] = None,
+    ) -> str:
+        stream = CountingReader(stream)
+        result = self.storage.upload_stream(stream, object_name, length, content_type)
+        self._notify("on_write", object_name, stream.count)
+        return result
+
+    def move(self, source: str, destination: str) -> str:
+        result = self.storage.move(source, destination)
+        self._notify("on_move", source, destination)
+        return result
+
+    def delete(self, path: str):
+        self.storage.delete(path)
+        self._notify("on_delete", path)
+
+    def read_json(self, path: str) -> Dict[str, Any]:
+        return self.storage.read_json(path)
+
+    def read_bytes(self, path: str) -> bytes:
+        return self.storage.read_bytes(path)
+
+    def exists(self, path: str) -> bool:
+        return self.storage.exists(path)
+
 
 class StorageFactory:
     """
@@ -45,7 +479,7 @@ class StorageFactory:
         Get a storage instance based on the specified type
 
         Args:
-            storage_type (str): Type of storage ('local' or 'minio')
+            storage_type (str): Type of storage ('local', 'minio' or 'tiered')
 
         Returns:
             StorageInterface: Storage implementation
@@ -58,5 +492,9 @@ class StorageFactory:
             from app.storage.minio_client import MinIOStorage
 
             return MinIOStorage()
+        elif storage_type == "tiered":
+            from app.storage.tiered_storage import get_tiered_storage
+
+            return get_tiered_storage()
         else:
             raise ValueError(f"Unsupported storage type: {storage_type}")
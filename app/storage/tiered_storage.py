@@ -0,0 +1,746 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from app.config import settings
+from app.core.logger import logger
+from app.storage.local_storage import LocalStorage
+from app.storage.storage_interface import StorageFactory, StorageInterface
+
+# Seconds after which the entry of a write that never completed is
+# replicated anyway, in case its writer died before committing it
+UNCOMMITTED_TIMEOUT = 600
+
+# Entries superseded by a later entry of their path
+NEWER_ENTRY = (
+    "EXISTS (SELECT 1 FROM journal AS newer "
+    "WHERE newer.path = journal.path AND newer.id > journal.id)"
+)
+
+
+class ReplicationJournal:
+    """
+    Append-only journal of the writes a spool still has to replicate
+
+    Every write to the spool appends an entry before it is made, and
+    commits it once it is. Only the last entry of a path is replicated: it
+    carries the current state of the spool, so earlier entries of the path,
+    such as a delete still waiting for its retry, are never applied after
+    it. The replicator marks entries done once their object reached the
+    remote storage, or schedules a retry with exponential backoff when it
+    didn't.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the journal
+
+        Args:
+            path (str): Path to the SQLite database file
+        """
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS journal ("
+                    "id INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, "
+                    "path TEXT NOT NULL, content_type TEXT, created_at REAL NOT NULL, "
+                    "attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, "
+                    "last_error TEXT, replicated_at REAL)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS journal_pending "
+                    "ON journal (replicated_at, next_attempt)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS journal_path ON journal (path)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS drain_lease "
+                    "(id INTEGER PRIMARY KEY CHECK (id = 1), owner TEXT, expires REAL)"
+                )
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # A connection per operation keeps the journal safe across forks
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def append(
+        self,
+        op: str,
+        path: str,
+        content_type: Optional[str] = None,
+        committed: bool = True,
+    ) -> int:
+        """
+        Append a write to replicate
+
+        Args:
+            op (str): 'json', 'bytes' or 'file' to upload the path, 'delete' to remove it
+            path (str): Path within the storage
+            content_type (str, optional): MIME type of 'bytes' objects
+            committed (bool): False for a write not made yet, which isn't
+                replicated before commit() or UNCOMMITTED_TIMEOUT
+
+        Returns:
+            int: ID of the entry
+        """
+        now = time.time()
+        next_attempt = now if committed else now + UNCOMMITTED_TIMEOUT
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(
+                    "INSERT INTO journal (op, path, content_type, created_at, next_attempt) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (op, path, content_type, now, next_attempt),
+                ).lastrowid
+        finally:
+            conn.close()
+
+    def commit(self, id: int):
+        """
+        Make the entry of a completed write due for replication
+
+        An entry replicated before its write completed is replicated again,
+        unless a later entry of its path replaced it.
+
+        Args:
+            id (int): ID of the entry
+        """
+        self._execute(
+            "UPDATE journal SET next_attempt = ?, "
+            f"replicated_at = CASE WHEN {NEWER_ENTRY} THEN replicated_at END "
+            "WHERE id = ?",
+            (time.time(), id),
+        )
+
+    def remove(self, id: int):
+        """
+        Remove the entry of a write that failed
+
+        Args:
+            id (int): ID of the entry
+        """
+        self._execute("DELETE FROM journal WHERE id = ?", (id,))
+
+    def last_entry(self, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the most recent entry of a path
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            Optional[Dict[str, Any]]: Entry with 'op' and 'content_type', or None
+        """
+        rows = self._execute(
+            "SELECT op, content_type FROM journal WHERE path = ? ORDER BY id DESC LIMIT 1",
+            (path,),
+        )
+        if not rows:
+            return None
+        return {"op": rows[0][0], "content_type": rows[0][1]}
+
+    def due(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Get the oldest entries that are ready to be replicated
+
+        Entries superseded by a later entry of their path are left out, they
+        are marked done when that entry is replicated.
+
+        Args:
+            limit (int): Maximum number of entries
+
+        Returns:
+            List[Dict[str, Any]]: Entries in write order, at most one per path
+        """
+        rows = self._execute(
+            "SELECT id, op, path, content_type, attempts FROM journal "
+            "WHERE replicated_at IS NULL AND next_attempt <= ? "
+            f"AND NOT {NEWER_ENTRY} ORDER BY id LIMIT ?",
+            (time.time(), limit),
+        )
+        return [
+            {
+                "id": id,
+                "op": op,
+                "path": path,
+                "content_type": content_type,
+                "attempts": attempts,
+            }
+            for id, op, path, content_type, attempts in rows
+        ]
+
+    def mark_done(self, ids: List[int], supersede: bool = False):
+        """
+        Mark entries as replicated
+
+        Args:
+            ids (List[int]): IDs of the entries
+            supersede (bool): Also mark the earlier pending entries of their
+                paths, which the replicated entries replaced
+        """
+        now = time.time()
+        if supersede:
+            sql = (
+                "UPDATE journal SET replicated_at = ? WHERE replicated_at IS NULL "
+                "AND path = (SELECT path FROM journal WHERE id = ?) AND id <= ?"
+            )
+            params = ((now, id, id) for id in ids)
+        else:
+            sql = "UPDATE journal SET replicated_at = ? WHERE id = ?"
+            params = ((now, id) for id in ids)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.executemany(sql, params)
+        finally:
+            conn.close()
+
+    def mark_failed(self, id: int, attempts: int, error: str, max_delay: float):
+        """
+        Schedule the retry of an entry that failed to replicate
+
+        Args:
+            id (int): ID of the entry
+            attempts (int): Failed attempts so far, including this one
+            error (str): Error of the attempt
+            max_delay (float): Longest delay between attempts in seconds
+        """
+        delay = min(2**attempts, max_delay)
+        self._execute(
+            "UPDATE journal SET attempts = ?, last_error = ?, next_attempt = ? WHERE id = ?",
+            (attempts, error, time.time() + delay, id),
+        )
+
+    def pending_count(self) -> int:
+        """
+        Count the entries not replicated yet
+
+        Returns:
+            int: Number of pending entries
+        """
+        return self._execute(
+            "SELECT COUNT(*) FROM journal WHERE replicated_at IS NULL"
+        )[0][0]
+
+    def has_pending(self, path: str) -> bool:
+        """Check whether a path has entries not replicated yet"""
+        return bool(
+            self._execute(
+                "SELECT 1 FROM journal WHERE path = ? AND replicated_at IS NULL LIMIT 1",
+                (path,),
+            )
+        )
+
+    def replicated_before(self, cutoff: float) -> List[Dict[str, Any]]:
+        """
+        Get the uploads replicated before a time
+
+        Args:
+            cutoff (float): Unix timestamp
+
+        Returns:
+            List[Dict[str, Any]]: Entries with 'id', 'path' and 'replicated_at'
+        """
+        rows = self._execute(
+            "SELECT id, path, replicated_at FROM journal "
+            "WHERE replicated_at IS NOT NULL AND replicated_at < ? AND op != 'delete'",
+            (cutoff,),
+        )
+        return [{"id": id, "path": path, "replicated_at": at} for id, path, at in rows]
+
+    def forget_before(self, cutoff: float):
+        """
+        Remove the entries replicated before a time
+
+        Args:
+            cutoff (float): Unix timestamp
+        """
+        self._execute(
+            "DELETE FROM journal WHERE replicated_at IS NOT NULL AND replicated_at < ?",
+            (cutoff,),
+        )
+
+    def acquire_lease(self, owner: str, duration: float) -> bool:
+        """
+        Take the exclusive right to drain the journal
+
+        Draining in one place at a time keeps the writes of a path in order.
+
+        Args:
+            owner (str): Identity of the drainer
+            duration (float): Seconds after which the lease expires
+
+        Returns:
+            bool: True if the lease was taken
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR IGNORE INTO drain_lease (id, owner, expires) VALUES (1, NULL, 0)"
+                )
+                cursor = conn.execute(
+                    "UPDATE drain_lease SET owner = ?, expires = ? "
+                    "WHERE id = 1 AND (expires < ? OR owner = ?)",
+                    (owner, now + duration, now, owner),
+                )
+                return cursor.rowcount == 1
+        finally:
+            conn.close()
+
+    def release_lease(self, owner: str):
+        """Release a lease taken with acquire_lease()"""
+        self._execute(
+            "UPDATE drain_lease SET owner = NULL, expires = 0 WHERE id = 1 AND owner = ?",
+            (owner,),
+        )
+
+
+class TieredStorage(StorageInterface):
+    """
+    Storage that commits writes to a local spool and replicates them asynchronously
+
+    Writes go through a LocalStorage and are recorded in a replication
+    journal, so they return at local disk speed and survive a slow or
+    unavailable remote storage. A replicator drains the journal to the
+    remote storage in batches, retrying failed objects with backoff. Reads
+    are served from the spool, then from the remote storage once replicated
+    files were pruned from the spool.
+    """
+
+    def __init__(
+        self,
+        local: Optional[LocalStorage] = None,
+        remote: Optional[StorageInterface] = None,
+        replication_interval: float = settings.TIERED_REPLICATION_INTERVAL,
+    ):
+        """
+        Initialize the tiered storage
+
+        Args:
+            local (LocalStorage, optional): Spool storage (default: TIERED_SPOOL_DIR)
+            remote (StorageInterface, optional): Storage to replicate to
+                (default: TIERED_REMOTE, created on first use)
+            replication_interval (float): Seconds between background drains
+                (0 to only replicate through replicate())
+        """
+        self.local = local or LocalStorage(base_dir=settings.TIERED_SPOOL_DIR)
+        self._remote = remote
+        self.replication_interval = replication_interval
+        self.journal = ReplicationJournal(
+            os.path.join(self.local.base_dir, "replication.sqlite")
+        )
+        # The replicator runs in the process that writes, restarted after a fork
+        self._replicator_pid = None
+        self._replicator_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    @property
+    def remote(self) -> StorageInterface:
+        """Storage the spool is replicated to"""
+        if self._remote is None:
+            self._remote = StorageFactory.get_storage(settings.TIERED_REMOTE)
+        return self._remote
+
+    @contextmanager
+    def _journaled(self, op: str, path: str, content_type: Optional[str] = None):
+        """
+        Journal a write to the spool around the block making it
+
+        The entry is appended before the write, so a write is never left in
+        the spool without one, and committed after it, so the replicator
+        never sends a half-written file. A failed write removes its entry.
+        """
+        entry_id = self.journal.append(op, path, content_type, committed=False)
+        try:
+            yield
+        except BaseException:
+            self.journal.remove(entry_id)
+            raise
+        self.journal.commit(entry_id)
+        self._start_replicator()
+
+    def _spooled_size(self, path: str) -> int:
+        return os.path.getsize(self.local.local_path(path))
+
+    def upload_json(self, data: Dict[str, Any], path: str) -> str:
+        """
+        Write JSON data to the spool and queue it for replication
+
+        Args:
+            data (Dict[str, Any]): JSON-serializable data
+            path (str): Path within the storage
+
+        Returns:
+            str: Path of the object
+        """
+        with self._journaled("json", path):
+            self.local.upload_json(data, path)
+        self._notify("on_write", path, self._spooled_size(path), 1)
+        return path
+
+    def upload_bytes(
+        self, data: bytes, path: str, content_type: Optional[str] = None
+    ) -> str:
+        """
+        Write serialized data to the spool and queue it for replication
+
+        Args:
+            data (bytes): Serialized data
+            path (str): Path within the storage
+            content_type (str, optional): MIME type of the data
+
+        Returns:
+            str: Path of the object
+        """
+        with self._journaled("bytes", path, content_type):
+            self.local.upload_bytes(data, path, content_type=content_type)
+        self._notify("on_write", path, len(data))
+        return path
+
+    def upload_file(self, filepath: str, object_name: str) -> str:
+        """
+        Copy a file to the spool and queue it for replication
+
+        Args:
+            filepath (str): Source file path
+            object_name (str): Destination path within storage
+
+        Returns:
+            str: Path of the object
+        """
+        with self._journaled("file", object_name):
+            self.local.upload_file(filepath, object_name)
+        self._notify("on_write", object_name, self._spooled_size(object_name))
+        return object_name
+
+    def upload_stream(
+        self,
+        stream: BinaryIO,
+        object_name: str,
+        length: int = -1,
+        content_type: Optional[str] = None,
+    ) -> str:
+        """
+        Write the content of a stream to the spool and queue it for replication
+
+        Args:
+            stream (BinaryIO): Object with a read(size) method
+            object_name (str): Destination path within storage
+            length (int): Size of the content in bytes, or -1 if unknown
+            content_type (str, optional): MIME type of the content
+
+        Returns:
+            str: Path of the object
+        """
+        with self._journaled("file", object_name):
+            self.local.upload_stream(stream, object_name, length, content_type)
+        self._notify("on_write", object_name, self._spooled_size(object_name))
+        return object_name
+
+    def move(self, source: str, destination: str) -> str:
+        """
+        Move an object within the spool and queue the move for replication
+
+        The move is replicated as an upload of the destination followed by
+        the removal of the source.
+
+        Args:
+            source (str): Current path of the object
+            destination (str): New path of the object
+
+        Returns:
+            str: Path of the moved object
+        """
+        last = self.journal.last_entry(source)
+        if last and last["op"] != "delete":
+            op, content_type = last["op"], last["content_type"]
+        elif self.local.local_path(source).startswith(self.local.media_dir + os.sep):
+            op, content_type = "file", None
+        else:
+            op, content_type = "bytes", None
+
+        with (
+            self._journaled(op, destination, content_type),
+            self._journaled("delete", source),
+        ):
+            self.local.move(source, destination)
+        self._notify("on_move", source, destination)
+        return destination
+
+    def delete(self, path: str):
+        """
+        Delete an object from the spool and queue its removal for replication
+
+        Args:
+            path (str): Path within the storage
+        """
+        with self._journaled("delete", path):
+            self.local.delete(path)
+        self._notify("on_delete", path)
+
+    def read_json(self, path: str) -> Dict[str, Any]:
+        """
+        Read JSON data from the spool, or from the remote storage
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            Dict[str, Any]: JSON data
+        """
+        if self.local.exists(path):
+            return self.local.read_json(path)
+        return self.remote.read_json(path)
+
+    def read_bytes(self, path: str) -> bytes:
+        """
+        Read the content of an object from the spool, or from the remote storage
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            bytes: Content of the object
+        """
+        if self.local.exists(path):
+            return self.local.read_bytes(path)
+        return self.remote.read_bytes(path)
+
+    def exists(self, path: str) -> bool:
+        """
+        Check whether an object is in the spool or in the remote storage
+
+        An unreachable remote storage counts as not having the object, so
+        the caller writes it again, which is harmless.
+
+        Args:
+            path (str): Path within the storage
+
+        Returns:
+            bool: True if the object exists
+        """
+        if self.local.exists(path):
+            return True
+        # Written here and pruned from the spool once replicated
+        last = self.journal.last_entry(path)
+        if last and last["op"] != "delete":
+            return True
+        try:
+            return self.remote.exists(path)
+        except Exception as e:
+            logger.warning(f"Could not check {path} in remote storage: {e}")
+            return False
+
+    def _replicate_entry(self, entry: Dict[str, Any], path: str) -> str:
+        """Apply one journal entry to the remote storage"""
+        op = entry["op"]
+        if op == "delete":
+            self.remote.delete(path)
+        elif op == "json":
+            self.remote.upload_json(self.local.read_json(path), path)
+        elif op == "bytes":
+            with open(self.local.local_path(path), "rb") as f:
+                data = f.read()
+            self.remote.upload_bytes(data, path, content_type=entry["content_type"])
+        else:
+            self.remote.upload_file(self.local.local_path(path), path)
+        return path
+
+    def _replicate_batch(self, entries: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Replicate a batch of journal entries
+
+        Uploads are applied before removals, so a moved object is never
+        missing from both of its paths. A replicated entry also settles the
+        earlier entries of its path.
+
+        Args:
+            entries (List[Dict[str, Any]]): Entries in write order, at most
+                one per path
+
+        Returns:
+            Dict[str, int]: Counts of 'replicated' and 'failed' entries
+        """
+        missing = []
+        to_apply = []
+        for entry in entries:
+            if entry["op"] != "delete" and not self.local.exists(entry["path"]):
+                # The write never reached the spool, so the earlier entries
+                # of the path still describe it
+                logger.warning(
+                    f"Spooled object {entry['path']} is missing, skipping it"
+                )
+                missing.append(entry["id"])
+            else:
+                to_apply.append(entry)
+        self.journal.mark_done(missing)
+
+        results = []
+        uploads = [entry for entry in to_apply if entry["op"] != "delete"]
+        removals = [entry for entry in to_apply if entry["op"] == "delete"]
+        for group in (uploads, removals):
+            results.extend(
+                zip(
+                    group,
+                    self._run_many(
+                        self._replicate_entry,
+                        [(entry, entry["path"]) for entry in group],
+                    ),
+                )
+            )
+
+        done = [entry["id"] for entry, result in results if result["ok"]]
+        self.journal.mark_done(done, supersede=True)
+        for entry, result in results:
+            if not result["ok"]:
+                self.journal.mark_failed(
+                    entry["id"],
+                    entry["attempts"] + 1,
+                    result["error"],
+                    settings.TIERED_RETRY_MAX_DELAY,
+                )
+        return {"replicated": len(done), "failed": len(results) - len(done)}
+
+    def replicate(
+        self, batch_size: int = settings.TIERED_REPLICATION_BATCH
+    ) -> Dict[str, int]:
+        """
+        Drain the journal to the remote storage
+
+        Replicates every entry that is due, one batch at a time, then prunes
+        the spool. Returns right away if another process is draining.
+
+        Args:
+            batch_size (int): Entries replicated together
+
+        Returns:
+            Dict[str, int]: Counts of 'replicated', 'failed' and 'pending' entries
+        """
+        stats = {"replicated": 0, "failed": 0}
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        lease = max(self.replication_interval, 60) * 5
+        if not self.journal.acquire_lease(owner, lease):
+            stats["pending"] = self.journal.pending_count()
+            return stats
+
+        try:
+            while True:
+                entries = self.journal.due(batch_size)
+                if not entries:
+                    break
+                batch_stats = self._replicate_batch(entries)
+                for key in stats:
+                    stats[key] += batch_stats[key]
+                # Keep the lease while draining
+                self.journal.acquire_lease(owner, lease)
+                if batch_stats["replicated"] == 0:
+                    # Nothing got through, leave the rest to the next drain
+                    break
+            self.prune()
+        finally:
+            self.journal.release_lease(owner)
+
+        stats["pending"] = self.journal.pending_count()
+        if stats["replicated"] or stats["failed"]:
+            logger.info(
+                f"Replicated {stats['replicated']} objects, {stats['failed']} failed, "
+                f"{stats['pending']} pending"
+            )
+        return stats
+
+    def prune(self, retention: float = settings.TIERED_SPOOL_RETENTION):
+        """
+        Remove replicated files from the spool
+
+        A file is only removed if it has no pending writes and wasn't
+        rewritten since it was replicated.
+
+        Args:
+            retention (float): Seconds replicated files are kept (0 to keep them)
+        """
+        if not retention:
+            return
+
+        cutoff = time.time() - retention
+        removed = 0
+        for entry in self.journal.replicated_before(cutoff):
+            path = entry["path"]
+            if not self.local.exists(path) or self.journal.has_pending(path):
+                continue
+            try:
+                if (
+                    os.path.getmtime(self.local.local_path(path))
+                    > entry["replicated_at"]
+                ):
+                    continue
+            except FileNotFoundError:
+                continue
+            self.local.delete(path)
+            removed += 1
+
+        self.journal.forget_before(cutoff)
+        if removed:
+            logger.info(f"Pruned {removed} replicated files from {self.local.base_dir}")
+
+    def _start_replicator(self):
+        """Start the background replicator of this process, if not running"""
+        if not self.replication_interval:
+            return
+
+        with self._replicator_lock:
+            if self._replicator_pid == os.getpid():
+                return
+            self._replicator_pid = os.getpid()
+            self._wakeup = threading.Event()
+            thread = threading.Thread(
+                target=self._run_replicator, name="spool-replicator", daemon=True
+            )
+            thread.start()
+
+    def _run_replicator(self):
+        while True:
+            try:
+                self.replicate()
+            except Exception as e:
+                logger.error(f"Spool replication failed: {e}")
+            self._wakeup.wait(self.replication_interval)
+            self._wakeup.clear()
+
+
+# Shared by the tasks of a process, so they share the background replicator
+_tiered_storage = None
+_tiered_storage_lock = threading.Lock()
+
+
+def get_tiered_storage() -> TieredStorage:
+    """
+    Get the tiered storage of this process, creating it on first use
+
+    Returns:
+        TieredStorage: Storage configured from settings
+    """
+    global _tiered_storage
+    with _tiered_storage_lock:
+        if _tiered_storage is None:
+            _tiered_storage = TieredStorage()
+        return _tiered_storage
@@ -0,0 +1,65 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from app.core.logger import logger
+from app.storage.storage_interface import StorageInterface
+
+
+class WatermarkStore:
+    """
+    Per-author crawl watermarks kept alongside the crawled data
+
+    A watermark records the newest submission stored for an author on a
+    platform, so that later crawls only fetch content newer than it.
+    """
+
+    def __init__(
+        self, storage: StorageInterface, prefix: str = "bronze/crawler/state/watermarks"
+    ):
+        """
+        Initialize the watermark store
+
+        Args:
+            storage (StorageInterface): Storage holding the watermarks
+            prefix (str): Path prefix for watermark objects
+        """
+        self.storage = storage
+        self.prefix = prefix
+
+    def _path(self, platform: str, author_id: str) -> str:
+        return f"{self.prefix}/{platform}/{author_id}.json"
+
+    def get(self, platform: str, author_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the watermark of an author
+
+        Args:
+            platform (str): Platform name
+            author_id (str): ID of the author
+
+        Returns:
+            Optional[Dict[str, Any]]: Watermark with 'fullname' and 'created_utc',
+            or None if the author was never crawled
+        """
+        try:
+            return self.storage.read_json(self._path(platform, author_id))
+        except FileNotFoundError:
+            return None
+
+    def set(self, platform: str, author_id: str, fullname: str, created_utc: float):
+        """
+        Set the watermark of an author
+
+        Args:
+            platform (str): Platform name
+            author_id (str): ID of the author
+            fullname (str): Fullname of the newest stored submission
+            created_utc (float): Creation time of the newest stored submission
+        """
+        watermark = {
+            "fullname": fullname,
+            "created_utc": created_utc,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+        self.storage.upload_json(watermark, self._path(platform, author_id))
+        logger.info(f"Updated {platform} watermark for {author_id} to {fullname}")
@@ -31,6 +31,11 @@ def retry_with_backoff(
     """
     Decorator for retrying functions with exponential backoff
 
+    The backoff always sleeps in place, even where long waits may be
+    deferred: a rescheduled task would start its retries over, so an error
+    that never clears would be retried forever. Rate limit waits are
+    deferred by the rate limiters the retried calls go through.
+
     Args:
         max_retries (int): Maximum number of retries
         base_delay (int): Base delay in seconds
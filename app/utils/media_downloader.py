@@ -1,23 +1,174 @@
 import hashlib
+import json
 import os
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from urllib.parse import urlparse
 from urllib.request import getproxies
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from app.config import settings
 from app.core.logger import logger
-from app.utils.throttling import wait_random_delay
+from app.storage.key_layout import MEDIA_PREFIX, key_layout
+from app.utils.media_index import MediaIndex
+from app.utils.media_spool import MediaSpool
+from app.utils.throttling import ThrottleDeferred, media_rate_limiter
 from app.utils.user_agents import user_agent_manager
 
+try:
+    import fcntl
+except ImportError:
+    # Without file locks, downloads are only serialized within a process
+    fcntl = None
+
+
+class MediaRejected(Exception):
+    """Raised when media is not worth downloading, e.g. too large or not media"""
+
+
+class IncompleteDownload(Exception):
+    """Raised when a download ends before all of its content was received"""
+
+
+def _parse_content_range(value):
+    """
+    Parse a Content-Range header
+
+    Args:
+        value (str): Header value, e.g. 'bytes 100-199/1000'
+
+    Returns:
+        tuple: (first byte, total size or None)
+    """
+    unit, _, spec = (value or "").partition(" ")
+    byte_range, _, total = spec.partition("/")
+    if unit != "bytes" or "-" not in byte_range:
+        raise IncompleteDownload(f"Unexpected Content-Range: {value}")
+    start = int(byte_range.split("-")[0])
+    return start, int(total) if total.isdigit() else None
+
+
+class HashingReader:
+    """
+    File-like wrapper over an HTTP response body that hashes what is read
+    """
+
+    def __init__(self, raw, max_bytes=0):
+        """
+        Initialize the reader
+
+        Args:
+            raw: urllib3 response to read the decoded body from
+            max_bytes (int): Size above which reading is aborted (0 for no limit)
+        """
+        self.raw = raw
+        self.max_bytes = max_bytes
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes of the decoded body
+
+        Args:
+            size (int): Maximum number of bytes to read, -1 for all
+
+        Returns:
+            bytes: Data read, empty at the end of the body
+        """
+        if size is None or size < 0:
+            size = None
+        data = self.raw.read(size, decode_content=True)
+        if data:
+            self.sha256.update(data)
+            self.size += len(data)
+            if self.max_bytes and self.size > self.max_bytes:
+                raise MediaRejected(f"Content exceeds {self.max_bytes} bytes")
+        return data
+
+    def hexdigest(self):
+        """Get the SHA-256 hex digest of the data read so far"""
+        return self.sha256.hexdigest()
+
 
 class MediaDownloader:
-    def __init__(self, download_dir="downloads"):
-        """Initialize the media downloader with a target directory"""
+    def __init__(
+        self,
+        download_dir="downloads",
+        max_workers=settings.MEDIA_DOWNLOAD_WORKERS,
+        per_host_limit=settings.MEDIA_PER_HOST_CONCURRENCY,
+        max_bytes=settings.MEDIA_MAX_BYTES,
+        allowed_content_types=settings.MEDIA_ALLOWED_CONTENT_TYPES,
+        max_retries=settings.MEDIA_DOWNLOAD_RETRIES,
+        spool_quota_bytes=settings.MEDIA_SPOOL_QUOTA_BYTES,
+    ):
+        """
+        Initialize the media downloader with a target directory
+
+        Args:
+            download_dir (str): Directory where media is downloaded
+            max_workers (int): Maximum number of concurrent downloads
+            per_host_limit (int): Maximum number of concurrent downloads per host
+            max_bytes (int): Maximum size of a media file (0 for no limit)
+            allowed_content_types (list): Allowed Content-Type prefixes (empty for any)
+            max_retries (int): Retries of an interrupted download, resuming where it stopped
+            spool_quota_bytes (int): Disk quota for downloaded media (0 for no limit)
+        """
         self.download_dir = download_dir
+        self.index = MediaIndex(os.path.join(download_dir, "media_index.sqlite"))
+        self.max_workers = max(max_workers, 1)
+        self.per_host_limit = max(per_host_limit, 1)
+        self.max_bytes = max_bytes
+        self.allowed_content_types = list(allowed_content_types)
+        self.max_retries = max(max_retries, 0)
+
+        # Partial downloads of a URL are only written by one thread at a time;
+        # each URL being downloaded has a [lock, number of users] entry
+        self._url_locks = {}
+        self._url_locks_lock = threading.Lock()
+
+        # Keep-alive sessions and concurrency limits, one per host
+        self._sessions = {}
+        self._host_slots = {}
+        self._hosts_lock = threading.Lock()
+
         os.makedirs(download_dir, exist_ok=True)
+        self.spool = MediaSpool(
+            download_dir,
+            spool_quota_bytes,
+            part_ttl=settings.MEDIA_SPOOL_PART_TTL,
+            pin_ttl=settings.MEDIA_SPOOL_PIN_TTL,
+            unuploaded_ttl=settings.MEDIA_SPOOL_UNUPLOADED_TTL,
+        )
         logger.info(f"Media will be downloaded to {os.path.abspath(download_dir)}")
 
+    def _get_host(self, url):
+        """
+        Get the session and concurrency slots for the host of a URL
+
+        Args:
+            url (str): URL to download
+
+        Returns:
+            tuple: (requests.Session, threading.BoundedSemaphore)
+        """
+        host = urlparse(url).netloc
+        with self._hosts_lock:
+            if host not in self._sessions:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.per_host_limit
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._sessions[host] = session
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host_limit)
+            return self._sessions[host], self._host_slots[host]
+
     def _get_file_extension(self, url, content_type=None):
         """Determine file extension from URL or content type"""
         # Try to get extension from URL
@@ -45,66 +196,487 @@ class MediaDownloader:
         # Default extension if we can't determine
         return ".bin"
 
-    def download_media(self, url):
+    def get_blob_path(self, digest, ext):
         """
-        Download media from URL and return local path
+        Get the local path of a content-addressed media file
 
         Args:
-            url (str): URL of the media to download
+            digest (str): SHA-256 hex digest of the content
+            ext (str): File extension, including the dot
+
+        Returns:
+            str: Local path of the media file
+        """
+        return os.path.join(self.download_dir, f"{digest}{ext}")
+
+    def _check_response(self, url, response):
+        """
+        Reject a response before its body is read if it isn't wanted media
+
+        Args:
+            url (str): URL of the media
+            response (requests.Response): Response whose headers were received
+
+        Raises:
+            MediaRejected: If the content type isn't allowed or the content is too large
+        """
+        content_type = (response.headers.get("Content-Type") or "").lower()
+        if (
+            content_type
+            and self.allowed_content_types
+            and not content_type.startswith(tuple(self.allowed_content_types))
+        ):
+            raise MediaRejected(f"Content-Type {content_type} is not allowed")
+
+        total = None
+        if response.status_code == 206:
+            total = _parse_content_range(response.headers.get("Content-Range"))[1]
+        elif response.headers.get("Content-Length"):
+            total = int(response.headers["Content-Length"])
+        if self.max_bytes and total is not None and total > self.max_bytes:
+            raise MediaRejected(f"Content of {total} bytes exceeds {self.max_bytes}")
+
+    def _get_part_paths(self, url):
+        """
+        Get the paths of the partial download of a URL and of its sidecar
+
+        Args:
+            url (str): URL of the media
+
+        Returns:
+            tuple: (partial file path, sidecar JSON path)
+        """
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        part_path = os.path.join(self.download_dir, f".{name}.part")
+        return part_path, f"{part_path}.json"
+
+    def _load_part_state(self, url, part_path, state_path):
+        """
+        Load the state of a partial download that can be resumed
+
+        Args:
+            url (str): URL of the media
+            part_path (str): Path of the partial file
+            state_path (str): Path of the sidecar JSON file
 
         Returns:
-            str: Local path where media was saved
+            Optional[dict]: Sidecar state, or None if there is nothing to resume
         """
+        if not (os.path.exists(part_path) and os.path.exists(state_path)):
+            return None
         try:
-            # Add a small delay before downloading
-            wait_random_delay(base=5)  # Shorter delay for media downloads
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("url") != url or not state.get("validator"):
+            return None
+        return state
+
+    def _discard_part(self, part_path, state_path):
+        """Remove a partial download and its sidecar"""
+        for path in (part_path, state_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @contextmanager
+    def _lock_url(self, url):
+        """
+        Serialize the downloads of a URL across threads and worker processes
 
-            user_agent = user_agent_manager.get_random_user_agent()
+        The partial file of a URL is shared by every process using the
+        download directory, so besides a lock per URL within this process,
+        an exclusive flock is held on a lock file next to it. The lock of a
+        URL is dropped once no thread uses it, so they don't pile up.
 
-            # Setup headers and proxies
-            headers = {"User-Agent": user_agent}
+        Args:
+            url (str): URL of the media
+        """
+        with self._url_locks_lock:
+            entry = self._url_locks.setdefault(url, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if fcntl is None:
+                    yield
+                    return
+
+                lock_path = f"{self._get_part_paths(url)[0]}.lock"
+                while True:
+                    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    # The holder removes the lock file on release, so a lock
+                    # taken on a removed file must be taken again
+                    try:
+                        if os.fstat(fd).st_ino == os.stat(lock_path).st_ino:
+                            break
+                    except FileNotFoundError:
+                        pass
+                    os.close(fd)
+
+                try:
+                    yield
+                finally:
+                    try:
+                        os.remove(lock_path)
+                    except FileNotFoundError:
+                        pass
+                    os.close(fd)
+        finally:
+            with self._url_locks_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._url_locks[url]
+
+    def _known_blob(self, url, storage=None):
+        """
+        Get the local path of a URL's media if it doesn't need downloading
+
+        Args:
+            url (str): URL of the media
+            storage (StorageInterface, optional): Storage the media is uploaded to
 
-            # Make request
-            response = requests.get(
+        Returns:
+            str: Local path of the media if it was downloaded before and is
+            still on disk or already in storage, None otherwise
+        """
+        known = self.index.get(url)
+        if known:
+            filepath = self.get_blob_path(known["digest"], known["ext"])
+            if os.path.exists(filepath):
+                return filepath
+            # Evicted from the spool once uploaded, it is only needed in storage
+            if storage is not None and storage.exists(
+                key_layout.media_key(os.path.basename(filepath))
+            ):
+                return filepath
+        return None
+
+    def _download_part(self, url, part_path, state_path):
+        """
+        Download a URL into its partial file, resuming a previous attempt
+
+        A previous attempt is resumed with a Range request. If-Range makes the
+        server send the whole content instead if it changed since, as told by
+        the ETag or Last-Modified recorded in the sidecar.
+
+        Args:
+            url (str): URL of the media
+            part_path (str): Path of the partial file
+            state_path (str): Path of the sidecar JSON file
+
+        Returns:
+            tuple: (SHA-256 hex digest, file extension, size in bytes)
+
+        Raises:
+            MediaRejected: If the media isn't wanted
+            IncompleteDownload: If the content was not fully received
+        """
+        state = self._load_part_state(url, part_path, state_path)
+        offset = os.path.getsize(part_path) if state else 0
+
+        headers = {"User-Agent": user_agent_manager.get_random_user_agent()}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = state["validator"]
+
+        session, slots = self._get_host(url)
+        with slots:
+            with session.get(
                 url, headers=headers, proxies=getproxies(), stream=True, timeout=30
-            )
-            response.raise_for_status()
-
-            # Generate a unique filename
-            url_hash = hashlib.md5(url.encode()).hexdigest()[:10]
-            file_ext = self._get_file_extension(
-                url, response.headers.get("Content-Type")
-            )
-            filename = f"{url_hash}_{uuid.uuid4().hex[:6]}{file_ext}"
-            filepath = os.path.join(self.download_dir, filename)
-
-            # Save the file
-            with open(filepath, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-
-            logger.info(f"Downloaded {url} to {filepath}")
+            ) as response:
+                if response.status_code == 416:
+                    self._discard_part(part_path, state_path)
+                    raise IncompleteDownload("Partial download no longer matches")
+                response.raise_for_status()
+                self._check_response(url, response)
+
+                if response.status_code == 206:
+                    start, total = _parse_content_range(
+                        response.headers.get("Content-Range")
+                    )
+                    if start != offset:
+                        self._discard_part(part_path, state_path)
+                        raise IncompleteDownload(
+                            f"Server resumed at byte {start} instead of {offset}"
+                        )
+                    logger.info(f"Resuming download of {url} at byte {offset}")
+                else:
+                    # Full content, either a fresh download or the media changed
+                    offset = 0
+                    total = None
+                    encoded = response.headers.get("Content-Encoding")
+                    if response.headers.get("Content-Length") and not encoded:
+                        total = int(response.headers["Content-Length"])
+
+                    # Record validators so an interrupted download can resume;
+                    # ranges of encoded content don't match the decoded bytes
+                    validator = response.headers.get("ETag")
+                    if not validator or validator.startswith("W/"):
+                        validator = response.headers.get("Last-Modified")
+                    state = {
+                        "url": url,
+                        "validator": None if encoded else validator,
+                        "content_type": response.headers.get("Content-Type"),
+                        "total": total,
+                    }
+                    with open(state_path, "w", encoding="utf-8") as f:
+                        json.dump(state, f)
+
+                # Hash the bytes already on disk, then append the rest
+                digest = hashlib.sha256()
+                if offset:
+                    with open(part_path, "rb") as f:
+                        for chunk in iter(lambda: f.read(65536), b""):
+                            digest.update(chunk)
+
+                size = offset
+                with open(part_path, "ab" if offset else "wb") as f:
+                    for chunk in response.iter_content(chunk_size=65536):
+                        if chunk:
+                            size += len(chunk)
+                            if self.max_bytes and size > self.max_bytes:
+                                raise MediaRejected(
+                                    f"Content exceeds {self.max_bytes} bytes"
+                                )
+                            f.write(chunk)
+                            digest.update(chunk)
+
+        total = total if total is not None else state.get("total")
+        if total is not None and size != total:
+            raise IncompleteDownload(f"Received {size} of {total} bytes")
+
+        file_ext = self._get_file_extension(url, state.get("content_type"))
+        return digest.hexdigest(), file_ext, size
+
+    def download_media(self, url, storage=None):
+        """
+        Download media from URL and return local path
+
+        Files are named after the SHA-256 digest of their content, computed
+        while streaming, so identical media downloaded from different URLs
+        is stored once. URLs already in the media index are not downloaded
+        again while their file is on disk or, given the storage the media
+        is uploaded to, already stored there.
+
+        Interrupted downloads keep their partial file and are resumed with
+        HTTP Range requests, both by the retries of this call and by later
+        runs. Media with a disallowed Content-Type or above the size cap is
+        abandoned before or while its body is read.
+
+        Args:
+            url (str): URL of the media to download
+            storage (StorageInterface, optional): Storage the media is uploaded to
+
+        Returns:
+            str: Local path where media was saved, which known media that is
+            only in storage no longer has on disk
+        """
+        filepath = self._known_blob(url, storage)
+        if filepath:
+            logger.info(f"Skipping download of known media {url}")
+            self.spool.touch(filepath)
             return filepath
 
+        part_path, state_path = self._get_part_paths(url)
+        with self._lock_url(url):
+            # Another process may have downloaded it while this one waited
+            filepath = self._known_blob(url, storage)
+            if filepath:
+                logger.info(f"Skipping download of known media {url}")
+                self.spool.touch(filepath)
+                return filepath
+
+            for attempt in range(self.max_retries + 1):
+                try:
+                    # Space out downloads from hosts that don't advertise a budget
+                    media_rate_limiter.wait()
+
+                    digest, file_ext, size = self._download_part(
+                        url, part_path, state_path
+                    )
+                    break
+
+                except ThrottleDeferred:
+                    raise
+                except MediaRejected as e:
+                    logger.warning(f"Skipping media {url}: {e}")
+                    self._discard_part(part_path, state_path)
+                    return None
+                except (
+                    requests.ConnectionError,
+                    requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    IncompleteDownload,
+                ) as e:
+                    if attempt >= self.max_retries:
+                        # Keep the partial file for a later run to resume
+                        logger.error(f"Failed to download {url}: {e}")
+                        return None
+                    logger.warning(
+                        f"Download of {url} interrupted ({e}), "
+                        f"retry {attempt + 1}/{self.max_retries}"
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to download {url}: {e}")
+                    self._discard_part(part_path, state_path)
+                    return None
+
+            filepath = self.get_blob_path(digest, file_ext)
+            try:
+                if not os.path.exists(filepath):
+                    os.replace(part_path, filepath)
+                self._discard_part(part_path, state_path)
+            except OSError as e:
+                logger.error(f"Failed to store download of {url} as {filepath}: {e}")
+                self._discard_part(part_path, state_path)
+                return None
+
+            # Indexed before the lock is released, for the processes waiting on it
+            self.index.put(url, digest, file_ext, size)
+
+        # Make room for the new file by evicting media that was already uploaded
+        self.spool.add(filepath, size)
+
+        logger.info(f"Downloaded {url} to {filepath}")
+        return filepath
+
+    def stream_media(self, url, storage, prefix=MEDIA_PREFIX):
+        """
+        Stream media from URL straight into storage, without touching local disk
+
+        The response body is piped into ``storage.upload_stream`` under a
+        staging name while its SHA-256 digest is computed, then moved to
+        ``{prefix}/{digest}{ext}``. If that object already exists, the
+        staging copy is deleted instead, so each unique file is stored once.
+
+        Args:
+            url (str): URL of the media to download
+            storage (StorageInterface): Storage to upload to
+            prefix (str): Prefix of content-addressed media objects
+
+        Returns:
+            str: Object name of the media in storage
+        """
+        known = self.index.get(url)
+        if known:
+            object_name = f"{prefix}/{known['digest']}{known['ext']}"
+            if storage.exists(object_name):
+                logger.info(f"Skipping download of known media {url}")
+                return object_name
+
+        staging_name = None
+        try:
+            # Space out downloads from hosts that don't advertise a budget
+            media_rate_limiter.wait()
+
+            headers = {"User-Agent": user_agent_manager.get_random_user_agent()}
+
+            session, slots = self._get_host(url)
+            with slots:
+                with session.get(
+                    url, headers=headers, proxies=getproxies(), stream=True, timeout=30
+                ) as response:
+                    response.raise_for_status()
+                    self._check_response(url, response)
+
+                    content_type = response.headers.get("Content-Type")
+                    file_ext = self._get_file_extension(url, content_type)
+
+                    # The length is only known up front for bodies sent as is
+                    length = -1
+                    if not response.headers.get("Content-Encoding"):
+                        length = int(response.headers.get("Content-Length", -1))
+
+                    reader = HashingReader(response.raw, self.max_bytes)
+                    staging_name = f"{prefix}/.incoming/{uuid.uuid4().hex}{file_ext}"
+                    storage.upload_stream(
+                        reader, staging_name, length=length, content_type=content_type
+                    )
+
+            digest = reader.hexdigest()
+            object_name = f"{prefix}/{digest}{file_ext}"
+            if storage.exists(object_name):
+                storage.delete(staging_name)
+            else:
+                storage.move(staging_name, object_name)
+            staging_name = None
+
+            self.index.put(url, digest, file_ext, reader.size)
+
+            logger.info(f"Streamed {url} to {object_name}")
+            return object_name
+
+        except ThrottleDeferred:
+            raise
+        except MediaRejected as e:
+            logger.warning(f"Skipping media {url}: {e}")
+            return None
         except Exception as e:
-            logger.error(f"Failed to download {url}: {e}")
+            logger.error(f"Failed to stream {url}: {e}")
             return None
+        finally:
+            if staging_name:
+                try:
+                    storage.delete(staging_name)
+                except Exception as e:
+                    logger.warning(f"Failed to clean up {staging_name}: {e}")
+
+    def _map(self, func, urls):
+        """
+        Apply a download function to URLs concurrently, preserving order
+
+        Args:
+            func (callable): Function taking a URL
+            urls (list): List of URLs
+
+        Returns:
+            list: Results of the function, in the order of the URLs
+        """
+        if len(urls) <= 1:
+            return [func(url) for url in urls]
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.max_workers, len(urls)),
+            thread_name_prefix="media-download",
+        ) as executor:
+            return list(executor.map(func, urls))
 
-    def download_multiple(self, urls):
+    def stream_multiple(self, urls, storage, prefix=MEDIA_PREFIX):
+        """
+        Stream multiple media files into storage and return their object names
+
+        Args:
+            urls (list): List of URLs to download
+            storage (StorageInterface): Storage to upload to
+            prefix (str): Prefix of content-addressed media objects
+
+        Returns:
+            list: Object names of the stored media, in the order of the URLs
+        """
+        object_names = self._map(
+            lambda url: self.stream_media(url, storage, prefix), urls
+        )
+        return [name for name in object_names if name]
+
+    def download_multiple(self, urls, storage=None):
         """
         Download multiple media files and return list of local paths
 
+        Downloads run concurrently on a bounded thread pool, with at most
+        ``per_host_limit`` downloads in flight per host. Paths are returned in
+        the order of the input URLs.
+
         Args:
             urls (list): List of URLs to download
+            storage (StorageInterface, optional): Storage the media is uploaded to
 
         Returns:
             list: List of local paths where media was saved (None for failed downloads)
         """
-        local_paths = []
-        for url in urls:
-            local_path = self.download_media(url)
-            local_paths.append(local_path)
+        local_paths = self._map(lambda url: self.download_media(url, storage), urls)
 
         # Filter out None values (failed downloads)
         return [path for path in local_paths if path]
@@ -0,0 +1,84 @@
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from app.core.logger import logger
+
+
+class MediaIndex:
+    """
+    Persistent index from media URL to the SHA-256 digest of its content
+
+    Lets the downloader skip URLs whose content is already known, and is
+    shared by all worker processes on a host through SQLite.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the media index
+
+        Args:
+            path (str): Path to the SQLite database file
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS media_urls ("
+                "url TEXT PRIMARY KEY, digest TEXT NOT NULL, ext TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # A connection per operation keeps the index safe across forks
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up the content of a URL
+
+        Args:
+            url (str): Media URL
+
+        Returns:
+            Optional[Dict[str, Any]]: Entry with 'digest', 'ext' and 'size', or None
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT digest, ext, size FROM media_urls WHERE url = ?", (url,)
+            ).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+        return {"digest": row[0], "ext": row[1], "size": row[2]}
+
+    def put(self, url: str, digest: str, ext: str, size: int):
+        """
+        Record the content of a URL
+
+        Args:
+            url (str): Media URL
+            digest (str): SHA-256 hex digest of the content
+            ext (str): File extension, including the dot
+            size (int): Content size in bytes
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO media_urls (url, digest, ext, size, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (url, digest, ext, size, time.time()),
+                )
+        except sqlite3.Error as e:
+            # The index is an optimization, a failed write only costs a re-download
+            logger.warning(f"Failed to index media {url}: {e}")
+        finally:
+            conn.close()
@@ -0,0 +1,131 @@
+import html
+import os
+from typing import Any, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlparse
+
+from app.config import settings
+from app.core.logger import logger
+
+# Hosts serving Reddit-hosted images, where the file name is the image id
+REDDIT_IMAGE_HOSTS = ("i.redd.it", "preview.redd.it")
+
+
+class MediaPolicy:
+    """
+    Decides which media of a post is downloaded, and at which size
+
+    Reddit serves the same image as the original on i.redd.it and as
+    resized variants on preview.redd.it. The policy identifies both by the
+    image id so each image is fetched once, at the smallest variant that is
+    at least ``max_image_width`` wide. Videos above a duration or bitrate
+    cap are skipped.
+    """
+
+    def __init__(
+        self,
+        max_image_width: int = 0,
+        max_video_duration: float = 0,
+        max_video_bitrate: float = 0,
+    ):
+        """
+        Initialize the media policy
+
+        Args:
+            max_image_width (int): Width images are fetched at (0 for full resolution)
+            max_video_duration (float): Longest video to download in seconds (0 for no limit)
+            max_video_bitrate (float): Highest video bitrate in kbps (0 for no limit)
+        """
+        self.max_image_width = max_image_width
+        self.max_video_duration = max_video_duration
+        self.max_video_bitrate = max_video_bitrate
+
+    def canonicalize(self, url: str) -> str:
+        """
+        Normalize a media URL
+
+        Listings fetched without raw_json escape '&' in URLs as '&amp;'.
+
+        Args:
+            url (str): Media URL
+
+        Returns:
+            str: Canonical URL
+        """
+        url = html.unescape(url.strip())
+        parsed = urlparse(url)
+        if parsed.netloc.lower() == "i.redd.it":
+            # Originals don't take parameters
+            return parsed._replace(query="", fragment="").geturl()
+        return url
+
+    def media_key(self, url: str) -> str:
+        """
+        Get the identity of the media behind a URL
+
+        Args:
+            url (str): Canonical media URL
+
+        Returns:
+            str: Key shared by all URLs serving the same media
+        """
+        parsed = urlparse(url)
+        host = parsed.netloc.lower()
+        if host in REDDIT_IMAGE_HOSTS:
+            return "redd.it/" + os.path.splitext(os.path.basename(parsed.path))[0]
+        return f"{host}{parsed.path}"
+
+    def select_variant(self, variants: Iterable[Tuple[str, int]]) -> Optional[str]:
+        """
+        Choose the smallest image variant that is at least max_image_width wide
+
+        Falls back to the widest variant when none is wide enough.
+
+        Args:
+            variants (Iterable[Tuple[str, int]]): (URL, width) of each variant
+
+        Returns:
+            Optional[str]: URL of the chosen variant, or None without variants
+        """
+        ordered = sorted(
+            ((url, width or 0) for url, width in variants if url),
+            key=lambda variant: variant[1],
+        )
+        if not ordered:
+            return None
+        if self.max_image_width:
+            for url, width in ordered:
+                if width >= self.max_image_width:
+                    return url
+        return ordered[-1][0]
+
+    def accept_video(self, video: Dict[str, Any]) -> bool:
+        """
+        Check whether a Reddit video is within the duration and bitrate caps
+
+        Args:
+            video (dict): 'reddit_video' object of a submission
+
+        Returns:
+            bool: True if the video should be downloaded
+        """
+        duration = video.get("duration") or 0
+        bitrate = video.get("bitrate_kbps") or 0
+        if self.max_video_duration and duration > self.max_video_duration:
+            logger.info(
+                f"Skipping video of {duration}s, over {self.max_video_duration}s"
+            )
+            return False
+        if self.max_video_bitrate and bitrate > self.max_video_bitrate:
+            logger.info(
+                f"Skipping video of {bitrate} kbps, over {self.max_video_bitrate} kbps"
+            )
+            return False
+        return True
+
+
+# Singleton instance
+media_policy = MediaPolicy(
+    max_image_width=settings.MEDIA_MAX_IMAGE_WIDTH,
+    max_video_duration=settings.MEDIA_MAX_VIDEO_DURATION,
+    max_video_bitrate=settings.MEDIA_MAX_VIDEO_BITRATE,
+)
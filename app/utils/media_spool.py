@@ -0,0 +1,274 @@
+import glob
+import os
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from app.core.logger import logger
+
+# Content-addressed media files, named after the SHA-256 digest of their content
+BLOB_NAME = re.compile(r"^[0-9a-f]{64}\.[0-9a-z]+$")
+
+
+class MediaSpool:
+    """
+    Disk quota for the media files a downloader keeps on local disk
+
+    Files are tracked in a SQLite table shared by the worker processes of a
+    host. Once the spool grows past its quota, the least recently used files
+    that were already uploaded are evicted. Files that are not uploaded yet,
+    or pinned while an upload is in flight, are not evicted.
+
+    Pins are leases in the shared table, so an upload in one worker protects
+    its files from the evictions of every worker. Leases expire after
+    ``pin_ttl`` seconds, and files left un-uploaded for ``unuploaded_ttl``
+    seconds (by a task that failed before uploading them) become evictable,
+    so a crashed worker can't hold disk space forever.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        quota_bytes: int,
+        part_ttl: float = 86400,
+        pin_ttl: float = 3600,
+        unuploaded_ttl: float = 86400,
+    ):
+        """
+        Initialize the media spool
+
+        Args:
+            directory (str): Directory holding the media files
+            quota_bytes (int): Disk usage above which files are evicted (0 for no limit)
+            part_ttl (float): Seconds after which abandoned partial downloads are removed
+            pin_ttl (float): Seconds after which a pin that wasn't released expires
+            unuploaded_ttl (float): Seconds after which files that were never
+                uploaded become evictable
+        """
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.part_ttl = part_ttl
+        self.pin_ttl = pin_ttl
+        self.unuploaded_ttl = unuploaded_ttl
+        self.path = os.path.join(directory, "media_spool.sqlite")
+
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool_files ("
+                "path TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "last_access REAL NOT NULL, uploaded INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS spool_pins ("
+                "path TEXT NOT NULL, owner TEXT NOT NULL, count INTEGER NOT NULL, "
+                "expires_at REAL NOT NULL, PRIMARY KEY (path, owner))"
+            )
+        self._sync()
+
+    def _connect(self):
+        # A connection per operation keeps the spool safe across forks
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _execute(self, sql, params=()):
+        conn = self._connect()
+        try:
+            with conn:
+                return conn.execute(sql, params).fetchall()
+        finally:
+            conn.close()
+
+    def _sync(self):
+        """
+        Reconcile the table with the files on disk
+
+        Files from before the spool existed are tracked as uploaded, since the
+        task that downloaded them uploaded them right away.
+        """
+        on_disk = {
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if BLOB_NAME.match(name)
+        }
+        tracked = {row[0] for row in self._execute("SELECT path FROM spool_files")}
+
+        for path in tracked - on_disk:
+            self._execute("DELETE FROM spool_files WHERE path = ?", (path,))
+        for path in on_disk - tracked:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            self._execute(
+                "INSERT OR IGNORE INTO spool_files (path, size, last_access, uploaded) "
+                "VALUES (?, ?, ?, 1)",
+                (path, stat.st_size, stat.st_mtime),
+            )
+
+    def add(self, path: str, size: int):
+        """
+        Track a file written to the spool, then enforce the quota
+
+        Args:
+            path (str): Path of the media file
+            size (int): Size of the file in bytes
+        """
+        self._execute(
+            "INSERT INTO spool_files (path, size, last_access) VALUES (?, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET "
+            "size = excluded.size, last_access = excluded.last_access",
+            (path, size, time.time()),
+        )
+        self.enforce_quota()
+
+    def touch(self, path: str):
+        """
+        Mark a file as recently used
+
+        Args:
+            path (str): Path of the media file
+        """
+        self._execute(
+            "UPDATE spool_files SET last_access = ? WHERE path = ?", (time.time(), path)
+        )
+
+    def mark_uploaded(self, path: str):
+        """
+        Mark a file as uploaded, which makes it evictable
+
+        Args:
+            path (str): Path of the media file
+        """
+        self._execute("UPDATE spool_files SET uploaded = 1 WHERE path = ?", (path,))
+
+    def _owner(self) -> str:
+        # Read at each call, since the spool may be created before a fork
+        return str(os.getpid())
+
+    def pin(self, path: str):
+        """
+        Protect a file from eviction, by every worker, for up to pin_ttl seconds
+
+        Args:
+            path (str): Path of the media file
+        """
+        self._execute(
+            "INSERT INTO spool_pins (path, owner, count, expires_at) VALUES (?, ?, 1, ?) "
+            "ON CONFLICT(path, owner) DO UPDATE SET "
+            "count = count + 1, expires_at = excluded.expires_at",
+            (path, self._owner(), time.time() + self.pin_ttl),
+        )
+
+    def unpin(self, path: str):
+        """
+        Release a pin taken with pin()
+
+        Args:
+            path (str): Path of the media file
+        """
+        owner = self._owner()
+        self._execute(
+            "UPDATE spool_pins SET count = count - 1 WHERE path = ? AND owner = ?",
+            (path, owner),
+        )
+        self._execute(
+            "DELETE FROM spool_pins WHERE path = ? AND owner = ? AND count <= 0",
+            (path, owner),
+        )
+
+    @contextmanager
+    def pinned(self, path: str):
+        """
+        Protect a file from eviction within the block
+
+        Args:
+            path (str): Path of the media file
+        """
+        self.pin(path)
+        try:
+            yield path
+        finally:
+            self.unpin(path)
+
+    def is_pinned(self, path: str) -> bool:
+        """Check whether a file is pinned by any worker"""
+        return bool(
+            self._execute(
+                "SELECT 1 FROM spool_pins WHERE path = ? AND expires_at > ? LIMIT 1",
+                (path, time.time()),
+            )
+        )
+
+    def usage(self) -> int:
+        """
+        Get the disk usage of the tracked files
+
+        Returns:
+            int: Total size in bytes
+        """
+        return self._execute("SELECT COALESCE(SUM(size), 0) FROM spool_files")[0][0]
+
+    def _remove_stale_parts(self):
+        """Remove partial downloads abandoned for longer than part_ttl"""
+        cutoff = time.time() - self.part_ttl
+        for path in glob.glob(os.path.join(self.directory, ".*.part*")):
+            # Lock files are removed by their holder, a held one must stay
+            if path.endswith(".lock"):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    logger.info(f"Removed stale partial download {path}")
+            except FileNotFoundError:
+                pass
+
+    def enforce_quota(self) -> int:
+        """
+        Evict least recently used uploaded files until the spool fits its quota
+
+        Returns:
+            int: Number of bytes freed
+        """
+        if not self.quota_bytes:
+            return 0
+
+        self._remove_stale_parts()
+
+        excess = self.usage() - self.quota_bytes
+        if excess <= 0:
+            return 0
+
+        now = time.time()
+        self._execute("DELETE FROM spool_pins WHERE expires_at <= ?", (now,))
+
+        freed = 0
+        # Files never uploaded are kept for unuploaded_ttl, then evictable
+        candidates = self._execute(
+            "SELECT path, size FROM spool_files "
+            "WHERE (uploaded = 1 OR last_access < ?) "
+            "AND path NOT IN (SELECT path FROM spool_pins) "
+            "ORDER BY last_access ASC",
+            (now - self.unuploaded_ttl,),
+        )
+        for path, size in candidates:
+            if freed >= excess:
+                break
+            # Pinned since the candidates were selected
+            if self.is_pinned(path):
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self._execute("DELETE FROM spool_files WHERE path = ?", (path,))
+            freed += size
+
+        if freed < excess:
+            logger.warning(
+                f"Media spool {self.directory} is {excess - freed} bytes over its "
+                f"quota, the remaining files are not uploaded yet or pinned"
+            )
+        else:
+            logger.info(f"Evicted {freed} bytes from media spool {self.directory}")
+        return freed
@@ -1,7 +1,175 @@
-import random
+import threading
 import time
+from contextlib import contextmanager
 
+from app.config import settings
+from app.core.logger import logger
 
-def wait_random_delay(base=30):
-    delay = base + random.randint(0, 5)
+_deferral = threading.local()
+
+
+class ThrottleDeferred(Exception):
+    """
+    Raised instead of sleeping when the caller can be rescheduled later
+
+    Attributes:
+        delay (float): Seconds to wait before resuming
+    """
+
+    def __init__(self, delay):
+        super().__init__(f"Throttled, resume in {delay:.2f}s")
+        self.delay = delay
+
+
+@contextmanager
+def allow_deferral(enabled=True):
+    """
+    Let long throttling waits in the current thread raise ThrottleDeferred
+
+    Args:
+        enabled (bool): Whether deferral is enabled within the block
+    """
+    previous = getattr(_deferral, "enabled", False)
+    _deferral.enabled = enabled
+    try:
+        yield
+    finally:
+        _deferral.enabled = previous
+
+
+def throttle_sleep(delay):
+    """
+    Wait for a throttling delay
+
+    Within an allow_deferral block, delays of at least
+    THROTTLE_DEFER_MIN_DELAY seconds raise ThrottleDeferred instead of
+    sleeping, so the caller can release its worker and resume later.
+
+    Args:
+        delay (float): Delay in seconds
+
+    Raises:
+        ThrottleDeferred: If the delay should be spent outside the worker
+    """
+    if delay <= 0:
+        return
+    if (
+        getattr(_deferral, "enabled", False)
+        and delay >= settings.THROTTLE_DEFER_MIN_DELAY
+    ):
+        raise ThrottleDeferred(delay)
     time.sleep(delay)
+
+
+class RateLimiter:
+    """
+    Request rate limiter driven by the server's advertised budget
+
+    Reddit reports the state of the current rate limit window in the
+    X-Ratelimit-Remaining, X-Ratelimit-Used and X-Ratelimit-Reset headers.
+    Requests go out immediately while the budget lasts; the limiter only
+    waits for the window to reset once the remaining budget drops to
+    ``min_remaining``. An optional ``min_interval`` enforces a floor
+    between consecutive requests for hosts that don't report a budget.
+    """
+
+    def __init__(self, min_remaining=5, min_interval=0.0):
+        """
+        Initialize the rate limiter
+
+        Args:
+            min_remaining (int): Remaining requests at which to wait for the reset
+            min_interval (float): Minimum number of seconds between requests
+        """
+        self.min_remaining = min_remaining
+        self.min_interval = min_interval
+
+        self.remaining = None
+        self.used = None
+        self.reset_at = None
+        self._last_request = None
+        self._lock = threading.Lock()
+
+    def update(self, remaining=None, used=None, reset=None):
+        """
+        Record the state of the current rate limit window
+
+        Args:
+            remaining (float, optional): Requests remaining in the window
+            used (int, optional): Requests used in the window
+            reset (float, optional): Seconds until the window resets
+        """
+        with self._lock:
+            if remaining is not None:
+                self.remaining = float(remaining)
+            if used is not None:
+                self.used = int(used)
+            if reset is not None:
+                self.reset_at = time.monotonic() + float(reset)
+
+    def update_from_headers(self, headers):
+        """
+        Record the rate limit window advertised in response headers
+
+        Args:
+            headers (Mapping): HTTP response headers
+        """
+        try:
+            remaining = headers.get("X-Ratelimit-Remaining")
+            used = headers.get("X-Ratelimit-Used")
+            reset = headers.get("X-Ratelimit-Reset")
+            self.update(
+                remaining=float(remaining) if remaining is not None else None,
+                used=int(float(used)) if used is not None else None,
+                reset=float(reset) if reset is not None else None,
+            )
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Ignoring malformed rate limit headers: {e}")
+
+    def get_delay(self):
+        """
+        Compute how long the next request has to wait
+
+        Returns:
+            float: Delay in seconds (0 when the request can go out now)
+        """
+        with self._lock:
+            return self._get_delay(time.monotonic())
+
+    def _get_delay(self, now):
+        delay = 0.0
+
+        if self.min_interval and self._last_request is not None:
+            delay = max(delay, self._last_request + self.min_interval - now)
+
+        if self.reset_at is not None:
+            if now >= self.reset_at:
+                # The window has reset, the budget is unknown until the next response
+                self.remaining = None
+                self.used = None
+                self.reset_at = None
+            elif self.remaining is not None and self.remaining <= self.min_remaining:
+                delay = max(delay, self.reset_at - now)
+
+        return delay
+
+    def wait(self):
+        """
+        Block until the next request is allowed and account for it
+        """
+        delay = self.get_delay()
+        if delay > 0:
+            logger.info(f"Rate limit budget low, waiting {delay:.2f}s")
+            throttle_sleep(delay)
+
+        with self._lock:
+            self._last_request = time.monotonic()
+            if self.remaining is not None:
+                self.remaining = max(self.remaining - 1, 0)
+
+
+# Limiter for API requests, which report their budget in response headers
+api_rate_limiter = RateLimiter(min_remaining=settings.RATE_LIMIT_MIN_REMAINING)
+
+# Limiter for media downloads from CDNs that don't report a budget
+media_rate_limiter = RateLimiter(min_interval=settings.MEDIA_MIN_INTERVAL)
@@ -0,0 +1,271 @@
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from app.config import settings
+from app.core.logger import logger
+from app.utils.throttling import throttle_sleep
+
+
+class TokenBucketBackend(ABC):
+    """
+    Abstract backend holding token bucket state
+    """
+
+    @abstractmethod
+    def consume(
+        self, key: str, rate: float, capacity: float, tokens: float = 1
+    ) -> float:
+        """
+        Atomically refill a bucket and try to take tokens from it
+
+        Args:
+            key (str): Bucket key
+            rate (float): Refill rate in tokens per second
+            capacity (float): Maximum number of tokens in the bucket
+            tokens (float): Number of tokens to take
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they are available
+        """
+
+
+def _refill(available, updated_at, now, rate, capacity, tokens):
+    """
+    Refill a bucket and take tokens from it
+
+    Returns:
+        tuple: (tokens left in the bucket, seconds to wait)
+    """
+    if available is None:
+        available = capacity
+    else:
+        available = min(capacity, available + max(now - updated_at, 0) * rate)
+
+    if available >= tokens:
+        return available - tokens, 0.0
+    return available, (tokens - available) / rate
+
+
+class MemoryTokenBucketBackend(TokenBucketBackend):
+    """
+    In-process token buckets, shared by the threads of a single worker
+    """
+
+    def __init__(self):
+        """Initialize the in-memory bucket state"""
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(
+        self, key: str, rate: float, capacity: float, tokens: float = 1
+    ) -> float:
+        with self._lock:
+            now = time.monotonic()
+            available, updated_at = self._buckets.get(key, (None, now))
+            available, wait = _refill(
+                available, updated_at, now, rate, capacity, tokens
+            )
+            self._buckets[key] = (available, now)
+            return wait
+
+
+class SQLiteTokenBucketBackend(TokenBucketBackend):
+    """
+    Token buckets in a SQLite database, shared by all worker processes of a host
+
+    Each operation runs in an immediate transaction, so SQLite's file lock
+    serializes concurrent workers.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the SQLite backend
+
+        Args:
+            path (str): Path to the SQLite database file
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        # A connection per operation keeps the backend safe across forks
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def consume(
+        self, key: str, rate: float, capacity: float, tokens: float = 1
+    ) -> float:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (key,)
+            ).fetchone()
+            available, updated_at = row if row else (None, now)
+            available, wait = _refill(
+                available, updated_at, now, rate, capacity, tokens
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (key, tokens, updated_at) "
+                "VALUES (?, ?, ?)",
+                (key, available, now),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+
+class RedisTokenBucketBackend(TokenBucketBackend):
+    """
+    Token buckets in Redis, shared by every worker of a cluster
+    """
+
+    # Refill and take tokens atomically, using the Redis server clock so that
+    # workers on different hosts agree on elapsed time.
+    CONSUME_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1])
+local updated_at = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+else
+    tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+end
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 60)
+return tostring(wait)
+"""
+
+    def __init__(self, url: str, prefix: str = "token_bucket:"):
+        """
+        Initialize the Redis backend
+
+        Args:
+            url (str): Redis connection URL
+            prefix (str): Prefix for bucket keys
+        """
+        try:
+            import redis
+        except ImportError:
+            raise ImportError(
+                "The redis package is required for the redis token bucket backend"
+            )
+
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(url)
+        self._consume = self.client.register_script(self.CONSUME_SCRIPT)
+
+    def consume(
+        self, key: str, rate: float, capacity: float, tokens: float = 1
+    ) -> float:
+        return float(
+            self._consume(keys=[f"{self.prefix}{key}"], args=[rate, capacity, tokens])
+        )
+
+
+class TokenBucket:
+    """
+    Token bucket limiting the request rate for a key across all its users
+    """
+
+    def __init__(self, backend: TokenBucketBackend, rate: float, capacity: float):
+        """
+        Initialize the token bucket
+
+        Args:
+            backend (TokenBucketBackend): Backend holding the bucket state
+            rate (float): Refill rate in tokens per second
+            capacity (float): Maximum burst size
+        """
+        self.backend = backend
+        self.rate = rate
+        self.capacity = capacity
+
+    def get_delay(self, key: str, tokens: float = 1) -> float:
+        """
+        Try to take tokens from a bucket
+
+        Args:
+            key (str): Bucket key
+            tokens (float): Number of tokens to take
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they are available
+        """
+        return self.backend.consume(key, self.rate, self.capacity, tokens)
+
+    def acquire(self, key: str, tokens: float = 1):
+        """
+        Block until tokens are taken from a bucket
+
+        Args:
+            key (str): Bucket key
+            tokens (float): Number of tokens to take
+        """
+        while True:
+            delay = self.get_delay(key, tokens)
+            if delay <= 0:
+                return
+            logger.info(f"Request budget for {key} exhausted, waiting {delay:.2f}s")
+            throttle_sleep(delay)
+
+
+class TokenBucketFactory:
+    """
+    Factory class for creating token bucket backends
+    """
+
+    @staticmethod
+    def get_backend(backend_type: str = "memory") -> TokenBucketBackend:
+        """
+        Get a token bucket backend based on the specified type
+
+        Args:
+            backend_type (str): Type of backend ('memory', 'sqlite' or 'redis')
+
+        Returns:
+            TokenBucketBackend: Backend implementation
+        """
+        if backend_type == "memory":
+            return MemoryTokenBucketBackend()
+        elif backend_type == "sqlite":
+            return SQLiteTokenBucketBackend(settings.REQUEST_BUDGET_SQLITE_PATH)
+        elif backend_type == "redis":
+            return RedisTokenBucketBackend(settings.REDIS_URL)
+        else:
+            raise ValueError(f"Unsupported token bucket backend: {backend_type}")
+
+
+# Request budget shared by everything using the same credential and host
+request_budget = TokenBucket(
+    TokenBucketFactory.get_backend(settings.REQUEST_BUDGET_BACKEND),
+    rate=settings.REQUEST_BUDGET_RATE,
+    capacity=settings.REQUEST_BUDGET_BURST,
+)
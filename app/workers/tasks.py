@@ -1,78 +1,331 @@
+import math
 import os
 
 from datetime import datetime
+from typing import Any, Dict, List, Optional
 
+from app.config import settings
 from app.core.logger import logger
 from app.scrapers.reddit import RedditScraper
+from app.storage.compaction import compact_prefix
+from app.storage.content_hashes import LOCATION_FIELDS, ContentHashStore
+from app.storage.key_layout import key_layout
+from app.storage.post_sink import PostSinkFactory
+from app.storage.run_manifest import RunManifest, finalize_run
 from app.storage.storage_interface import StorageFactory
+from app.storage.watermarks import WatermarkStore
+from app.utils.media_downloader import media_downloader
+from app.utils.throttling import ThrottleDeferred, allow_deferral
 from app.utils.yaml_loader import yaml_loader
 from app.workers.celery_app import celery_app
 
 
-@celery_app.task(name="tasks.crawl_reddit_author")
+def _store_media(storage, media_paths: List[str]) -> List[str]:
+    """
+    Upload content-addressed media files that aren't stored yet
+
+    Media files are named after the digest of their content, so each unique
+    file is uploaded once no matter how many posts or authors share it. Once
+    stored, a file becomes evictable from the local media spool.
+
+    Args:
+        storage (StorageInterface): Storage to upload to
+        media_paths (List[str]): Local paths of the media files
+
+    Returns:
+        List[str]: Object names of the media files in storage
+    """
+    media_paths = [media_path for media_path in media_paths if media_path]
+    spool = media_downloader.spool
+
+    # Keep the files out of the spool's eviction while they upload
+    for media_path in media_paths:
+        spool.pin(media_path)
+    try:
+        object_names = []
+        uploads = {}
+        for media_path in media_paths:
+            object_name = key_layout.media_key(os.path.basename(media_path))
+            if object_name not in uploads and not storage.exists(object_name):
+                if not os.path.exists(media_path):
+                    logger.warning(
+                        f"Media file {media_path} is missing, not uploading it"
+                    )
+                    continue
+                uploads[object_name] = media_path
+            object_names.append(object_name)
+
+        results = storage.upload_many(
+            [(media_path, object_name) for object_name, media_path in uploads.items()]
+        )
+    finally:
+        for media_path in media_paths:
+            spool.unpin(media_path)
+
+    failed = [result for result in results if not result["ok"]]
+    if failed:
+        raise OSError(
+            f"Failed to upload {len(failed)} media files, first error: {failed[0]['error']}"
+        )
+
+    for media_path in media_paths:
+        spool.mark_uploaded(media_path)
+    return object_names
+
+
+@celery_app.task(name="tasks.crawl_reddit_author", bind=True)
 def crawl_reddit_author(
-    author_id: str, since: str, until: str, crawler_processing_timestamp: datetime, storage_type: str = "minio"
+    self,
+    author_id: str,
+    since: str,
+    until: str,
+    crawler_processing_timestamp: datetime,
+    storage_type: str = "minio",
+    checkpoint: Optional[Dict[str, Any]] = None,
+    incremental: bool = True,
 ):
     """
     Celery task to crawl a Reddit author and store the data
 
+    Incremental crawls only fetch submissions newer than the author's
+    watermark, which is advanced to the newest stored submission once the
+    crawl completes, but never past a submission that failed to process.
+
+    Posts are written through the POST_SINK, either one JSON object per post
+    or batched into gzipped JSON Lines or Parquet files.
+
+    With MEDIA_UPLOAD_MODE=stream, media is piped from HTTP straight into
+    storage instead of being downloaded to local disk first.
+
+    With THROTTLE_MODE=defer, a long throttling wait doesn't hold the worker:
+    the task records a checkpoint of what it already stored and re-enqueues
+    itself with a countdown, resuming from the checkpoint.
+
+    With RUN_MANIFESTS, every object written is recorded in a manifest of the
+    author's crawl, written before the watermark advances.
+
+    With SKIP_UNCHANGED_WRITES, the author profile and the posts, keyed by
+    submission fullname, are only written when their content hash differs
+    from the one stored by an earlier crawl. Unchanged posts also skip their
+    media downloads and uploads.
+
     Args:
         author_id (str): Reddit username
         since (str): Start date in YYYY-MM-DD format
         until (str): End date in YYYY-MM-DD format
-        storage_type (str): Storage type ('local' or 'minio')
+        storage_type (str): Storage type ('local', 'minio' or 'tiered')
+        checkpoint (dict, optional): Progress of a deferred run to resume from
+        incremental (bool): Whether to stop at the author's watermark
     """
     logger.info(f"Starting Celery task to crawl Reddit author: {author_id}")
 
     # Create scraper and storage
     scraper = RedditScraper()
     storage = StorageFactory.get_storage(storage_type)
+    scraper.media_storage = storage
+
+    checkpoint = dict(checkpoint or {})
+    checkpoint.setdefault("posts_count", 0)
+    checkpoint.setdefault("media_count", 0)
+    checkpoint.setdefault("unchanged_count", 0)
+
+    watermarks = WatermarkStore(storage)
+    if "watermark" not in checkpoint:
+        checkpoint["watermark"] = (
+            watermarks.get("reddit", author_id) if incremental else None
+        )
+
+    def drop_watermark_candidate(submission):
+        # The watermark must stay newer than nothing that was dropped, so
+        # that the next crawl fetches the dropped submission again
+        logger.warning(
+            f"Submission {submission.get('name') or submission.get('id')} of {author_id} "
+            f"was dropped, the watermark won't advance past it"
+        )
+        checkpoint["newest"] = None
+
+    run_manifest = RunManifest(
+        storage, crawler_processing_timestamp, "reddit", author_id
+    )
+    # The crawled data is written through the manifest's own view of the
+    # storage, which other tasks of this worker don't write through
+    task_storage = run_manifest.recorded_storage if settings.RUN_MANIFESTS else storage
+    post_sink = PostSinkFactory.get_sink(
+        settings.POST_SINK,
+        task_storage,
+        "reddit",
+        author_id,
+        crawler_processing_timestamp,
+    )
+    run_manifest.track_sink(post_sink)
+    content_hashes = ContentHashStore(storage, "reddit", author_id)
+
+    def is_unchanged(post):
+        # Posts without a fullname have no stable key to compare with
+        return bool(
+            settings.SKIP_UNCHANGED_WRITES
+            and post.id
+            and content_hashes.unchanged(
+                post.id, post.model_dump(exclude=LOCATION_FIELDS)
+            )
+        )
 
     try:
-        # Fetch and store author data
-        author = scraper.fetch_author(author_id)
-        author_path = f"bronze/crawler/metadata/user_profil/{crawler_processing_timestamp}/reddit/{author_id}.json"
-        storage.upload_json(author.model_dump(), author_path)
-        logger.info(f"Stored author data for {author_id} in {storage_type} storage")
-
-        # Fetch and store posts
-        posts = scraper.fetch_posts(author_id, since, until)
-        logger.info(f"Found {len(posts)} posts for {author_id}")
-
-        for post in posts:
-            # Store post metadata
-            post_timestamp = post.timestamp.replace(":", "-")
-            post_path = f"bronze/crawler/metadata/user_post/{crawler_processing_timestamp}/reddit/{author_id}/{post_timestamp}.json"
-            storage.upload_json(post.model_dump(), post_path)
-
-            # Store media files
-            for i, media_path in enumerate(post.media_local_paths):
-                if media_path and os.path.exists(media_path):
-                    ext = os.path.splitext(media_path)[1]
-                    media_object_name = (
-                        f"bronze/crawler/media/reddit/{author_id}/{post_timestamp}_{i}{ext}"
+        with allow_deferral(settings.THROTTLE_MODE == "defer"):
+            if not checkpoint.get("author_stored"):
+                # Fetch and store author data
+                author = scraper.fetch_author(author_id)
+                author_data = author.model_dump()
+                if settings.SKIP_UNCHANGED_WRITES and content_hashes.unchanged(
+                    "author", author_data
+                ):
+                    logger.info(
+                        f"Author data for {author_id} is unchanged, not storing it"
                     )
-                    storage.upload_file(media_path, media_object_name)
+                else:
+                    author_path = key_layout.author_key(
+                        "reddit", author_id, crawler_processing_timestamp
+                    )
+                    task_storage.upload_json(author_data, author_path)
+                    if settings.POST_SINK == "parquet":
+                        author_sink = PostSinkFactory.get_author_sink(
+                            task_storage, "reddit", crawler_processing_timestamp
+                        )
+                        run_manifest.track_sink(author_sink)
+                        author_sink.write(author)
+                        author_sink.close()
+                    content_hashes.update("author", author_data)
+                    logger.info(
+                        f"Stored author data for {author_id} in {storage_type} storage"
+                    )
+                checkpoint["author_stored"] = True
+
+            # Stream posts and store each one, with its media, as it arrives
+            for post in scraper.iter_posts(
+                author_id,
+                since,
+                until,
+                after=checkpoint.get("after"),
+                watermark=checkpoint["watermark"],
+                on_dropped=drop_watermark_candidate,
+                # Unchanged posts are checked before their media is downloaded
+                skip_media=is_unchanged,
+            ):
+                post_data = post.model_dump(exclude=LOCATION_FIELDS)
+                if is_unchanged(post):
+                    checkpoint["unchanged_count"] += 1
+                else:
+                    # Store media files, then the post metadata referencing them
+                    if settings.MEDIA_UPLOAD_MODE == "stream":
+                        post.media_object_names = media_downloader.stream_multiple(
+                            post.media_urls, task_storage
+                        )
+                    else:
+                        post.media_object_names = _store_media(
+                            task_storage, post.media_local_paths
+                        )
+
+                    post_sink.write(post)
+                    if post.id:
+                        content_hashes.update(post.id, post_data)
 
+                    checkpoint["posts_count"] += 1
+                    checkpoint["media_count"] += len(post.media_object_names)
+
+                checkpoint["after"] = post.id
+                # The listing is newest first, so the first post stored since
+                # the last dropped submission is the newest safe watermark
+                if not checkpoint.get("newest"):
+                    checkpoint["newest"] = {
+                        "fullname": post.id,
+                        "created_utc": datetime.fromisoformat(
+                            post.timestamp
+                        ).timestamp(),
+                    }
+
+            post_sink.close()
+
+    except ThrottleDeferred as e:
+        # The checkpoint counts buffered posts as stored, write them out first,
+        # so the manifest part lists them
+        post_sink.flush()
+        if settings.RUN_MANIFESTS:
+            parts = checkpoint.setdefault("manifest_parts", [])
+            parts.append(run_manifest.write_part(len(parts)))
+        if settings.SKIP_UNCHANGED_WRITES:
+            content_hashes.save()
+        countdown = math.ceil(e.delay)
+        logger.info(
+            f"Deferring crawl of {author_id} by {countdown}s after "
+            f"{checkpoint['posts_count']} posts"
+        )
+        self.apply_async(
+            args=(author_id, since, until, crawler_processing_timestamp, storage_type),
+            kwargs={"checkpoint": checkpoint, "incremental": incremental},
+            countdown=countdown,
+        )
         return {
             "author_id": author_id,
-            "posts_count": len(posts),
-            "media_count": sum(len(post.media_local_paths) for post in posts),
+            "deferred": True,
+            "countdown": countdown,
+            "posts_count": checkpoint["posts_count"],
+            "media_count": checkpoint["media_count"],
+            "unchanged_count": checkpoint["unchanged_count"],
         }
 
     except Exception as e:
         logger.error(f"Error in crawl_reddit_author task for {author_id}: {e}")
+        try:
+            post_sink.flush()
+        except Exception as flush_error:
+            logger.error(f"Failed to flush posts of {author_id}: {flush_error}")
         raise
 
+    logger.info(
+        f"Stored {checkpoint['posts_count']} posts for {author_id}, "
+        f"skipped {checkpoint['unchanged_count']} unchanged posts"
+    )
+
+    manifest_path = None
+    if settings.RUN_MANIFESTS:
+        manifest_path = run_manifest.write(
+            checkpoint.get("manifest_parts", []),
+            posts_count=checkpoint["posts_count"],
+            media_count=checkpoint["media_count"],
+            unchanged_count=checkpoint["unchanged_count"],
+        )
+
+    # Posts are stored, so later crawls can skip those that didn't change
+    if settings.SKIP_UNCHANGED_WRITES:
+        content_hashes.save()
+
+    newest = checkpoint.get("newest")
+    if newest and newest.get("fullname"):
+        watermarks.set("reddit", author_id, newest["fullname"], newest["created_utc"])
+
+    return {
+        "author_id": author_id,
+        "posts_count": checkpoint["posts_count"],
+        "media_count": checkpoint["media_count"],
+        "unchanged_count": checkpoint["unchanged_count"],
+        "manifest_path": manifest_path,
+    }
+
 
 @celery_app.task(name="tasks.crawl_reddit_users_from_yaml")
-def crawl_reddit_users_from_yaml(yaml_path: str, crawler_processing_timestamp: datetime,storage_type: str = "minio"):
+def crawl_reddit_users_from_yaml(
+    yaml_path: str,
+    crawler_processing_timestamp: datetime,
+    storage_type: str = "minio",
+    incremental: bool = True,
+):
     """
     Celery task to crawl multiple Reddit users from a YAML configuration
 
     Args:
         yaml_path (str): Path to the YAML configuration file
-        storage_type (str): Storage type ('local' or 'minio')
+        storage_type (str): Storage type ('local', 'minio' or 'tiered')
+        incremental (bool): Whether to only fetch content newer than each author's watermark
     """
     logger.info(f"Starting Celery task to crawl Reddit users from YAML: {yaml_path}")
 
@@ -90,11 +343,106 @@ def crawl_reddit_users_from_yaml(yaml_path: str, crawler_processing_timestamp: d
         # Schedule individual tasks for each user
         results = []
         for user in reddit_users:
-            task = crawl_reddit_author.delay(user, since_date, until_date, storage_type, crawler_processing_timestamp)
+            task = crawl_reddit_author.delay(
+                user,
+                since_date,
+                until_date,
+                crawler_processing_timestamp,
+                storage_type,
+                incremental=incremental,
+            )
             results.append({"user": user, "task_id": task.id})
 
+        if settings.RUN_MANIFESTS:
+            finalize_crawl_run.apply_async(
+                args=(crawler_processing_timestamp, reddit_users, storage_type),
+                countdown=settings.RUN_MANIFEST_POLL_INTERVAL,
+            )
+
         return results
 
     except Exception as e:
         logger.error(f"Error in crawl_reddit_users_from_yaml task: {e}")
         raise   
+
+
+@celery_app.task(name="tasks.replicate_spool")
+def replicate_spool():
+    """
+    Celery task to drain the local spool of the tiered storage to its remote storage
+
+    Workers replicate their spool in the background; this task drains it
+    when they don't (TIERED_REPLICATION_INTERVAL=0), or after they stopped.
+
+    Returns:
+        dict: Counts of replicated, failed and pending objects
+    """
+    storage = StorageFactory.get_storage("tiered")
+    return storage.replicate()
+
+
+@celery_app.task(name="tasks.compact_bronze")
+def compact_bronze(prefix: str, storage_type: str = "minio"):
+    """
+    Celery task to merge the JSON objects under a bronze prefix into
+    gzipped JSON Lines files, or the Parquet files under a Parquet partition
+    into larger Parquet files, and archive the originals
+
+    Safe to re-run after a failure, which resumes where it stopped.
+
+    Args:
+        prefix (str): Prefix of the objects to compact, such as a crawl run's
+            posts or a crawl date of the Parquet posts
+        storage_type (str): Storage type ('local' or 'minio')
+
+    Returns:
+        dict: Prefix, parts written, records compacted and sources archived
+    """
+    storage = StorageFactory.get_storage(storage_type)
+    return compact_prefix(storage, prefix)
+
+
+@celery_app.task(
+    name="tasks.finalize_crawl_run",
+    bind=True,
+    max_retries=settings.RUN_MANIFEST_MAX_POLLS,
+)
+def finalize_crawl_run(
+    self,
+    crawler_processing_timestamp,
+    author_ids: List[str],
+    storage_type: str = "minio",
+    platform: str = "reddit",
+):
+    """
+    Celery task to write the manifest and _SUCCESS marker of a crawl run
+
+    Retries every RUN_MANIFEST_POLL_INTERVAL seconds until every author's
+    crawl wrote its manifest. After RUN_MANIFEST_MAX_POLLS checks, the run
+    manifest is written without _SUCCESS and lists the missing authors.
+
+    Args:
+        crawler_processing_timestamp: Timestamp of the crawl run
+        author_ids (List[str]): Authors crawled in the run
+        storage_type (str): Storage type ('local', 'minio' or 'tiered')
+        platform (str): Platform name
+
+    Returns:
+        dict: Run, completeness and object count of the manifest
+    """
+    storage = StorageFactory.get_storage(storage_type)
+    manifest = finalize_run(
+        storage,
+        crawler_processing_timestamp,
+        platform,
+        author_ids,
+        force=self.request.retries >= self.max_retries,
+    )
+    if manifest is None:
+        raise self.retry(countdown=settings.RUN_MANIFEST_POLL_INTERVAL)
+
+    return {
+        "run": manifest["run"],
+        "complete": manifest["complete"],
+        "object_count": manifest["object_count"],
+    }
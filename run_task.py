@@ -9,10 +9,16 @@ import sys
 from datetime import datetime
 
 from app.utils.yaml_loader import yaml_loader
-from app.workers.tasks import crawl_reddit_author, crawl_reddit_users_from_yaml
+from app.config import settings
+from app.workers.tasks import (
+    compact_bronze,
+    crawl_reddit_author,
+    crawl_reddit_users_from_yaml,
+    finalize_crawl_run,
+)
 
 
-def run_single_task(author_id, since, until, storage_type):
+def run_single_task(author_id, since, until, storage_type, incremental=True):
     """
     Run a single task to crawl a Reddit author
 
@@ -20,25 +26,41 @@ def run_single_task(author_id, since, until, storage_type):
         author_id (str): Reddit username
         since (str): Start date in YYYY-MM-DD format
         until (str): End date in YYYY-MM-DD format
-        storage_type (str): Storage type ('local' or 'minio')
+        storage_type (str): Storage type ('local', 'minio' or 'tiered')
+        incremental (bool): Whether to only fetch content newer than the author's watermark
     """
     print(f"Scheduling task to crawl Reddit author: {author_id}")
     print(f"Date range: {since} to {until}")
     print(f"Storage type: {storage_type}")
 
-    task = crawl_reddit_author.delay(author_id, since, until, storage_type)
+    crawler_processing_timestamp = datetime.now().timestamp()
+    task = crawl_reddit_author.delay(
+        author_id,
+        since,
+        until,
+        crawler_processing_timestamp,
+        storage_type,
+        incremental=incremental,
+    )
     print(f"Task scheduled with ID: {task.id}")
 
+    if settings.RUN_MANIFESTS:
+        finalize_crawl_run.apply_async(
+            args=(crawler_processing_timestamp, [author_id], storage_type),
+            countdown=settings.RUN_MANIFEST_POLL_INTERVAL,
+        )
+
     return task.id
 
 
-def run_yaml_task(yaml_path, storage_type):
+def run_yaml_task(yaml_path, storage_type, incremental=True):
     """
     Run a task to crawl Reddit users from a YAML file
 
     Args:
         yaml_path (str): Path to the YAML configuration file
-        storage_type (str): Storage type ('local' or 'minio')
+        storage_type (str): Storage type ('local', 'minio' or 'tiered')
+        incremental (bool): Whether to only fetch content newer than each author's watermark
     """
     if not os.path.exists(yaml_path):
         print(f"Error: YAML file '{yaml_path}' not found")
@@ -57,7 +79,26 @@ def run_yaml_task(yaml_path, storage_type):
     print(f"Date range: {date_range.get('since')} to {date_range.get('until')}")
 
     # Schedule the task
-    task = crawl_reddit_users_from_yaml.delay(yaml_path, storage_type, crawler_processing_timestamp)
+    task = crawl_reddit_users_from_yaml.delay(
+        yaml_path, crawler_processing_timestamp, storage_type, incremental=incremental
+    )
+    print(f"Task scheduled with ID: {task.id}")
+
+    return task.id
+
+
+def run_compaction_task(prefix, storage_type):
+    """
+    Run a task to compact the JSON or Parquet files under a bronze prefix
+
+    Args:
+        prefix (str): Prefix of the objects to compact
+        storage_type (str): Storage type ('local' or 'minio')
+    """
+    print(f"Scheduling compaction of {prefix}")
+    print(f"Storage type: {storage_type}")
+
+    task = compact_bronze.delay(prefix, storage_type)
     print(f"Task scheduled with ID: {task.id}")
 
     return task.id
@@ -79,8 +120,18 @@ def main():
     parser.add_argument(
         "--storage",
         default="local",
-        choices=["local", "minio"],
-        help="Storage type (local or minio)",
+        choices=["local", "minio", "tiered"],
+        help="Storage type (local, minio, or tiered: local spool replicated to MinIO)",
+    )
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="Ignore author watermarks and crawl the whole date range",
+    )
+    parser.add_argument(
+        "--compact",
+        metavar="PREFIX",
+        help="Compact the JSON or Parquet files under a bronze prefix and archive them instead of crawling",
     )
     args = parser.parse_args()
 
@@ -93,12 +144,19 @@ def main():
     os.makedirs("downloads", exist_ok=True)
     os.makedirs("results", exist_ok=True)
 
-    if args.author:
+    if args.compact:
+        if args.storage == "tiered":
+            print("Error: compaction runs on local or minio storage")
+            return 1
+        run_compaction_task(args.compact, args.storage)
+    elif args.author:
         # Run a single task for a specific author
-        run_single_task(args.author, args.since, args.until, args.storage)
+        run_single_task(
+            args.author, args.since, args.until, args.storage, not args.full_refresh
+        )
     else:
         # Run a task for all users in the YAML file
-        run_yaml_task(args.yaml, args.storage)
+        run_yaml_task(args.yaml, args.storage, not args.full_refresh)
 
     print(
         "\nTask(s) scheduled. Check Flower dashboard for status: http://localhost:5555"
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Test script for scrapers
+"""
+
+import json
+import os
+import sys
+import threading
+import unittest
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.scrapers.reddit import RedditScraper
+from app.utils.media_policy import MediaPolicy
+
+
+def make_submission(submission_id, created):
+    """Build a fake PRAW submission created at the given datetime"""
+    return SimpleNamespace(id=submission_id, created_utc=created.timestamp())
+
+
+class FakeRedditHandler(BaseHTTPRequestHandler):
+    """Serve a paginated submitted.json listing from the server's submissions"""
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        self.server.requests.append(self.path)
+
+        after = query.get("after", [None])[0]
+        if after in self.server.failing_cursors:
+            # Fail the first request of a page, like a transient server error
+            self.server.failing_cursors.remove(after)
+            self.send_response(502)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if url.path.endswith("/about.json"):
+            body = {"data": {"name": "test_user", "created_utc": 1600000000}}
+        else:
+            limit = int(query.get("limit", ["25"])[0])
+            after = query.get("after", [None])[0]
+            submissions = self.server.submissions
+            start = 0
+            if after:
+                start = [f"t3_{s['id']}" for s in submissions].index(after) + 1
+            page = submissions[start : start + limit]
+            next_after = (
+                f"t3_{page[-1]['id']}" if start + limit < len(submissions) else None
+            )
+            body = {
+                "data": {
+                    "after": next_after,
+                    "children": [{"kind": "t3", "data": s} for s in page],
+                }
+            }
+
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRedditScraper(unittest.TestCase):
+    """Test the Reddit scraper"""
+
+    def setUp(self):
+        """Set up the test environment"""
+        patcher = patch("app.scrapers.reddit.praw.Reddit")
+        self.mock_reddit_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.scraper = RedditScraper()
+        self.mock_redditor = self.scraper.reddit.redditor.return_value
+
+    def test_iter_submissions_date_window(self):
+        """Test that submissions are bounded by the date window"""
+        consumed = []
+
+        def listing():
+            # Newest first, as returned by Reddit
+            for submission in [
+                make_submission("newer", datetime(2025, 5, 2)),
+                make_submission("inside_1", datetime(2025, 4, 20)),
+                make_submission("inside_2", datetime(2025, 4, 12)),
+                make_submission("older", datetime(2025, 4, 1)),
+                make_submission("never_read", datetime(2025, 3, 1)),
+            ]:
+                consumed.append(submission.id)
+                yield submission
+
+        self.mock_redditor.submissions.new.return_value = listing()
+
+        submissions = list(
+            self.scraper._iter_submissions(
+                "test_user", datetime(2025, 4, 10), datetime(2025, 4, 28)
+            )
+        )
+
+        self.assertEqual([s["id"] for s in submissions], ["inside_1", "inside_2"])
+        # The crawl stops at the first submission older than the window
+        self.assertNotIn("never_read", consumed)
+        self.mock_redditor.submissions.new.assert_called_once_with(
+            limit=None, params={}
+        )
+
+    def test_iter_submissions_stops_at_watermark(self):
+        """Test that the crawl stops at the watermark of a previous crawl"""
+        listing = [
+            {
+                "id": "new",
+                "name": "t3_new",
+                "created_utc": datetime(2025, 4, 27).timestamp(),
+            },
+            {
+                "id": "seen",
+                "name": "t3_seen",
+                "created_utc": datetime(2025, 4, 25).timestamp(),
+            },
+            {
+                "id": "older",
+                "name": "t3_older",
+                "created_utc": datetime(2025, 4, 20).timestamp(),
+            },
+        ]
+        self.mock_redditor.submissions.new.return_value = iter(
+            SimpleNamespace(**submission) for submission in listing
+        )
+
+        submissions = list(
+            self.scraper._iter_submissions(
+                "test_user",
+                datetime(2025, 4, 10),
+                datetime(2025, 4, 28),
+                watermark={
+                    "fullname": "t3_seen",
+                    "created_utc": listing[1]["created_utc"],
+                },
+            )
+        )
+
+        self.assertEqual([s["id"] for s in submissions], ["new"])
+
+    @patch("app.utils.error_handler.time.sleep")
+    def test_praw_listing_resumes_after_a_failed_page(self, mock_sleep):
+        """Test that a failed PRAW page restarts the listing after the last submission"""
+
+        def listing(params):
+            if not params:
+                yield make_submission("first", datetime(2025, 4, 20))
+                raise requests.ConnectionError("connection reset")
+            self.assertEqual(params, {"after": "t3_first"})
+            yield make_submission("second", datetime(2025, 4, 19))
+
+        self.mock_redditor.submissions.new.side_effect = lambda limit, params: listing(
+            params
+        )
+
+        submissions = list(self.scraper._iter_listing_praw("test_user"))
+
+        self.assertEqual([s["id"] for s in submissions], ["first", "second"])
+        self.assertEqual(self.mock_redditor.submissions.new.call_count, 2)
+        mock_sleep.assert_called_once()
+
+    def test_extract_media_urls(self):
+        """Test media URL extraction from listing data"""
+        submission = {
+            "url": "https://i.redd.it/abc.jpg",
+            "is_gallery": True,
+            "media_metadata": {"g1": {"s": {"u": "https://i.redd.it/g1.png"}}},
+            "media": {"reddit_video": {"fallback_url": "https://v.redd.it/v/720.mp4"}},
+        }
+
+        self.assertEqual(
+            self.scraper._extract_media_urls(submission),
+            [
+                "https://i.redd.it/abc.jpg",
+                "https://i.redd.it/g1.png",
+                "https://v.redd.it/v/720.mp4",
+            ],
+        )
+
+    def test_extract_media_urls_applies_media_policy(self):
+        """Test that images are deduplicated and resized, and long videos skipped"""
+        self.scraper.media_policy = MediaPolicy(
+            max_image_width=640, max_video_duration=60
+        )
+        preview = "https://preview.redd.it/abc.jpg?width={}&amp;s=sig{}"
+        submission = {
+            "url": "https://i.redd.it/abc.jpg",
+            "preview": {
+                "images": [
+                    {
+                        "source": {"url": preview.format(3000, 0), "width": 3000},
+                        "resolutions": [
+                            {"url": preview.format(320, 1), "width": 320},
+                            {"url": preview.format(640, 2), "width": 640},
+                            {"url": preview.format(1080, 3), "width": 1080},
+                        ],
+                    }
+                ]
+            },
+            "media": {
+                "reddit_video": {
+                    "fallback_url": "https://v.redd.it/v/DASH_1080.mp4",
+                    "duration": 600,
+                }
+            },
+        }
+
+        # The original and its preview are one image, fetched at 640 wide
+        self.assertEqual(
+            self.scraper._extract_media_urls(submission),
+            ["https://preview.redd.it/abc.jpg?width=640&s=sig2"],
+        )
+
+    def test_process_submission_skips_media_of_skipped_posts(self):
+        """Test that media is only downloaded for posts the caller needs it for"""
+        submission = {
+            "id": "abc",
+            "name": "t3_abc",
+            "title": "Post",
+            "created_utc": datetime(2025, 4, 20).timestamp(),
+            "url": "https://i.redd.it/image.jpg",
+        }
+        self.scraper.spool_media = True
+
+        with patch.object(
+            self.scraper, "_download_media", return_value=["/tmp/image.jpg"]
+        ) as mock_download:
+            skipped = self.scraper._process_submission(
+                submission, "test_user", skip_media=lambda post: post.id == "t3_abc"
+            )
+            mock_download.assert_not_called()
+            kept = self.scraper._process_submission(
+                submission, "test_user", skip_media=lambda post: False
+            )
+
+        mock_download.assert_called_once_with(["https://i.redd.it/image.jpg"])
+        self.assertEqual(skipped.media_urls, ["https://i.redd.it/image.jpg"])
+        self.assertEqual(skipped.media_local_paths, [])
+        self.assertEqual(kept.media_local_paths, ["/tmp/image.jpg"])
+
+
+class TestRedditJSONEngine(unittest.TestCase):
+    """Test the Reddit JSON listing engine against a local fake Reddit server"""
+
+    def setUp(self):
+        """Start the fake Reddit server"""
+        self.server = HTTPServer(("127.0.0.1", 0), FakeRedditHandler)
+        self.server.requests = []
+        self.server.failing_cursors = set()
+        self.server.submissions = [
+            {
+                "id": f"p{i}",
+                "title": f"Post {i}",
+                "selftext": "",
+                "url": f"https://www.reddit.com/r/test/comments/p{i}/",
+                "created_utc": datetime(2025, 4, 30 - i // 10).timestamp(),
+                "score": i,
+                "num_comments": 1,
+            }
+            for i in range(250)
+        ]
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        host, port = self.server.server_address
+        self.scraper = RedditScraper(engine="json", api_base=f"http://{host}:{port}")
+
+    def test_iter_posts_paginates_json_listing(self):
+        """Test that the JSON engine pages through the listing in full pages"""
+        posts = list(self.scraper.iter_posts("test_user", "2025-04-13", "2025-04-28"))
+
+        # Days 28..13 hold ten posts each
+        self.assertEqual(len(posts), 160)
+        self.assertEqual(posts[0].text, "Post 20")
+        # 100 submissions per page, the crawl stops inside the second page
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertTrue(all("limit=100" in path for path in self.server.requests))
+
+    @patch("app.utils.error_handler.time.sleep")
+    def test_listing_page_failure_is_retried_from_its_cursor(self, mock_sleep):
+        """Test that a failed page is fetched again without restarting the listing"""
+        self.server.failing_cursors.add("t3_p99")
+
+        posts = list(self.scraper.iter_posts("test_user", "2025-04-13", "2025-04-28"))
+
+        self.assertEqual(len(posts), 160)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertIn("after=t3_p99", self.server.requests[1])
+        self.assertEqual(self.server.requests[1], self.server.requests[2])
+        mock_sleep.assert_called_once()
+
+    def test_fetch_author(self):
+        """Test fetching an author through about.json"""
+        author = self.scraper.fetch_author("test_user")
+
+        self.assertEqual(author.id, "test_user")
+        self.assertEqual(author.name, "test_user")
+
+
+def main():
+    """Run the tests"""
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()
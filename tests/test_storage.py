@@ -3,20 +3,41 @@
 Test script for storage implementations
 """
 
+import gzip
+import hashlib
+import io
 import json
 import os
 import sys
 import tempfile
+import time
 import unittest
 from datetime import datetime
+from unittest.mock import patch
 
 # Add the app directory to the path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from app.storage.storage_interface import StorageFactory
 from app.core.logger import logger
+from app.storage.codecs import CodecRules, decode, get_codec
+from app.storage.compaction import Compactor, compact_prefix
+from app.storage.key_layout import KeyLayout
 from app.storage.local_storage import LocalStorage
+from app.storage import minio_client
 from app.storage.minio_client import MinIOStorage
+from app.storage.multipart import MultipartUploader
+from app.models import Post
+from app.storage.post_sink import NDJSONPostSink, PostSinkFactory
+from app.storage.run_manifest import RunManifest, finalize_run
+from app.storage.tiered_storage import TieredStorage
+from app.storage.watermarks import WatermarkStore
+from app.config import settings
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
 
 
 class TestLocalStorage(unittest.TestCase):
@@ -100,6 +121,819 @@ class TestLocalStorage(unittest.TestCase):
         # Check that all files with the prefix are listed
         self.assertEqual(len(files), 4)
 
+    def test_list_files_pages(self):
+        """Test paginated listings from the manifest index"""
+        for i in range(5):
+            self.storage.upload_json(self.test_data, f"a/user{i}.json")
+        self.storage.upload_file(self.temp_file.name, "b/file.txt")
+        self.storage.move("a/user4.json", "c/user4.json")
+        self.storage.delete("a/user3.json")
+
+        self.assertEqual(self.storage.list_files("b"), ["b/file.txt"])
+        self.assertEqual(
+            self.storage.list_files_page("a", limit=2), ["a/user0.json", "a/user1.json"]
+        )
+        self.assertEqual(
+            self.storage.list_files_page("a", start_after="a/user1.json", limit=2),
+            ["a/user2.json"],
+        )
+        self.assertEqual(
+            list(self.storage.iter_files(page_size=2)),
+            [
+                "a/user0.json",
+                "a/user1.json",
+                "a/user2.json",
+                "b/file.txt",
+                "c/user4.json",
+            ],
+        )
+
+        # Files written before the index existed are picked up by a rebuild
+        os.remove(os.path.join(self.temp_dir, "manifest.sqlite"))
+        reopened = LocalStorage(base_dir=self.temp_dir)
+        self.assertEqual(len(reopened.list_files()), 5)
+
+    def test_codec_rules(self):
+        """Test writing JSON with per-prefix codecs and reading any of them"""
+        self.storage.codec_rules = CodecRules(
+            default="json", rules={"packed/": "json+gzip", "packed/fast/": "orjson"}
+        )
+
+        self.storage.upload_json(self.test_data, "plain/user.json")
+        self.storage.upload_json(self.test_data, "packed/user.json")
+        self.storage.upload_json(self.test_data, "packed/fast/user.json")
+
+        with open(
+            os.path.join(self.temp_dir, "metadata", "plain/user.json"), "rb"
+        ) as f:
+            self.assertEqual(
+                f.read(),
+                json.dumps(self.test_data, indent=2, ensure_ascii=False).encode(),
+            )
+        with open(
+            os.path.join(self.temp_dir, "metadata", "packed/user.json"), "rb"
+        ) as f:
+            self.assertEqual(f.read(2), b"\x1f\x8b")
+        self.assertEqual(self.storage.get_codec("packed/fast/user.json").name, "orjson")
+
+        for path in ("plain/user.json", "packed/user.json", "packed/fast/user.json"):
+            self.assertEqual(self.storage.read_json(path), self.test_data)
+
+    def test_read_json_many(self):
+        """Test reading several JSON documents in one call"""
+        self.storage.upload_json({"n": 1}, "test/one.json")
+        self.storage.upload_json({"n": 2}, "test/two.json")
+
+        data = self.storage.read_json_many(
+            ["test/one.json", "test/two.json", "test/missing.json"]
+        )
+
+        self.assertEqual(data, {"test/one.json": {"n": 1}, "test/two.json": {"n": 2}})
+
+    def test_upload_stream_move_delete(self):
+        """Test streaming an object, then moving and deleting it"""
+        self.storage.upload_stream(io.BytesIO(b"streamed"), "incoming/blob.bin")
+        self.assertTrue(self.storage.exists("incoming/blob.bin"))
+
+        full_path = self.storage.move("incoming/blob.bin", "blobs/blob.bin")
+        self.assertFalse(self.storage.exists("incoming/blob.bin"))
+        with open(full_path, "rb") as f:
+            self.assertEqual(f.read(), b"streamed")
+
+        self.storage.delete("blobs/blob.bin")
+        self.assertFalse(self.storage.exists("blobs/blob.bin"))
+        # Deleting a missing object is not an error
+        self.storage.delete("blobs/blob.bin")
+
+    def test_ndjson_post_sink(self):
+        """Test that posts are batched into gzipped JSON Lines files"""
+        sink = NDJSONPostSink(self.storage, "posts/test_user", max_records=2)
+        for i in range(5):
+            sink.write(
+                Post(
+                    author_id="test_user",
+                    text=f"Post {i}",
+                    timestamp=datetime(2025, 4, 1 + i).isoformat(),
+                    likes=i,
+                    reposts=0,
+                    comments=0,
+                    media_urls=[],
+                    media_local_paths=[],
+                )
+            )
+        sink.close()
+
+        self.assertEqual(len(sink.paths), 3)
+        texts = []
+        for path in sink.paths:
+            with gzip.open(os.path.join(self.temp_dir, "metadata", path), "rt") as f:
+                texts.extend(json.loads(line)["text"] for line in f)
+        self.assertEqual(texts, [f"Post {i}" for i in range(5)])
+
+    @unittest.skipUnless(pq, "pyarrow is not installed")
+    def test_parquet_post_sink(self):
+        """Test that posts are written as typed Parquet partitioned by crawl date"""
+        sink = PostSinkFactory.get_sink(
+            "parquet", self.storage, "reddit", "test_user", "1745962981.927765"
+        )
+        for i in range(3):
+            sink.write(
+                Post(
+                    id=f"t3_{i}",
+                    author_id="test_user",
+                    text=f"Post {i}",
+                    timestamp=datetime(2025, 4, 1 + i).isoformat(),
+                    likes=i,
+                    reposts=0,
+                    comments=0,
+                    media_urls=[f"https://i.redd.it/{i}.jpg"],
+                    media_local_paths=[],
+                )
+            )
+        sink.close()
+
+        self.assertEqual(len(sink.paths), 1)
+        self.assertTrue(
+            sink.paths[0].startswith(
+                "bronze/crawler/parquet/user_post/platform=reddit/crawl_date=2025-04-29/"
+            )
+        )
+        table = pq.read_table(
+            os.path.join(self.temp_dir, "metadata", sink.paths[0]),
+            columns=["id", "timestamp", "media_urls"],
+        )
+        self.assertEqual(str(table.schema.field("timestamp").type), "timestamp[us]")
+        self.assertEqual(
+            table.column("media_urls").to_pylist()[2], ["https://i.redd.it/2.jpg"]
+        )
+
+    def test_upload_json_many(self):
+        """Test uploading several JSON documents concurrently"""
+        items = [({"index": i}, f"bulk/{i}.json") for i in range(5)]
+
+        results = self.storage.upload_json_many(items, max_workers=3)
+
+        self.assertEqual([result["path"] for result in results], [p for _, p in items])
+        self.assertTrue(all(result["ok"] for result in results))
+        self.assertEqual(self.storage.read_json("bulk/4.json"), {"index": 4})
+
+    def test_upload_many_reports_failures(self):
+        """Test that a failed upload is retried, then reported without failing the rest"""
+        items = [
+            (self.temp_file.name, "bulk/ok.txt"),
+            ("/nonexistent/file.txt", "bulk/missing.txt"),
+        ]
+
+        with patch("app.utils.error_handler.time.sleep") as mock_sleep:
+            results = self.storage.upload_many(items, max_retries=1)
+
+        self.assertTrue(results[0]["ok"])
+        self.assertFalse(results[1]["ok"])
+        self.assertIn("No such file", results[1]["error"])
+        mock_sleep.assert_called_once()
+        self.assertTrue(self.storage.exists("bulk/ok.txt"))
+
+    def test_move_many(self):
+        """Test moving several objects concurrently"""
+        for i in range(3):
+            self.storage.upload_json({"index": i}, f"bulk/{i}.json")
+        items = [(f"bulk/{i}.json", f"moved/{i}.json") for i in range(3)]
+        items.append(("bulk/missing.json", "moved/missing.json"))
+
+        results = self.storage.move_many(items, max_workers=2, max_retries=0)
+
+        self.assertEqual(
+            [result["ok"] for result in results], [True, True, True, False]
+        )
+        self.assertEqual(self.storage.read_json("moved/2.json"), {"index": 2})
+        self.assertFalse(self.storage.exists("bulk/0.json"))
+
+    def test_watermarks(self):
+        """Test storing and reading author watermarks"""
+        watermarks = WatermarkStore(self.storage)
+        self.assertIsNone(watermarks.get("reddit", "test_user"))
+
+        watermarks.set("reddit", "test_user", "t3_abc", 1700000000.0)
+        watermark = watermarks.get("reddit", "test_user")
+
+        self.assertEqual(watermark["fullname"], "t3_abc")
+        self.assertEqual(watermark["created_utc"], 1700000000.0)
+
+
+class TestMinIOStorage(unittest.TestCase):
+    """Test the MinIO storage implementation against a mocked client"""
+
+    def setUp(self):
+        """Patch the MinIO client and reset the per-process cache"""
+        patcher = patch("app.storage.minio_client.Minio")
+        self.mock_minio_cls = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for cache in (minio_client._clients, minio_client._checked_buckets):
+            cache.clear()
+            self.addCleanup(cache.clear)
+
+    def test_client_is_shared(self):
+        """Test that instances share one client and check the bucket once"""
+        first = MinIOStorage()
+        second = MinIOStorage()
+
+        self.assertIs(first.client, second.client)
+        self.mock_minio_cls.assert_called_once()
+        first.client.bucket_exists.assert_called_once()
+
+    def test_upload_json_in_memory(self):
+        """Test that JSON is uploaded from memory with put_object"""
+        storage = MinIOStorage()
+
+        storage.upload_json({"id": "test_user"}, "test/user.json")
+
+        storage.client.fput_object.assert_not_called()
+        _, path, stream, length = storage.client.put_object.call_args[0]
+        self.assertEqual(path, "test/user.json")
+        self.assertEqual(json.loads(stream.read()), {"id": "test_user"})
+        self.assertEqual(
+            storage.client.put_object.call_args[1]["content_type"], "application/json"
+        )
+
+    def test_upload_json_encoding_metadata(self):
+        """Test that compressed JSON is uploaded with its Content-Encoding"""
+        storage = MinIOStorage()
+        storage.codec_rules = CodecRules(default="json+gzip")
+
+        storage.upload_json({"id": "test_user"}, "test/user.json")
+
+        _, _, stream, _ = storage.client.put_object.call_args[0]
+        kwargs = storage.client.put_object.call_args[1]
+        self.assertEqual(kwargs["metadata"], {"Content-Encoding": "gzip"})
+        self.assertEqual(decode(stream.read()), {"id": "test_user"})
+
+
+class FlakyStorage(LocalStorage):
+    """Local storage whose uploads and deletes fail while it is down"""
+
+    down = False
+
+    def upload_json(self, data, path):
+        if self.down:
+            raise ConnectionError("remote storage is down")
+        return super().upload_json(data, path)
+
+    def delete(self, path):
+        if self.down:
+            raise ConnectionError("remote storage is down")
+        return super().delete(path)
+
+
+class TestTieredStorage(unittest.TestCase):
+    """Test the local spool replicated to a remote storage"""
+
+    def setUp(self):
+        """Create a spool and a remote storage in temporary directories"""
+        import shutil
+
+        spool_dir = tempfile.mkdtemp()
+        remote_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        self.addCleanup(shutil.rmtree, remote_dir)
+
+        self.remote = FlakyStorage(base_dir=remote_dir)
+        self.storage = TieredStorage(
+            local=LocalStorage(base_dir=spool_dir),
+            remote=self.remote,
+            replication_interval=0,
+        )
+
+        patcher = patch.object(settings, "STORAGE_UPLOAD_RETRIES", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_writes_replicate_later(self):
+        """Test that writes land in the spool and reach the remote on replication"""
+        self.storage.upload_json({"id": "test_user"}, "authors/test_user.json")
+        self.storage.upload_bytes(
+            b"batch", "posts/part-1.bin", content_type="text/plain"
+        )
+        self.storage.upload_stream(io.BytesIO(b"media"), "incoming/blob.bin")
+        self.storage.move("incoming/blob.bin", "media/blob.bin")
+
+        self.assertTrue(self.storage.exists("authors/test_user.json"))
+        self.assertFalse(self.remote.exists("authors/test_user.json"))
+
+        stats = self.storage.replicate()
+
+        self.assertEqual(stats["pending"], 0)
+        self.assertEqual(
+            self.remote.read_json("authors/test_user.json"), {"id": "test_user"}
+        )
+        self.assertTrue(self.remote.exists("posts/part-1.bin"))
+        self.assertTrue(self.remote.exists("media/blob.bin"))
+        self.assertFalse(self.remote.exists("incoming/blob.bin"))
+
+    def test_failed_replication_is_retried(self):
+        """Test that objects are kept and retried while the remote is down"""
+        self.remote.down = True
+        self.storage.upload_json({"id": "test_user"}, "authors/test_user.json")
+
+        stats = self.storage.replicate()
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["pending"], 1)
+        # The retry waits for its backoff
+        self.assertEqual(self.storage.replicate()["failed"], 0)
+
+        self.remote.down = False
+        with patch(
+            "app.storage.tiered_storage.time.time", return_value=time.time() + 60
+        ):
+            stats = self.storage.replicate()
+
+        self.assertEqual(stats, {"replicated": 1, "failed": 0, "pending": 0})
+        self.assertTrue(self.remote.exists("authors/test_user.json"))
+
+    def test_stale_delete_is_not_applied_after_a_newer_write(self):
+        """Test that a delete waiting for its retry doesn't remove a later upload"""
+        self.storage.upload_json({"version": 1}, "authors/test_user.json")
+        self.storage.replicate()
+
+        self.remote.down = True
+        self.storage.delete("authors/test_user.json")
+        self.assertEqual(self.storage.replicate()["failed"], 1)
+
+        # Written again while the delete waits for its backoff
+        self.remote.down = False
+        self.storage.upload_json({"version": 2}, "authors/test_user.json")
+        self.assertEqual(self.storage.replicate()["replicated"], 1)
+
+        with patch(
+            "app.storage.tiered_storage.time.time", return_value=time.time() + 60
+        ):
+            stats = self.storage.replicate()
+
+        self.assertEqual(stats, {"replicated": 0, "failed": 0, "pending": 0})
+        self.assertEqual(
+            self.remote.read_json("authors/test_user.json"), {"version": 2}
+        )
+
+    def test_failed_spool_write_is_not_journaled(self):
+        """Test that a write that didn't reach the spool isn't replicated"""
+        with patch.object(
+            self.storage.local, "upload_json", side_effect=OSError("disk full")
+        ):
+            with self.assertRaises(OSError):
+                self.storage.upload_json({"id": "test_user"}, "authors/test_user.json")
+
+        self.assertEqual(self.storage.journal.pending_count(), 0)
+
+    def test_uncommitted_write_is_not_replicated(self):
+        """Test that a write in progress is only replicated once committed"""
+        entry_id = self.storage.journal.append(
+            "json", "authors/test_user.json", committed=False
+        )
+        self.storage.local.upload_json({"id": "test_user"}, "authors/test_user.json")
+        self.assertEqual(self.storage.replicate()["replicated"], 0)
+
+        self.storage.journal.commit(entry_id)
+
+        self.assertEqual(self.storage.replicate()["replicated"], 1)
+        self.assertTrue(self.remote.exists("authors/test_user.json"))
+
+    def test_prune_replicated_files(self):
+        """Test that replicated files leave the spool but stay readable"""
+        self.storage.upload_json({"id": "test_user"}, "authors/test_user.json")
+        self.storage.replicate()
+
+        with patch(
+            "app.storage.tiered_storage.time.time", return_value=time.time() + 60
+        ):
+            self.storage.prune(retention=30)
+
+        self.assertFalse(self.storage.local.exists("authors/test_user.json"))
+        self.assertEqual(
+            self.storage.read_json("authors/test_user.json"), {"id": "test_user"}
+        )
+
+
+class TestCodecs(unittest.TestCase):
+    """Test the serializers and compressions of stored JSON"""
+
+    def test_unknown_codec(self):
+        """Test that unknown serializers and compressions are rejected"""
+        with self.assertRaises(ValueError):
+            get_codec("yaml")
+        with self.assertRaises(ValueError):
+            get_codec("json+lz4")
+
+    def test_json_codec_writes_indented_json(self):
+        """Test that the default codec keeps writing indented JSON"""
+        data = {"id": "t3_abc", "text": "caf\u00e9"}
+        self.assertEqual(
+            get_codec("json").encode(data),
+            json.dumps(data, indent=2, ensure_ascii=False).encode("utf-8"),
+        )
+
+    def test_longest_prefix_wins(self):
+        """Test that the most specific prefix rule applies"""
+        rules = CodecRules(default="json", rules={"a/": "json+gzip", "a/b/": "orjson"})
+
+        self.assertEqual(rules.codec_for("a/b/c.json").name, "orjson")
+        self.assertEqual(rules.codec_for("a/c.json").name, "json+gzip")
+        self.assertEqual(rules.codec_for("c.json").name, "json")
+        self.assertEqual(rules.codec_for("a/c.json").content_encoding, "gzip")
+
+    def test_decode_every_codec(self):
+        """Test that data written by every available codec decodes"""
+        data = {"id": "t3_abc", "text": "caf\u00e9", "likes": 3, "media_urls": []}
+        for spec in (
+            "json",
+            "json+gzip",
+            "orjson",
+            "orjson+gzip",
+            "msgpack",
+            "json+zstd",
+        ):
+            try:
+                codec = get_codec(spec)
+            except ImportError:
+                continue
+            self.assertEqual(decode(codec.encode(data)), data, spec)
+
+
+class TestKeyLayout(unittest.TestCase):
+    """Test the partitioned keys of the crawled data"""
+
+    def test_default_scheme_keeps_original_keys(self):
+        """Test that the run/platform scheme builds the original keys"""
+        layout = KeyLayout(scheme="{run}/{platform}")
+
+        self.assertEqual(
+            layout.post_key(
+                layout.post_prefix("reddit", "alice", 1745962981.5),
+                "2025-04-29T10:00:00",
+            ),
+            "bronze/crawler/metadata/user_post/1745962981.5/reddit/alice/2025-04-29T10-00-00.json",
+        )
+        self.assertEqual(
+            layout.author_key("reddit", "alice", 1745962981.5),
+            "bronze/crawler/metadata/user_profil/1745962981.5/reddit/alice.json",
+        )
+
+    def test_hive_scheme(self):
+        """Test that a Hive-style scheme partitions by platform, date and hour"""
+        layout = KeyLayout(scheme="platform={platform}/dt={dt}/hour={hour}")
+
+        self.assertEqual(
+            layout.post_prefix("reddit", "alice", "2025-04-29T10:30:00+02:00"),
+            "bronze/crawler/metadata/user_post/platform=reddit/dt=2025-04-29/hour=08/alice",
+        )
+        with self.assertRaises(ValueError):
+            KeyLayout(scheme="{platform}/{minute}")
+
+    def test_iter_range_lists_only_the_range(self):
+        """Test that range listings stop at the partitions of the range"""
+        temp_dir = tempfile.mkdtemp()
+        storage = LocalStorage(base_dir=temp_dir)
+        layout = KeyLayout(scheme="platform={platform}/dt={dt}/hour={hour}")
+        for platform in ("reddit", "twitter"):
+            for day in (28, 29, 30):
+                prefix = layout.post_prefix(
+                    platform, "alice", f"2025-04-{day}T10:00:00"
+                )
+                storage.upload_json({"day": day}, f"{prefix}/post.json")
+
+        listed = []
+
+        def iter_files(prefix, start_after=None):
+            for key in LocalStorage.iter_files(
+                storage, prefix, start_after=start_after
+            ):
+                listed.append(key)
+                yield key
+
+        storage.iter_files = iter_files
+        keys = list(
+            layout.iter_range(
+                storage,
+                layout.dataset_prefix("user_post"),
+                "reddit",
+                "2025-04-29T00:00:00",
+                "2025-04-30T00:00:00",
+            )
+        )
+
+        self.assertEqual(
+            keys,
+            [
+                "bronze/crawler/metadata/user_post/platform=reddit/dt=2025-04-29/hour=10/alice/post.json"
+            ],
+        )
+        # The listing started at the range and stopped after its end
+        self.assertEqual(len(listed), 2)
+        self.assertTrue(all("platform=reddit" in key for key in listed))
+
+    def test_iter_range_includes_the_partition_of_an_unaligned_end(self):
+        """Test that the partition holding the end of the range is listed"""
+        prefix = "bronze/crawler/metadata/user_post"
+        cases = [
+            (
+                "platform={platform}/dt={dt}/hour={hour}",
+                "2024-01-02T10:30:00",
+                "hour=10",
+            ),
+            ("platform={platform}/dt={dt}", "2024-01-02T12:00:00", "dt=2024-01-02"),
+        ]
+        for scheme, until, included in cases:
+            with self.subTest(scheme=scheme):
+                storage = LocalStorage(base_dir=tempfile.mkdtemp())
+                layout = KeyLayout(scheme=scheme)
+                for run in ("2024-01-02T10:00:00", "2024-01-03T11:00:00"):
+                    partition = layout.partition("reddit", run)
+                    storage.upload_json({}, f"{prefix}/{partition}/alice/post.json")
+
+                keys = list(
+                    layout.iter_range(
+                        storage, prefix, "reddit", "2024-01-02T00:00:00", until
+                    )
+                )
+
+                self.assertEqual(len(keys), 1)
+                self.assertIn(included, keys[0])
+
+    def test_range_bounds_keep_an_aligned_end_exclusive(self):
+        """Test that an end at a partition boundary isn't rounded up"""
+        layout = KeyLayout(scheme="platform={platform}/dt={dt}/hour={hour}")
+
+        _, _, upper = layout.range_bounds(
+            "user_post", "reddit", "2024-01-02T00:00:00", "2024-01-02T10:00:00"
+        )
+
+        self.assertEqual(upper, "user_post/platform=reddit/dt=2024-01-02/hour=10")
+
+
+class TestCompaction(unittest.TestCase):
+    """Test the compaction of small JSON objects"""
+
+    prefix = "bronze/crawler/metadata/user_post/1700000000.0"
+
+    def setUp(self):
+        self.storage = LocalStorage(base_dir=tempfile.mkdtemp())
+        for author in ("alice", "bob"):
+            for i in range(5):
+                self.storage.upload_json(
+                    {"id": f"{author}-{i}", "author_id": author},
+                    f"{self.prefix}/reddit/{author}/{i}.json",
+                )
+
+    def read_part(self, path):
+        with gzip.open(self.storage.local_path(path), "rt") as f:
+            return [json.loads(line) for line in f]
+
+    def test_compact_and_archive(self):
+        """Test that objects are merged into parts and the originals archived"""
+        stats = Compactor(self.storage, self.prefix, max_records=4).run()
+
+        self.assertEqual(stats["parts"], 3)
+        self.assertEqual(stats["records"], 10)
+        self.assertEqual(stats["archived"], 10)
+        self.assertEqual(self.storage.list_files(self.prefix + "/"), [])
+        self.assertEqual(
+            len(self.storage.list_files("archive/" + self.prefix + "/")), 10
+        )
+
+        manifest = self.storage.read_json(
+            "bronze/crawler/compacted/metadata/user_post/1700000000.0/_manifest.json"
+        )
+        self.assertEqual(manifest["record_count"], 10)
+        records = [
+            record
+            for part in manifest["parts"]
+            for record in self.read_part(part["path"])
+        ]
+        self.assertEqual(
+            sorted(record["id"] for record in records)[:2], ["alice-0", "alice-1"]
+        )
+        self.assertEqual(len(records), 10)
+        self.assertFalse(any("sources" in part for part in manifest["parts"]))
+
+        # Nothing is left to compact on a re-run
+        self.assertEqual(Compactor(self.storage, self.prefix).run()["parts"], 0)
+
+    def test_run_manifests_follow_archived_sources(self):
+        """Test that finalized run manifests list the parts instead of archived objects"""
+        run_manifest = RunManifest(self.storage, "1700000000.0", "reddit", "alice")
+        sources = [f"{self.prefix}/reddit/alice/{i}.json" for i in range(5)]
+        for i, source in enumerate(sources):
+            run_manifest.recorded_storage.upload_json(
+                {"id": f"alice-{i}", "author_id": "alice"}, source
+            )
+        run_manifest.write()
+        finalize_run(self.storage, "1700000000.0", "reddit", ["alice"])
+
+        Compactor(self.storage, self.prefix, max_records=4).run()
+
+        run_prefix = "bronze/crawler/manifests/run=1700000000.0"
+        for path in (
+            f"{run_prefix}/manifest.json",
+            f"{run_prefix}/authors/reddit/alice.json",
+        ):
+            manifest = self.storage.read_json(path)
+            self.assertEqual(manifest["record_count"], 5)
+            self.assertTrue(
+                all(self.storage.exists(entry["path"]) for entry in manifest["objects"])
+            )
+            self.assertEqual(
+                sorted(
+                    source
+                    for entry in manifest["objects"]
+                    for source in entry["sources"]
+                ),
+                sources,
+            )
+        self.assertTrue(self.storage.exists(f"{run_prefix}/_SUCCESS"))
+
+    def test_run_finalized_after_compaction_merges_shared_parts(self):
+        """Test that authors compacted into one part add up in the run manifest"""
+        for author in ("alice", "bob"):
+            run_manifest = RunManifest(self.storage, "1700000000.0", "reddit", author)
+            for i in range(5):
+                run_manifest.recorded_storage.upload_json(
+                    {"id": f"{author}-{i}", "author_id": author},
+                    f"{self.prefix}/reddit/{author}/{i}.json",
+                )
+            run_manifest.write()
+
+        Compactor(self.storage, self.prefix).run()
+        manifest = finalize_run(
+            self.storage, "1700000000.0", "reddit", ["alice", "bob"]
+        )
+
+        self.assertEqual(manifest["object_count"], 1)
+        self.assertEqual(manifest["record_count"], 10)
+        self.assertEqual(len(manifest["objects"][0]["sources"]), 10)
+
+    def test_rerun_after_interruption(self):
+        """Test that a re-run finishes an interrupted compaction without duplicates"""
+        compactor = Compactor(self.storage, self.prefix)
+        with patch.object(
+            Compactor, "_archive", side_effect=RuntimeError("interrupted")
+        ):
+            with self.assertRaises(RuntimeError):
+                compactor.run()
+        # A part uploaded by a run that stopped before committing it
+        self.storage.upload_bytes(
+            b"",
+            "bronze/crawler/compacted/metadata/user_post/1700000000.0/part-0-orphan.json.gz",
+        )
+
+        stats = Compactor(self.storage, self.prefix).run()
+
+        self.assertEqual(
+            stats, {"prefix": self.prefix, "parts": 0, "records": 0, "archived": 10}
+        )
+        self.assertEqual(self.storage.list_files(self.prefix + "/"), [])
+        parts = [
+            path
+            for path in self.storage.list_files("bronze/crawler/compacted/")
+            if path.endswith(".json.gz")
+        ]
+        self.assertEqual(len(parts), 1)
+        self.assertEqual(len(self.read_part(parts[0])), 10)
+
+    @unittest.skipUnless(pq, "pyarrow is not installed")
+    def test_compact_parquet_files_of_author_tasks(self):
+        """Test that the small Parquet files of author tasks are merged into one"""
+        for author in ("alice", "bob", "carol"):
+            sink = PostSinkFactory.get_sink(
+                "parquet", self.storage, "reddit", author, "1745962981.927765"
+            )
+            for i in range(2):
+                sink.write(
+                    Post(
+                        id=f"{author}-{i}",
+                        author_id=author,
+                        text=f"Post {i}",
+                        timestamp=datetime(2025, 4, 1 + i).isoformat(),
+                        likes=i,
+                        reposts=0,
+                        comments=0,
+                        media_urls=[],
+                        media_local_paths=[],
+                    )
+                )
+            sink.close()
+        prefix = (
+            "bronze/crawler/parquet/user_post/platform=reddit/crawl_date=2025-04-29"
+        )
+        self.assertEqual(len(self.storage.list_files(prefix + "/")), 3)
+
+        stats = compact_prefix(self.storage, prefix)
+
+        self.assertEqual(stats["parts"], 1)
+        self.assertEqual(stats["records"], 6)
+        self.assertEqual(stats["archived"], 3)
+        self.assertEqual(self.storage.list_files(prefix + "/"), [])
+        manifest = self.storage.read_json(
+            "bronze/crawler/compacted/parquet/user_post/platform=reddit/"
+            "crawl_date=2025-04-29/_manifest.json"
+        )
+        table = pq.read_table(self.storage.local_path(manifest["parts"][0]["path"]))
+        self.assertEqual(table.num_rows, 6)
+        self.assertEqual(str(table.schema.field("timestamp").type), "timestamp[us]")
+        self.assertEqual(
+            sorted(table.column("id").to_pylist())[:2], ["alice-0", "alice-1"]
+        )
+
+
+class FakeS3Client:
+    """In-memory stand-in for the multipart API of a boto3 S3 client"""
+
+    def __init__(self):
+        self.uploads = {}
+        self.objects = {}
+        self.uploaded_parts = []
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = f"upload-{len(self.uploads)}"
+        self.uploads[upload_id] = {"Key": Key, "Parts": {}}
+        return {"UploadId": upload_id}
+
+    def list_multipart_uploads(self, Bucket, Prefix, **kwargs):
+        return {
+            "Uploads": [
+                {"Key": upload["Key"], "UploadId": upload_id, "Initiated": upload_id}
+                for upload_id, upload in self.uploads.items()
+                if upload["Key"].startswith(Prefix)
+            ]
+        }
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        parts = self.uploads[UploadId]["Parts"]
+        return {
+            "Parts": [
+                {
+                    "PartNumber": number,
+                    "ETag": f'"{hashlib.md5(body).hexdigest()}"',
+                    "Size": len(body),
+                }
+                for number, body in parts.items()
+            ]
+        }
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.uploaded_parts.append(PartNumber)
+        self.uploads[UploadId]["Parts"][PartNumber] = Body
+        return {"ETag": f'"{hashlib.md5(Body).hexdigest()}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)["Parts"]
+        self.objects[Key] = b"".join(
+            parts[part["PartNumber"]] for part in MultipartUpload["Parts"]
+        )
+
+
+class TestMultipartUploader(unittest.TestCase):
+    """Test resumable multipart uploads"""
+
+    def setUp(self):
+        """Create a file of three parts"""
+        self.part_size = 5 * 1024 * 1024
+        self.content = os.urandom(2 * self.part_size + 1000)
+        temp_file = tempfile.NamedTemporaryFile(delete=False)
+        temp_file.write(self.content)
+        temp_file.close()
+        self.filepath = temp_file.name
+        self.addCleanup(os.unlink, self.filepath)
+
+        self.client = FakeS3Client()
+        self.uploader = MultipartUploader(
+            self.client, "bucket", part_size=self.part_size, max_workers=3
+        )
+
+    def test_upload(self):
+        """Test uploading a file in concurrent parts"""
+        self.uploader.upload(self.filepath, "media/video.mp4")
+
+        self.assertEqual(sorted(self.client.uploaded_parts), [1, 2, 3])
+        self.assertEqual(self.client.objects["media/video.mp4"], self.content)
+
+    def test_resumes_interrupted_upload(self):
+        """Test that only the parts missing from an interrupted upload are sent"""
+        upload_id = self.client.create_multipart_upload(
+            Bucket="bucket", Key="media/video.mp4", ContentType="video/mp4"
+        )["UploadId"]
+        self.client.upload_part(
+            Bucket="bucket",
+            Key="media/video.mp4",
+            UploadId=upload_id,
+            PartNumber=1,
+            Body=self.content[: self.part_size],
+        )
+        self.client.uploaded_parts = []
+
+        self.uploader.upload(self.filepath, "media/video.mp4")
+
+        self.assertEqual(sorted(self.client.uploaded_parts), [2, 3])
+        self.assertEqual(self.client.objects["media/video.mp4"], self.content)
+
 
 class TestStorageFactory(unittest.TestCase):
     """Test the storage factory"""
@@ -3,18 +3,42 @@
 Test script for Celery tasks
 """
 
+import gzip
 import os
+import shutil
 import sys
+import tempfile
 import unittest
 from datetime import datetime
-from unittest.mock import MagicMock, patch
+from unittest.mock import ANY, MagicMock, patch
 
 # Add the app directory to the path
 sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
 
 from app.core.logger import logger
 from app.models import Author, Post
-from app.workers.tasks import crawl_reddit_author, crawl_reddit_users_from_yaml
+from app.storage.local_storage import LocalStorage
+from app.storage.run_manifest import RunManifest
+from app.utils.throttling import ThrottleDeferred
+from app.workers.tasks import (
+    crawl_reddit_author,
+    crawl_reddit_users_from_yaml,
+    finalize_crawl_run,
+)
+from celery.exceptions import Retry
+
+
+def delegate_bulk_uploads(mock_storage):
+    """Make the bulk uploads of a mocked storage go through its single uploads"""
+
+    def run_many(upload):
+        return lambda items: [
+            {"path": path, "ok": True, "result": upload(source, path), "error": None}
+            for source, path in items
+        ]
+
+    mock_storage.upload_json_many.side_effect = run_many(mock_storage.upload_json)
+    mock_storage.upload_many.side_effect = run_many(mock_storage.upload_file)
 
 
 class TestCeleryTasks(unittest.TestCase):
@@ -36,6 +60,16 @@ class TestCeleryTasks(unittest.TestCase):
             following_count=50,
         )
 
+        # Media files of the mock posts
+        media_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_dir, ignore_errors=True)
+        media_paths = []
+        for name in ("image1.jpg", "image2.jpg"):
+            media_path = os.path.join(media_dir, name)
+            with open(media_path, "wb") as f:
+                f.write(name.encode())
+            media_paths.append(media_path)
+
         # Mock posts
         self.mock_posts = [
             Post(
@@ -46,7 +80,7 @@ class TestCeleryTasks(unittest.TestCase):
                 reposts=5,
                 comments=3,
                 media_urls=["http://example.com/image1.jpg"],
-                media_local_paths=["/tmp/image1.jpg"],
+                media_local_paths=[media_paths[0]],
             ),
             Post(
                 author_id=self.author_id,
@@ -56,7 +90,7 @@ class TestCeleryTasks(unittest.TestCase):
                 reposts=10,
                 comments=6,
                 media_urls=["http://example.com/image2.jpg"],
-                media_local_paths=["/tmp/image2.jpg"],
+                media_local_paths=[media_paths[1]],
             ),
         ]
 
@@ -67,21 +101,31 @@ class TestCeleryTasks(unittest.TestCase):
         # Set up mocks
         mock_scraper_instance = mock_reddit_scraper.return_value
         mock_scraper_instance.fetch_author.return_value = self.mock_author
-        mock_scraper_instance.fetch_posts.return_value = self.mock_posts
+        mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
 
         mock_storage = mock_storage_factory.return_value
+        delegate_bulk_uploads(mock_storage)
+        mock_storage.read_json.side_effect = FileNotFoundError
+        mock_storage.exists.return_value = False
 
         # Call the task
         result = crawl_reddit_author(self.author_id, self.since, self.until, "local")
 
         # Check that the scraper was called correctly
         mock_scraper_instance.fetch_author.assert_called_once_with(self.author_id)
-        mock_scraper_instance.fetch_posts.assert_called_once_with(
-            self.author_id, self.since, self.until
+        mock_scraper_instance.iter_posts.assert_called_once_with(
+            self.author_id,
+            self.since,
+            self.until,
+            after=None,
+            watermark=None,
+            on_dropped=ANY,
+            skip_media=ANY,
         )
 
         # Check that the storage was called correctly
-        self.assertEqual(mock_storage.upload_json.call_count, 3)  # 1 author + 2 posts
+        # 1 author + 2 posts + 1 run manifest + 1 content hashes
+        self.assertEqual(mock_storage.upload_json.call_count, 5)
         self.assertEqual(mock_storage.upload_file.call_count, 2)  # 2 media files
 
         # Check the result
@@ -89,6 +133,434 @@ class TestCeleryTasks(unittest.TestCase):
         self.assertEqual(result["posts_count"], 2)
         self.assertEqual(result["media_count"], 2)
 
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_persists_incrementally(
+        self, mock_storage_factory, mock_reddit_scraper
+    ):
+        """Test that posts are stored before a later failure in the crawl"""
+
+        def failing_posts():
+            yield self.mock_posts[0]
+            raise RuntimeError("connection lost")
+
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.return_value = failing_posts()
+
+        mock_storage = mock_storage_factory.return_value
+        delegate_bulk_uploads(mock_storage)
+        mock_storage.read_json.side_effect = FileNotFoundError
+
+        with self.assertRaises(RuntimeError):
+            crawl_reddit_author(self.author_id, self.since, self.until, "local")
+
+        # The author and the first post were stored before the failure
+        self.assertEqual(mock_storage.upload_json.call_count, 2)
+
+    @patch("app.workers.tasks.crawl_reddit_author.apply_async")
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_defers_when_throttled(
+        self, mock_storage_factory, mock_reddit_scraper, mock_apply_async
+    ):
+        """Test that a throttled crawl re-enqueues itself from a checkpoint"""
+
+        def throttled_posts():
+            yield self.mock_posts[0]
+            raise ThrottleDeferred(42.5)
+
+        self.mock_posts[0].id = "t3_first"
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.return_value = throttled_posts()
+        mock_storage = mock_storage_factory.return_value
+        delegate_bulk_uploads(mock_storage)
+        mock_storage.read_json.side_effect = FileNotFoundError
+
+        result = crawl_reddit_author(
+            self.author_id, self.since, self.until, "1700000000.0", "local"
+        )
+
+        self.assertTrue(result["deferred"])
+        self.assertEqual(result["posts_count"], 1)
+
+        _, kwargs = mock_apply_async.call_args
+        self.assertEqual(kwargs["countdown"], 43)
+        self.assertEqual(
+            kwargs["args"],
+            (self.author_id, self.since, self.until, "1700000000.0", "local"),
+        )
+        checkpoint = kwargs["kwargs"]["checkpoint"]
+        self.assertTrue(checkpoint["author_stored"])
+        self.assertEqual(checkpoint["after"], "t3_first")
+
+        # Resuming skips the author and continues after the checkpoint
+        mock_scraper_instance.iter_posts.return_value = iter([])
+        result = crawl_reddit_author(
+            self.author_id,
+            self.since,
+            self.until,
+            "1700000000.0",
+            "local",
+            checkpoint=checkpoint,
+        )
+
+        mock_scraper_instance.fetch_author.assert_called_once()
+        mock_scraper_instance.iter_posts.assert_called_with(
+            self.author_id,
+            self.since,
+            self.until,
+            after="t3_first",
+            watermark=None,
+            on_dropped=ANY,
+            skip_media=ANY,
+        )
+        self.assertEqual(result["posts_count"], 1)
+
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_uploads_shared_media_once(
+        self, mock_storage_factory, mock_reddit_scraper
+    ):
+        """Test that media shared by several posts is uploaded once"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            media_path = os.path.join(temp_dir, "0123abcd.jpg")
+            with open(media_path, "wb") as f:
+                f.write(b"image")
+            for post in self.mock_posts:
+                post.media_local_paths = [media_path]
+
+            mock_scraper_instance = mock_reddit_scraper.return_value
+            mock_scraper_instance.fetch_author.return_value = self.mock_author
+            mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
+
+            uploaded = set()
+            mock_storage = mock_storage_factory.return_value
+            delegate_bulk_uploads(mock_storage)
+            mock_storage.read_json.side_effect = FileNotFoundError
+            mock_storage.exists.side_effect = lambda path: path in uploaded
+            mock_storage.upload_file.side_effect = lambda src, dst: uploaded.add(dst)
+
+            crawl_reddit_author(self.author_id, self.since, self.until, "local")
+
+        mock_storage.upload_file.assert_called_once_with(
+            media_path, "bronze/crawler/media/sha256/0123abcd.jpg"
+        )
+        post_data = mock_storage.upload_json.call_args_list[2][0][0]
+        self.assertEqual(
+            post_data["media_object_names"],
+            ["bronze/crawler/media/sha256/0123abcd.jpg"],
+        )
+
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_uses_watermark(
+        self, mock_storage_factory, mock_reddit_scraper
+    ):
+        """Test that incremental crawls stop at and advance the author's watermark"""
+        watermark = {"fullname": "t3_old", "created_utc": 1700000000.0}
+        self.mock_posts[0].id = "t3_newest"
+
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
+
+        mock_storage = mock_storage_factory.return_value
+        delegate_bulk_uploads(mock_storage)
+        mock_storage.read_json.return_value = watermark
+
+        crawl_reddit_author(
+            self.author_id, self.since, self.until, "1700000000.0", "local"
+        )
+
+        _, kwargs = mock_scraper_instance.iter_posts.call_args
+        self.assertEqual(kwargs["watermark"], watermark)
+
+        data, path = mock_storage.upload_json.call_args[0]
+        self.assertEqual(path, "bronze/crawler/state/watermarks/reddit/test_user.json")
+        self.assertEqual(data["fullname"], "t3_newest")
+
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_keeps_watermark_before_dropped_posts(
+        self, mock_storage_factory, mock_reddit_scraper
+    ):
+        """Test that the watermark doesn't advance past a submission that was dropped"""
+        self.mock_posts[0].id = "t3_newest"
+        self.mock_posts[1].id = "t3_older"
+
+        def posts_with_drop(*args, on_dropped=None, **kwargs):
+            yield self.mock_posts[0]
+            on_dropped({"name": "t3_dropped", "created_utc": 1700000500.0})
+            yield self.mock_posts[1]
+
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.side_effect = posts_with_drop
+
+        mock_storage = mock_storage_factory.return_value
+        delegate_bulk_uploads(mock_storage)
+        mock_storage.read_json.side_effect = FileNotFoundError
+        mock_storage.exists.return_value = False
+
+        crawl_reddit_author(
+            self.author_id, self.since, self.until, "1700000000.0", "local"
+        )
+
+        data, path = mock_storage.upload_json.call_args[0]
+        self.assertEqual(path, "bronze/crawler/state/watermarks/reddit/test_user.json")
+        self.assertEqual(data["fullname"], "t3_older")
+
+    @patch("app.workers.tasks.media_downloader")
+    @patch("app.workers.tasks.settings.MEDIA_UPLOAD_MODE", "stream")
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_streams_media(
+        self, mock_storage_factory, mock_reddit_scraper, mock_media_downloader
+    ):
+        """Test that media is streamed into storage in stream mode"""
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
+        mock_media_downloader.stream_multiple.return_value = [
+            "bronze/crawler/media/sha256/0123abcd.jpg"
+        ]
+
+        mock_storage = mock_storage_factory.return_value
+        delegate_bulk_uploads(mock_storage)
+        mock_storage.read_json.side_effect = FileNotFoundError
+
+        result = crawl_reddit_author(self.author_id, self.since, self.until, "local")
+
+        urls, task_storage = mock_media_downloader.stream_multiple.call_args_list[0][0]
+        self.assertEqual(urls, ["http://example.com/image1.jpg"])
+        # Streamed through the run manifest's view of the storage
+        self.assertIs(task_storage.storage, mock_storage)
+        mock_storage.upload_file.assert_not_called()
+        post_data = mock_storage.upload_json.call_args_list[1][0][0]
+        self.assertEqual(
+            post_data["media_object_names"],
+            ["bronze/crawler/media/sha256/0123abcd.jpg"],
+        )
+        self.assertEqual(result["media_count"], 2)
+
+    @patch("app.workers.tasks.settings.POST_SINK", "ndjson")
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_batches_posts(
+        self, mock_storage_factory, mock_reddit_scraper
+    ):
+        """Test that the ndjson sink writes all posts of a crawl in one batch"""
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
+
+        mock_storage = mock_storage_factory.return_value
+        delegate_bulk_uploads(mock_storage)
+        mock_storage.read_json.side_effect = FileNotFoundError
+        mock_storage.exists.return_value = False
+
+        result = crawl_reddit_author(
+            self.author_id, self.since, self.until, "1700000000.0"
+        )
+
+        # Only the author, the run manifest and the content hashes are JSON
+        # objects, the posts go out as a single batch
+        self.assertEqual(mock_storage.upload_json.call_count, 3)
+        mock_storage.upload_bytes.assert_called_once()
+        data, path = mock_storage.upload_bytes.call_args[0]
+        self.assertTrue(
+            path.startswith(
+                "bronze/crawler/metadata/user_post/1700000000.0/reddit/test_user/"
+            )
+        )
+        self.assertEqual(len(gzip.decompress(data).splitlines()), 2)
+        self.assertEqual(result["posts_count"], 2)
+
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_writes_manifest(
+        self, mock_storage_factory, mock_reddit_scraper
+    ):
+        """Test that a completed crawl writes the manifest of its objects"""
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = LocalStorage(base_dir=temp_dir)
+            mock_storage_factory.return_value = storage
+            for post in self.mock_posts:
+                post.media_local_paths = []
+
+            result = crawl_reddit_author(
+                self.author_id, self.since, self.until, "1700000000.0", "local"
+            )
+            manifest = storage.read_json(result["manifest_path"])
+
+        self.assertEqual(
+            result["manifest_path"],
+            "bronze/crawler/manifests/run=1700000000.0/authors/reddit/test_user.json",
+        )
+        self.assertEqual(manifest["object_count"], 3)
+        self.assertEqual(manifest["record_count"], 3)
+        self.assertEqual(manifest["posts_count"], 2)
+        self.assertTrue(all(entry["size"] > 0 for entry in manifest["objects"]))
+
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_crawl_reddit_author_skips_unchanged_posts(
+        self, mock_storage_factory, mock_reddit_scraper
+    ):
+        """Test that a recrawl only writes the posts that changed"""
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        for i, post in enumerate(self.mock_posts):
+            post.id = f"t3_post{i}"
+            post.media_local_paths = []
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = LocalStorage(base_dir=temp_dir)
+            mock_storage_factory.return_value = storage
+
+            mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
+            crawl_reddit_author(
+                self.author_id,
+                self.since,
+                self.until,
+                "1700000000.0",
+                "local",
+                incremental=False,
+            )
+
+            self.mock_posts[1].likes += 1
+            mock_scraper_instance.iter_posts.return_value = iter(self.mock_posts)
+            result = crawl_reddit_author(
+                self.author_id,
+                self.since,
+                self.until,
+                "1700000001.0",
+                "local",
+                incremental=False,
+            )
+            written = storage.list_files("bronze/crawler/metadata/")
+
+            # The scraper is told not to download the media of unchanged posts
+            _, kwargs = mock_scraper_instance.iter_posts.call_args
+            self.assertTrue(kwargs["skip_media"](self.mock_posts[0]))
+            self.mock_posts[0].likes += 1
+            self.assertFalse(kwargs["skip_media"](self.mock_posts[0]))
+
+        self.assertEqual(result["posts_count"], 1)
+        self.assertEqual(result["unchanged_count"], 1)
+        # The second run only holds the changed post, and not the unchanged author
+        self.assertEqual(
+            [path for path in written if "1700000001.0" in path],
+            [
+                "bronze/crawler/metadata/user_post/1700000001.0/reddit/test_user/"
+                + self.mock_posts[1].timestamp.replace(":", "-")
+                + ".json"
+            ],
+        )
+
+    @patch("app.workers.tasks.crawl_reddit_author.apply_async")
+    @patch("app.workers.tasks.RedditScraper")
+    @patch("app.workers.tasks.StorageFactory.get_storage")
+    def test_deferred_crawl_lists_buffered_posts_in_manifest(
+        self, mock_storage_factory, mock_reddit_scraper, mock_apply_async
+    ):
+        """Test that posts flushed when a crawl defers are listed in its manifest part"""
+
+        def throttled_posts():
+            yield from self.mock_posts
+            raise ThrottleDeferred(10)
+
+        mock_scraper_instance = mock_reddit_scraper.return_value
+        mock_scraper_instance.fetch_author.return_value = self.mock_author
+        mock_scraper_instance.iter_posts.return_value = throttled_posts()
+        for i, post in enumerate(self.mock_posts):
+            post.id = f"t3_post{i}"
+            post.media_local_paths = []
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = LocalStorage(base_dir=temp_dir)
+            mock_storage_factory.return_value = storage
+
+            result = crawl_reddit_author(
+                self.author_id, self.since, self.until, "1700000000.0", "local"
+            )
+            stored = storage.list_files("bronze/crawler/metadata/")
+            checkpoint = mock_apply_async.call_args[1]["kwargs"]["checkpoint"]
+            part = storage.read_json(checkpoint["manifest_parts"][0])
+
+        self.assertTrue(result["deferred"])
+        # 1 author + 2 posts, including any still buffered when the crawl deferred
+        self.assertEqual(len(stored), 3)
+        self.assertEqual(sorted(entry["path"] for entry in part["objects"]), stored)
+
+    def test_run_manifests_sharing_a_storage_record_their_own_writes(self):
+        """Test that concurrent crawls on one storage don't record each other's writes"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = LocalStorage(base_dir=temp_dir)
+            first = RunManifest(storage, "1700000000.0", "reddit", "first")
+            second = RunManifest(storage, "1700000000.0", "reddit", "second")
+
+            first.recorded_storage.upload_json({"id": "first"}, "data/first.json")
+            second.recorded_storage.upload_bytes(b"second", "data/second.bin")
+            storage.upload_json({"id": "other"}, "data/other.json")
+
+            self.assertEqual(
+                [entry["path"] for entry in first.entries()], ["data/first.json"]
+            )
+            self.assertEqual(
+                second.entries(),
+                [{"path": "data/second.bin", "size": 6, "records": None}],
+            )
+            self.assertEqual(getattr(storage, "_write_listeners", []), [])
+
+    def test_finalize_crawl_run_waits_for_authors(self):
+        """Test that a run is only marked successful once every author is done"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            storage = LocalStorage(base_dir=temp_dir)
+            with patch(
+                "app.workers.tasks.StorageFactory.get_storage", return_value=storage
+            ):
+                manifest = RunManifest(storage, "1700000000.0", "reddit", "first")
+                manifest.recorded_storage.upload_json(
+                    {"id": "first"}, "data/first.json"
+                )
+                manifest.write()
+
+                with self.assertRaises(Retry):
+                    finalize_crawl_run("1700000000.0", ["first", "second"], "local")
+                self.assertFalse(
+                    storage.exists("bronze/crawler/manifests/run=1700000000.0/_SUCCESS")
+                )
+
+                manifest = RunManifest(storage, "1700000000.0", "reddit", "second")
+                manifest.recorded_storage.upload_json(
+                    {"id": "second"}, "data/second.json"
+                )
+                manifest.write()
+
+                result = finalize_crawl_run(
+                    "1700000000.0", ["first", "second"], "local"
+                )
+                run_manifest = storage.read_json(
+                    "bronze/crawler/manifests/run=1700000000.0/manifest.json"
+                )
+
+                self.assertTrue(result["complete"])
+                self.assertEqual(
+                    [entry["path"] for entry in run_manifest["objects"]],
+                    ["data/first.json", "data/second.json"],
+                )
+                self.assertTrue(
+                    storage.exists("bronze/crawler/manifests/run=1700000000.0/_SUCCESS")
+                )
+
+
 def main():
     """Run the tests"""
     unittest.main()
@@ -0,0 +1,522 @@
+#!/usr/bin/env python3
+"""
+Test script for utilities
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import MagicMock, patch
+
+# Add the app directory to the path
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+from app.storage.key_layout import key_layout
+from app.storage.local_storage import LocalStorage
+from app.utils.error_handler import ScraperException, retry_with_backoff
+from app.utils.media_downloader import MediaDownloader
+from app.utils.media_spool import MediaSpool
+from app.utils.throttling import (
+    RateLimiter,
+    ThrottleDeferred,
+    allow_deferral,
+    throttle_sleep,
+)
+from app.utils.token_bucket import (
+    MemoryTokenBucketBackend,
+    SQLiteTokenBucketBackend,
+    TokenBucket,
+)
+
+
+class TestRateLimiter(unittest.TestCase):
+    """Test the header-driven rate limiter"""
+
+    def test_no_delay_without_budget_info(self):
+        """Test that requests go out immediately when no budget is known"""
+        limiter = RateLimiter(min_remaining=5)
+        self.assertEqual(limiter.get_delay(), 0)
+
+    def test_no_delay_while_budget_lasts(self):
+        """Test that requests go out immediately while the budget lasts"""
+        limiter = RateLimiter(min_remaining=5)
+        limiter.update_from_headers(
+            {
+                "X-Ratelimit-Remaining": "42.0",
+                "X-Ratelimit-Used": "58",
+                "X-Ratelimit-Reset": "300",
+            }
+        )
+
+        self.assertEqual(limiter.get_delay(), 0)
+        self.assertEqual(limiter.used, 58)
+
+    def test_waits_for_reset_when_budget_is_low(self):
+        """Test that the limiter waits for the window reset once the budget runs low"""
+        limiter = RateLimiter(min_remaining=5)
+        limiter.update_from_headers(
+            {"X-Ratelimit-Remaining": "3", "X-Ratelimit-Reset": "120"}
+        )
+
+        delay = limiter.get_delay()
+        self.assertGreater(delay, 119)
+        self.assertLessEqual(delay, 120)
+
+        with patch("app.utils.throttling.time.sleep") as mock_sleep:
+            limiter.wait()
+        mock_sleep.assert_called_once()
+        self.assertEqual(limiter.remaining, 2)
+
+    def test_min_interval(self):
+        """Test the minimum interval between requests"""
+        limiter = RateLimiter(min_interval=10)
+        limiter.wait()
+
+        self.assertGreater(limiter.get_delay(), 9)
+
+    def test_malformed_headers_are_ignored(self):
+        """Test that malformed headers don't break the limiter"""
+        limiter = RateLimiter()
+        limiter.update_from_headers({"X-Ratelimit-Remaining": "soon"})
+
+        self.assertIsNone(limiter.remaining)
+
+
+class TestThrottleSleep(unittest.TestCase):
+    """Test deferrable throttling waits"""
+
+    @patch("app.utils.throttling.time.sleep")
+    def test_sleeps_outside_deferral(self, mock_sleep):
+        """Test that waits sleep when deferral isn't allowed"""
+        throttle_sleep(60)
+        mock_sleep.assert_called_once_with(60)
+
+    @patch("app.utils.throttling.time.sleep")
+    def test_long_waits_are_deferred(self, mock_sleep):
+        """Test that long waits raise ThrottleDeferred within allow_deferral"""
+        with allow_deferral():
+            with self.assertRaises(ThrottleDeferred) as context:
+                throttle_sleep(60)
+            # Short waits still sleep in place
+            throttle_sleep(0.5)
+
+        self.assertEqual(context.exception.delay, 60)
+        mock_sleep.assert_called_once_with(0.5)
+
+    @patch("app.utils.error_handler.time.sleep")
+    def test_retry_backoff_is_never_deferred(self, mock_sleep):
+        """Test that failing calls run out of retries instead of being deferred"""
+        calls = []
+
+        @retry_with_backoff(
+            max_retries=2, base_delay=30, exceptions=(ScraperException,)
+        )
+        def fetch():
+            calls.append(1)
+            raise ScraperException("HTTP Error 404")
+
+        with allow_deferral():
+            with self.assertRaises(ScraperException):
+                fetch()
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+
+class TestTokenBucket(unittest.TestCase):
+    """Test the shared token bucket"""
+
+    def setUp(self):
+        """Set up the test environment"""
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Clean up after tests"""
+        shutil.rmtree(self.temp_dir)
+
+    def test_memory_backend_burst_then_wait(self):
+        """Test that a bucket allows a burst and then asks to wait"""
+        bucket = TokenBucket(MemoryTokenBucketBackend(), rate=2, capacity=3)
+
+        for _ in range(3):
+            self.assertEqual(bucket.get_delay("client:host"), 0)
+
+        delay = bucket.get_delay("client:host")
+        self.assertGreater(delay, 0)
+        self.assertLessEqual(delay, 0.5)
+
+        # Buckets are independent per key
+        self.assertEqual(bucket.get_delay("client:other_host"), 0)
+
+    def test_sqlite_backend_is_shared(self):
+        """Test that SQLite buckets are shared between backend instances"""
+        path = os.path.join(self.temp_dir, "budget.sqlite")
+        first = TokenBucket(SQLiteTokenBucketBackend(path), rate=0.01, capacity=2)
+        second = TokenBucket(SQLiteTokenBucketBackend(path), rate=0.01, capacity=2)
+
+        self.assertEqual(first.get_delay("client:host"), 0)
+        self.assertEqual(second.get_delay("client:host"), 0)
+        # The budget was spent by the two instances together
+        self.assertGreater(first.get_delay("client:host"), 0)
+        self.assertGreater(second.get_delay("client:host"), 0)
+
+    def test_acquire_sleeps_until_tokens_are_available(self):
+        """Test that acquire waits for the bucket to refill"""
+        backend = MagicMock()
+        backend.consume.side_effect = [0.5, 0]
+        bucket = TokenBucket(backend, rate=2, capacity=1)
+
+        with patch("app.utils.token_bucket.time.sleep") as mock_sleep:
+            bucket.acquire("client:host")
+
+        mock_sleep.assert_called_once_with(0.5)
+        self.assertEqual(backend.consume.call_count, 2)
+
+
+VIDEO = bytes(range(256)) * 1024
+
+
+class FakeMediaHandler(BaseHTTPRequestHandler):
+    """Serve the request path as an image body, slowly, and 404 for /missing"""
+
+    def send_video(self):
+        """Serve VIDEO with Range support, cutting the first response short"""
+        range_header = self.headers.get("Range")
+        if range_header and self.headers.get("If-Range") == '"v1"':
+            start = int(range_header[len("bytes=") :].rstrip("-"))
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{len(VIDEO) - 1}/{len(VIDEO)}"
+            )
+            self.send_header("Content-Length", str(len(VIDEO) - start))
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            self.wfile.write(VIDEO[start:])
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(len(VIDEO)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        # Drop the connection halfway through the first download
+        self.wfile.write(VIDEO[: len(VIDEO) // 2])
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.requests.append(self.path)
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(
+                self.server.max_in_flight, self.server.in_flight
+            )
+        time.sleep(0.2)
+        with self.server.lock:
+            self.server.in_flight -= 1
+
+        self.server.range_headers.append(self.headers.get("Range"))
+        if self.path.startswith("/video"):
+            self.send_video()
+            return
+
+        if self.path.startswith("/page"):
+            payload = b"<html></html>" * 1000
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        if self.path.startswith("/missing"):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        # Every /same... URL serves identical content
+        payload = b"same" if self.path.startswith("/same") else self.path.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestMediaDownloader(unittest.TestCase):
+    """Test the media downloader"""
+
+    def setUp(self):
+        """Start a fake media server"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeMediaHandler)
+        self.server.lock = threading.Lock()
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.server.requests = []
+        self.server.range_headers = []
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        patcher = patch("app.utils.media_downloader.media_rate_limiter")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        host, port = self.server.server_address
+        self.base_url = f"http://{host}:{port}"
+
+    def tearDown(self):
+        """Clean up after tests"""
+        shutil.rmtree(self.temp_dir)
+
+    def test_download_multiple_keeps_order(self):
+        """Test concurrent downloads keep input order and skip failures"""
+        downloader = MediaDownloader(self.temp_dir, max_workers=8, per_host_limit=2)
+        urls = [f"{self.base_url}/image{i}" for i in range(6)]
+        urls.insert(3, f"{self.base_url}/missing")
+
+        paths = downloader.download_multiple(urls)
+
+        self.assertEqual(len(paths), 6)
+        for i, path in enumerate(paths):
+            with open(path) as f:
+                self.assertEqual(f.read(), f"/image{i}")
+        # Downloads ran concurrently, within the per-host limit
+        self.assertGreater(self.server.max_in_flight, 1)
+        self.assertLessEqual(self.server.max_in_flight, 2)
+        # The locks of finished downloads are dropped
+        self.assertEqual(downloader._url_locks, {})
+
+    def test_content_addressed_downloads(self):
+        """Test that media is stored by content digest and known URLs are skipped"""
+        downloader = MediaDownloader(self.temp_dir)
+
+        first = downloader.download_media(f"{self.base_url}/same/a.png")
+        second = downloader.download_media(f"{self.base_url}/same/b.png")
+
+        # Identical content from different URLs is stored once
+        self.assertEqual(first, second)
+        self.assertEqual(
+            os.path.basename(first),
+            "0967115f2813a3541eaef77de9d9d5773f1c0c04314b0bbfe4ff3b3b1c55b5d5.png",
+        )
+
+        # A known URL is not downloaded again
+        self.assertEqual(
+            downloader.download_media(f"{self.base_url}/same/a.png"), first
+        )
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_known_media_in_storage_is_not_downloaded_again(self):
+        """Test that known media evicted from disk is skipped once it is in storage"""
+        downloader = MediaDownloader(os.path.join(self.temp_dir, "downloads"))
+        storage = LocalStorage(os.path.join(self.temp_dir, "storage"))
+        url = f"{self.base_url}/image.png"
+
+        path = downloader.download_media(url)
+        storage.upload_file(path, key_layout.media_key(os.path.basename(path)))
+        # The spool evicts the file once it is uploaded
+        os.remove(path)
+
+        self.assertEqual(downloader.download_media(url, storage), path)
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertFalse(os.path.exists(path))
+
+        # Without the storage, the file has to be downloaded again
+        self.assertEqual(downloader.download_media(url), path)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_downloaders_sharing_a_directory_download_once(self):
+        """Test that downloaders of separate workers don't share a partial file"""
+        downloaders = [MediaDownloader(self.temp_dir) for _ in range(2)]
+        url = f"{self.base_url}/image.png"
+        paths = [None, None]
+
+        def download(i):
+            paths[i] = downloaders[i].download_media(url)
+
+        threads = [threading.Thread(target=download, args=(i,)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The second downloader waited for the first and found its file
+        self.assertEqual(paths[0], paths[1])
+        with open(paths[0], "rb") as f:
+            self.assertEqual(f.read(), b"/image.png")
+        self.assertEqual(self.server.requests, ["/image.png"])
+        self.assertEqual(
+            [name for name in os.listdir(self.temp_dir) if name.startswith(".")], []
+        )
+
+    def test_interrupted_download_resumes(self):
+        """Test that an interrupted download resumes with a Range request"""
+        downloader = MediaDownloader(self.temp_dir, max_retries=0)
+        url = f"{self.base_url}/video/720.mp4"
+
+        # The connection drops halfway, the partial file is kept
+        self.assertIsNone(downloader.download_media(url))
+        part_path, state_path = downloader._get_part_paths(url)
+        received = os.path.getsize(part_path)
+        self.assertGreater(received, 0)
+
+        # A later run only fetches the missing bytes
+        path = downloader.download_media(url)
+
+        self.assertEqual(self.server.range_headers[-1], f"bytes={received}-")
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), VIDEO)
+        self.assertTrue(path.endswith(".mp4"))
+        self.assertFalse(os.path.exists(part_path))
+        self.assertFalse(os.path.exists(state_path))
+
+    def test_rejects_unwanted_media(self):
+        """Test that disallowed content types and oversized media are skipped"""
+        downloader = MediaDownloader(self.temp_dir, max_bytes=1000)
+
+        self.assertIsNone(downloader.download_media(f"{self.base_url}/page.html"))
+        self.assertIsNone(downloader.download_media(f"{self.base_url}/video/1080.mp4"))
+        # Rejected media is not retried
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(
+            [name for name in os.listdir(self.temp_dir) if name.endswith(".part")], []
+        )
+
+    def test_stream_media_to_storage(self):
+        """Test that media is streamed into storage by content digest"""
+        downloader = MediaDownloader(os.path.join(self.temp_dir, "downloads"))
+        storage = LocalStorage(os.path.join(self.temp_dir, "storage"))
+
+        object_names = downloader.stream_multiple(
+            [
+                f"{self.base_url}/same/a.png",
+                f"{self.base_url}/missing.png",
+                f"{self.base_url}/same/b.png",
+            ],
+            storage,
+        )
+
+        expected = (
+            "bronze/crawler/media/sha256/"
+            "0967115f2813a3541eaef77de9d9d5773f1c0c04314b0bbfe4ff3b3b1c55b5d5.png"
+        )
+        self.assertEqual(object_names, [expected, expected])
+        # Only the content-addressed object is left, nothing went to local disk
+        self.assertEqual(storage.list_files("bronze"), [expected])
+        self.assertEqual(
+            [
+                name
+                for name in os.listdir(os.path.join(self.temp_dir, "downloads"))
+                if not name.endswith(".sqlite")
+            ],
+            [],
+        )
+
+        # A known URL already in storage is not downloaded again
+        requests_made = len(self.server.requests)
+        self.assertEqual(
+            downloader.stream_media(f"{self.base_url}/same/a.png", storage), expected
+        )
+        self.assertEqual(len(self.server.requests), requests_made)
+
+
+class TestMediaSpool(unittest.TestCase):
+    """Test the media spool"""
+
+    def setUp(self):
+        """Set up a spool directory"""
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def write_blob(self, spool, name, size=100):
+        """Write a media file to the spool and track it"""
+        path = os.path.join(self.temp_dir, f"{name * 64}.jpg")
+        with open(path, "wb") as f:
+            f.write(b"x" * size)
+        spool.add(path, size)
+        return path
+
+    def test_evicts_least_recently_used_uploaded_files(self):
+        """Test that only uploaded, unpinned files are evicted, oldest first"""
+        spool = MediaSpool(self.temp_dir, quota_bytes=300)
+        touched = self.write_blob(spool, "a")
+        pinned = self.write_blob(spool, "b")
+        least_recent = self.write_blob(spool, "c")
+        for path in (touched, pinned, least_recent):
+            spool.mark_uploaded(path)
+        spool.touch(touched)
+
+        with spool.pinned(pinned):
+            not_uploaded = self.write_blob(spool, "d")
+
+        # 'b' is older but pinned, so 'c' goes to bring the spool back to its quota
+        self.assertFalse(os.path.exists(least_recent))
+        for path in (touched, pinned, not_uploaded):
+            self.assertTrue(os.path.exists(path))
+        self.assertEqual(spool.usage(), 300)
+
+    def test_pins_are_shared_by_spools(self):
+        """Test that a pin taken through one spool protects the file from another"""
+        spool = MediaSpool(self.temp_dir, quota_bytes=100)
+        other_worker = MediaSpool(self.temp_dir, quota_bytes=100)
+        pinned = self.write_blob(spool, "a")
+        spool.mark_uploaded(pinned)
+
+        with spool.pinned(pinned):
+            self.assertTrue(other_worker.is_pinned(pinned))
+            self.write_blob(other_worker, "b")
+            self.assertTrue(os.path.exists(pinned))
+        self.assertFalse(other_worker.is_pinned(pinned))
+
+        # Pins of a worker that died before releasing them expire
+        expiring = MediaSpool(self.temp_dir, quota_bytes=100, pin_ttl=0)
+        expiring.pin(pinned)
+        self.assertFalse(other_worker.is_pinned(pinned))
+
+    def test_ages_out_files_never_uploaded(self):
+        """Test that files left un-uploaded by a failed task become evictable"""
+        spool = MediaSpool(self.temp_dir, quota_bytes=100, unuploaded_ttl=60)
+        abandoned = self.write_blob(spool, "a")
+        self.write_blob(spool, "b")
+        self.assertTrue(os.path.exists(abandoned))
+
+        with patch("app.utils.media_spool.time.time", return_value=time.time() + 120):
+            spool.enforce_quota()
+
+        self.assertFalse(os.path.exists(abandoned))
+        self.assertEqual(spool.usage(), 100)
+
+    def test_tracks_existing_files(self):
+        """Test that files already on disk are tracked when the spool starts"""
+        with open(os.path.join(self.temp_dir, f"{'e' * 64}.png"), "wb") as f:
+            f.write(b"x" * 500)
+        with open(os.path.join(self.temp_dir, "media_index.sqlite"), "wb") as f:
+            f.write(b"not media")
+
+        spool = MediaSpool(self.temp_dir, quota_bytes=100)
+
+        self.assertEqual(spool.usage(), 500)
+        self.assertEqual(spool.enforce_quota(), 500)
+        self.assertEqual(spool.usage(), 0)
+        self.assertTrue(
+            os.path.exists(os.path.join(self.temp_dir, "media_index.sqlite"))
+        )
+
+
+def main():
+    """Run the tests"""
+    unittest.main()
+
+
+if __name__ == "__main__":
+    main()